@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+bench_bes_writer.py
+
+Latency and peak RSS of AutoPkgBESEngine's two .bes writers, write_tree
+and write_stream, on a synthetic task of about --size-mb megabytes. Most
+of that size is large inline action scripts and a base64 icon. Also
+checks that both writers produce byte-identical files.
+
+Each writer runs in a fresh child process. The peak RSS growth reported
+is measured after the task's input strings have been built, so it is
+the writer's own overhead.
+
+autopkglib comes from an AutoPkg install if there is one, otherwise
+BESFleet's stand-in, so this also runs off a Mac. Tests/test_bes_writer.py
+checks the byte identity on small tasks.
+
+Usage: bench_bes_writer.py [--size-mb N] [--actions N] [--repeat N]
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+import resource
+import subprocess
+import tempfile
+from collections import OrderedDict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir, 'Code'))
+sys.path.insert(0, os.path.join(HERE, os.pardir, 'Code', 'BESHelpers'))
+
+from BESFleet import install_processor_shim
+
+
+def peak_rss():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak *= 1024
+    return peak
+
+
+def make_task(size_mb, action_count):
+    """A deterministic task whose scripts and icon add up to about size_mb."""
+    rng = random.Random(size_mb)
+    size = size_mb * 1024 * 1024
+
+    # A fifth of the size is the icon, the rest is split across the scripts
+    icon = base64.b64encode(rng.randbytes(size // 5 * 3 // 4)).decode()
+    line = 'if {exists file "/tmp/<marker>"}\n    echo "x" >> /tmp/log\nendif\n'
+    per_action = (size - len(icon)) // action_count
+
+    actions = []
+    for number in range(1, action_count + 1):
+        script = (line * (per_action // len(line) + 1))[:per_action]
+        actions.append(({'ActionName': 'DefaultAction' if number == 1 else 'Action',
+                         'ActionNumber': 'Action%d' % number,
+                         'ActionScript': script}, False))
+
+    return {
+        'title': 'Deploy Benchmark 1.0',
+        'description': 'This task will deploy Benchmark 1.0.<BR><BR>',
+        'relevance': ['mac of operating system',
+                      'not exists folder "/Applications/Benchmark.app"'] * 50,
+        'details': OrderedDict((('Category', 'Software Deployment'),
+                                ('DownloadSize', str(size)),
+                                ('Source', 'AutoPkgBESEngine.py'),
+                                ('SourceID', 'bench'),
+                                ('SourceReleaseDate', '2020-01-01'),
+                                ('SourceSeverity', ''),
+                                ('CVENames', ''),
+                                ('SANSID', ''))),
+        'ui_metadata': '{"version": "1.0", "size": "%d", "icon": "%s"}' % (
+            size, 'data:image/png;base64,' + icon),
+        'source': 'AutoPkgBESEngine.py',
+        'mime_fields': [('x-extra', 'value')],
+        'modification_time': 'Wed, 01 Jan 2020 00:00:00 +0000',
+        'actions': actions,
+    }
+
+
+def child(writer, size_mb, action_count, path):
+    install_processor_shim()
+    from AutoPkgBESEngine import AutoPkgBESEngine
+
+    task = make_task(size_mb, action_count)
+    engine = AutoPkgBESEngine({})
+
+    baseline = peak_rss()
+    start = time.perf_counter()
+    fingerprint = getattr(engine, 'write_' + writer)(path, task)
+    elapsed = time.perf_counter() - start
+    growth = peak_rss() - baseline
+
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file_handle:
+        for chunk in iter(lambda: file_handle.read(1024 * 1024), b''):
+            sha256.update(chunk)
+
+    print(json.dumps({'seconds': elapsed, 'rss_growth': growth,
+                      'size': os.path.getsize(path),
+                      'sha256': sha256.hexdigest(),
+                      'fingerprint': fingerprint}))
+    return 0
+
+
+def run_child(writer, args, path):
+    output = subprocess.check_output([
+        sys.executable, os.path.abspath(__file__), '--child', writer,
+        '--size-mb', str(args.size_mb), '--actions', str(args.actions),
+        '--output', path])
+    return json.loads(output.decode('utf-8'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[2])
+    parser.add_argument('--size-mb', type=int, default=50)
+    parser.add_argument('--actions', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args.child, args.size_mb, args.actions, args.output)
+
+    temp_dir = tempfile.mkdtemp()
+    results = {}
+    try:
+        for writer in ('tree', 'stream'):
+            path = os.path.join(temp_dir, '%s.bes' % writer)
+            runs = [run_child(writer, args, path) for _ in range(args.repeat)]
+            results[writer] = min(runs, key=lambda run: run['seconds'])
+            results[writer]['rss_growth'] = max(run['rss_growth'] for run in runs)
+            os.remove(path)
+    finally:
+        os.rmdir(temp_dir)
+
+    tree, stream = results['tree'], results['stream']
+    if (tree['sha256'], tree['fingerprint']) != (stream['sha256'],
+                                                 stream['fingerprint']):
+        print("MISMATCH: tree %s != stream %s" % (tree['sha256'],
+                                                  stream['sha256']))
+        return 1
+
+    print("%.1f MB task, %d actions, output byte-identical (sha256 %s...)" % (
+        tree['size'] / (1024.0 * 1024.0), args.actions, tree['sha256'][:12]))
+    for label, result in (('tree writer:  ', tree), ('stream writer:', stream)):
+        print("  %s %8.3fs  %8.1f MB peak RSS growth" % (
+            label, result['seconds'], result['rss_growth'] / (1024.0 * 1024.0)))
+    print("  memory saved:  %7.1f MB" % (
+        (tree['rss_growth'] - stream['rss_growth']) / (1024.0 * 1024.0)))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
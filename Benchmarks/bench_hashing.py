@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+bench_hashing.py
+
+Throughput benchmark for BESHashing.hash_file against the original
+per-digest loops that read the file once per algorithm in
+h.block_size (64 byte) chunks.
+
+Usage: bench_hashing.py [--size-mb N] [--repeat N] [FILE ...]
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import time
+import hashlib
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'Code', 'BESHelpers'))
+from BESHashing import hash_file
+
+
+def legacy_digest(filename, algorithm):
+    """The original get_sha1/get_sha256 loop."""
+    h = hashlib.new(algorithm)
+    with open(filename, 'rb') as file:
+        while True:
+            chunk = file.read(h.block_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def legacy(filename):
+    return {'sha1': legacy_digest(filename, 'sha1'),
+            'sha256': legacy_digest(filename, 'sha256'),
+            'size': os.path.getsize(filename)}
+
+
+def best_of(func, filename, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(filename)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def make_sample(size_mb):
+    handle, path = tempfile.mkstemp(suffix='.bin')
+    with os.fdopen(handle, 'wb') as file_handle:
+        chunk = os.urandom(1024 * 1024)
+        for _ in range(size_mb):
+            file_handle.write(chunk)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--size-mb', type=int, default=256,
+                        help='Size of the generated sample file.')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    files = args.files
+    generated = None
+    if not files:
+        generated = make_sample(args.size_mb)
+        files = [generated]
+
+    try:
+        for path in files:
+            size_mb = os.path.getsize(path) / (1024.0 * 1024.0)
+            old_time, old = best_of(legacy, path, args.repeat)
+            new_time, new = best_of(hash_file, path, args.repeat)
+
+            if old != new:
+                print("MISMATCH for %s: %s != %s" % (path, old, new))
+                return 1
+
+            print("%s (%.1f MB)" % (os.path.basename(path), size_mb))
+            print("  per-digest loops: %8.3fs  %8.1f MB/s" % (
+                old_time, size_mb / old_time))
+            print("  single pass:      %8.3fs  %8.1f MB/s" % (
+                new_time, size_mb / new_time))
+            print("  speedup:          %8.2fx" % (old_time / new_time))
+    finally:
+        if generated:
+            os.remove(generated)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+bench_site_listing.py
+
+Time-to-decision and peak RSS of BESImporter's duplicate title search
+over a synthetic custom site listing served by stub_bigfix.py: the
+original objectify tree walk against the streamed incremental parse
+that stops at the first match.
+
+The stub server and each search run in separate child processes, so the
+peak RSS reported for a search is its own, along with its growth over the
+child's baseline after imports.
+
+Usage: bench_site_listing.py [--tasks N] [--position first|middle|last|missing]
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+from contextlib import closing
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir, 'Code'))
+sys.path.insert(0, os.path.join(HERE, os.pardir, 'Code', 'BESHelpers'))
+
+import requests
+from lxml import objectify
+
+from BESSiteIndex import find_task, open_task_listing, LISTING_CHUNK_SIZE
+from stub_bigfix import start_server
+
+SITE = 'Bench'
+
+TASK_XML = (
+    '<Task Resource="%(base)s/api/task/custom/%(site)s/%(id)d" '
+    'LastModified="Mon, 02 Mar 2020 15:%(min)02d:00 +0000">'
+    '<Name>Example App %(id)d - macOS</Name><ID>%(id)d</ID></Task>')
+
+
+class Connection(object):
+    """The parts of besapi.BESConnection the streamed search uses."""
+
+    def __init__(self, rootserver):
+        self.rootserver = rootserver
+        self.session = requests.Session()
+        self.verify = False
+
+    def url(self, path):
+        return '%s/api/%s' % (self.rootserver, path)
+
+
+def make_listing(base, count):
+    tasks = [TASK_XML % {'base': base, 'site': SITE, 'id': task_id,
+                         'min': task_id % 60}
+             for task_id in range(1, count + 1)]
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<BESAPI xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+            'xsi:noNamespaceSchemaLocation="BESAPI.xsd">%s</BESAPI>'
+            % ''.join(tasks)).encode('utf-8')
+
+
+def search_tree(base, title):
+    """The original search: objectify the whole listing, then walk it."""
+    response = requests.get('%s/api/tasks/custom/%s' % (base, SITE))
+    match = None
+    for task in objectify.fromstring(response.content).iterchildren():
+        if task.Name == title:
+            match = [str(task.ID), task.get('LastModified')]
+    return match
+
+
+def search_stream(base, title):
+    with closing(open_task_listing(Connection(base), SITE)) as response:
+        return find_task(response.iter_content(LISTING_CHUNK_SIZE), title)
+
+
+def peak_rss():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak *= 1024
+    return peak
+
+
+def child(mode, base, title):
+    search = search_tree if mode == 'tree' else search_stream
+    baseline = peak_rss()
+    start = time.perf_counter()
+    match = search(base, title)
+    elapsed = time.perf_counter() - start
+
+    print(json.dumps({'seconds': elapsed, 'peak_rss': peak_rss(),
+                      'rss_growth': peak_rss() - baseline, 'match': match}))
+    return 0
+
+
+def run_child(mode, base, title):
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                      '--child', mode, '--base', base,
+                                      '--title', title])
+    return json.loads(output.decode('utf-8'))
+
+
+def serve(count):
+    """Serve the listing until stdin is closed."""
+    server, base = start_server()
+    server.state.listings[SITE] = make_listing(base, count)
+    print(json.dumps({'base': base,
+                      'size': len(server.state.listings[SITE])}))
+    sys.stdout.flush()
+    sys.stdin.read()
+    server.shutdown()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[2])
+    parser.add_argument('--tasks', type=int, default=50000)
+    parser.add_argument('--position', default='middle',
+                        choices=['first', 'middle', 'last', 'missing'])
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--base', help=argparse.SUPPRESS)
+    parser.add_argument('--title', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.tasks)
+    if args.child:
+        return child(args.child, args.base, args.title)
+
+    task_id = {'first': 1, 'middle': args.tasks // 2,
+               'last': args.tasks, 'missing': 0}[args.position]
+    title = 'Example App %d - macOS' % task_id
+
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                               '--serve', '--tasks', str(args.tasks)],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        listing = json.loads(server.stdout.readline().decode('utf-8'))
+        tree = run_child('tree', listing['base'], title)
+        stream = run_child('stream', listing['base'], title)
+    finally:
+        server.stdin.close()
+        server.wait()
+
+    if tree['match'] != stream['match']:
+        print("MISMATCH: %s != %s" % (tree['match'], stream['match']))
+        return 1
+
+    size_mb = listing['size'] / (1024.0 * 1024.0)
+    print("%d tasks (%.1f MB listing), title %s" % (args.tasks, size_mb,
+                                                    args.position))
+    for label, result in (('objectify tree: ', tree),
+                          ('streamed search:', stream)):
+        print("  %s %8.3fs to decision  %8.1f MB peak RSS (+%.1f MB)" % (
+            label, result['seconds'], result['peak_rss'] / (1024.0 * 1024.0),
+            result['rss_growth'] / (1024.0 * 1024.0)))
+    print("  speedup:         %8.2fx" % (tree['seconds'] / stream['seconds']))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+bench_suite.py
+
+Offline benchmark suite for the processors' hot paths, per machine.
+
+Everything runs against local stand-ins: autopkglib from an AutoPkg
+install if there is one, otherwise BESFleet's stand-in; fake_qna.py for
+QnA; and stub_bigfix.py, in its own process, for the REST API and the
+download CDN. The cases are:
+
+  hash_<size>            AutoPkgBESEngine.get_sha1 and get_sha256 of a
+                         sparse file of each --sizes (1M and 64M unless
+                         e.g. --sizes 1M,64M,1G,4G), digest cache off
+  tree_new_node          10,000 new_node() calls
+  tree_new_action        1,000 new_action() calls, with SSA settings
+  engine_main_cold       AutoPkgBESEngine.main with a prefetch, an icon
+                         and 20 relevance lines, every cache disabled
+  engine_main_cached     the same with warm digest, redirect and icon caches
+  engine_main_unchanged  the same with inputs unchanged since the last run
+  uploader_upload        BESUploader.main uploading an --upload-mb file
+  importer_duplicate     BESImporter.main finding a duplicate title at the
+                         end of a --tasks task listing
+
+The uploader and importer cases are skipped when besapi is not
+installed. Each case is run --repeat times, each time in a loop of
+enough calls to take at least MIN_SAMPLE seconds, and reports its best
+time per call (files of 1 GB and more are hashed just once).
+
+Timings only compare on the same machine, so no baseline is shipped.
+--save stores the results as this machine's baseline in baselines/; later
+runs are compared with it, and a case slower than baseline *
+(1 + threshold), by more than MIN_DELTA, is a regression.
+
+Usage: bench_suite.py [--only REGEX] [--repeat N] [--save] [--baseline FILE]
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import shutil
+import struct
+import random
+import argparse
+import platform
+import plistlib
+import datetime
+import subprocess
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir, 'Code'))
+sys.path.insert(0, os.path.join(HERE, os.pardir, 'Code', 'BESHelpers'))
+
+from BESFleet import install_processor_shim
+
+SITE = 'Bench'
+FAKE_QNA = os.path.join(HERE, 'fake_qna.py')
+BASELINE_DIR = os.path.join(HERE, 'baselines')
+DEFAULT_THRESHOLD = 0.25
+# Differences below this are timer noise, whatever the ratio
+MIN_DELTA = 0.005
+# Shortest time one timed loop of a case may take
+MIN_SAMPLE = 0.2
+
+SIZES = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(size):
+    """'64M' -> 67108864"""
+    return int(size[:-1]) * SIZES[size[-1].upper()]
+
+
+def make_png(width, height):
+    """A noisy RGB PNG, so that it compresses about as badly as a real icon."""
+    rng = random.Random(width)
+    rows = b''.join(b'\x00' + rng.randbytes(width * 3) for _ in range(height))
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+def serve(task_count):
+    """Serve the stub with a task listing and CDN files until stdin closes."""
+    from bench_site_listing import make_listing
+    from stub_bigfix import start_server
+
+    server, base = start_server()
+    server.state.listings[SITE] = make_listing(base, task_count)
+    server.state.files['Bench.pkg'] = b'pkg'
+    server.state.files['icon.png'] = make_png(512, 512)
+    print(json.dumps({'base': base}))
+    sys.stdout.flush()
+    sys.stdin.read()
+    server.shutdown()
+    return 0
+
+
+def best_of(func, repeat):
+    """
+    Return func's best time per call over repeat loops. The first call
+    sizes the loops to take MIN_SAMPLE seconds each, so that the times of
+    millisecond cases are not mostly scheduler and timer noise.
+    """
+    start = time.perf_counter()
+    func()
+    first = time.perf_counter() - start
+    if repeat <= 1 and first >= MIN_SAMPLE:
+        return first
+
+    calls = max(1, int(MIN_SAMPLE / first)) if first else 1000
+    best = None
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        elapsed = (time.perf_counter() - start) / calls
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def quiet(processor):
+    processor.output = lambda *args, **kwargs: None
+    return processor
+
+
+def have_besapi():
+    try:
+        # Where the processors find it: besapi.besapi, or besapi itself
+        # for older releases
+        from BESConnections import BESConnection
+    except ImportError:
+        return False
+    return True
+
+
+def engine_cases(work_dir, base, payload):
+    from AutoPkgBESEngine import AutoPkgBESEngine
+
+    cache_dir = os.path.join(work_dir, 'cache')
+    recipe_cache_dir = os.path.join(cache_dir, 'local.bes.Bench')
+    os.makedirs(recipe_cache_dir)
+
+    def env(**overrides):
+        values = {
+            'NAME': 'Bench', 'bes_version': '1.0',
+            'RECIPE_CACHE_DIR': recipe_cache_dir, 'CACHE_DIR': cache_dir,
+            'url': '%s/download/Bench.pkg' % base, 'pathname': payload,
+            'bes_icon': '%s/cdn/icon.png' % base,
+            'bes_qna_path': FAKE_QNA,
+            'bes_relevance': ['mac of operating system',
+                              'system version >= "10.15"'] +
+                             ['not exists file "/Applications/Bench%d.app"' % n
+                              for n in range(18)],
+            'bes_actions': {1: {'ActionName': 'DefaultAction',
+                                'ActionNumber': 'Action1',
+                                'ActionScript': 'echo "install"\n' * 50}},
+            'bes_ssa': 'True', 'bes_ssaaction': 'Action',
+        }
+        values.update(overrides)
+        return values
+
+    cold = dict(bes_force_rebuild='True', bes_digest_cache_dir='',
+                bes_redirect_cache_dir='', bes_icon_cache_dir='')
+    engine = quiet(AutoPkgBESEngine(env()))
+
+    def new_nodes():
+        for number in range(10000):
+            engine.new_node('Relevance', 'exists file "/tmp/%d"' % number,
+                            {'Index': str(number)})
+
+    def new_actions():
+        for number in range(1000):
+            engine.new_action({'ActionName': 'Action',
+                               'ActionNumber': 'Action%d' % number,
+                               'ActionScript': 'echo "%d"' % number}, ssa=True)
+
+    def main(**overrides):
+        return lambda: quiet(AutoPkgBESEngine(env(**overrides))).main()
+
+    def digests(path):
+        def run():
+            hasher = quiet(AutoPkgBESEngine({'bes_digest_cache_dir': ''}))
+            hasher.get_sha1(path)
+            hasher.get_sha256(path)
+        return run
+
+    # Warm the caches and write the build record the later cases rely on
+    main(bes_force_rebuild='True')()
+
+    return digests, [
+        ('tree_new_node', new_nodes),
+        ('tree_new_action', new_actions),
+        ('engine_main_cold', main(**cold)),
+        ('engine_main_cached', main(bes_force_rebuild='True')),
+        ('engine_main_unchanged', main()),
+    ]
+
+
+def api_cases(work_dir, base, task_count, upload_size):
+    from BESUploader import BESUploader
+    from BESImporter import BESImporter
+
+    upload = os.path.join(work_dir, 'Bench Upload.pkg')
+    with open(upload, 'wb') as file_handle:
+        file_handle.write(random.Random(upload_size).randbytes(upload_size))
+
+    duplicate = os.path.join(work_dir, 'Duplicate.bes')
+    with open(duplicate, 'w') as file_handle:
+        file_handle.write(
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<BES xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+            'xsi:noNamespaceSchemaLocation="BES.xsd"><Task>'
+            '<Title>Example App %d - macOS</Title></Task></BES>' % task_count)
+
+    credentials = {'BES_USERNAME': 'bench', 'BES_PASSWORD': 'bench'}
+
+    def upload_file():
+        quiet(BESUploader(dict(credentials, BES_ROOTSERVER=base,
+                               bes_uploadpath=upload,
+                               bes_digest_cache_dir=''))).main()
+
+    def find_duplicate():
+        quiet(BESImporter(dict(credentials, BES_ROOT_SERVER=base,
+                               bes_file=duplicate, bes_customsite=SITE,
+                               bes_site_index_dir=''))).main()
+
+    return [('uploader_upload', upload_file),
+            ('importer_duplicate', find_duplicate)]
+
+
+def run_cases(args, work_dir, base):
+    selected = re.compile(args.only) if args.only else None
+    results = {}
+
+    def run(name, func, repeat=args.repeat):
+        if selected and not selected.search(name):
+            return
+        results[name] = {'seconds': best_of(func, repeat)}
+        print("  %-24s %10.4fs" % (name, results[name]['seconds']))
+        sys.stdout.flush()
+
+    payload = os.path.join(work_dir, 'Bench.pkg')
+    with open(payload, 'wb') as file_handle:
+        file_handle.write(random.Random(0).randbytes(4 * 1024 * 1024))
+
+    digests, cases = engine_cases(work_dir, base, payload)
+
+    for size in args.sizes.split(','):
+        path = os.path.join(work_dir, 'hash-%s.bin' % size)
+        with open(path, 'wb') as file_handle:
+            file_handle.truncate(parse_size(size))
+        run('hash_%s' % size, digests(path),
+            1 if parse_size(size) >= SIZES['G'] else args.repeat)
+        os.remove(path)
+
+    if have_besapi():
+        cases += api_cases(work_dir, base, args.tasks,
+                           args.upload_mb * 1024 * 1024)
+    else:
+        print("  besapi is not installed, skipping uploader and importer cases")
+
+    for name, func in cases:
+        run(name, func)
+    return results
+
+
+def compare(results, baseline, threshold=None):
+    """
+    Return [(name, seconds, baseline seconds, change, status)], where
+    status is 'ok', 'faster', 'REGRESSION' or 'new'.
+    """
+    rows = []
+    for name, result in sorted(results.items()):
+        reference = baseline.get('results', {}).get(name)
+        if not reference:
+            rows.append((name, result['seconds'], None, None, 'new'))
+            continue
+
+        limit = threshold
+        if limit is None:
+            limit = reference.get('threshold',
+                                  baseline.get('threshold', DEFAULT_THRESHOLD))
+        change = result['seconds'] / reference['seconds'] - 1
+        delta = result['seconds'] - reference['seconds']
+        if change > limit and delta > MIN_DELTA:
+            status = 'REGRESSION'
+        elif change < -limit and -delta > MIN_DELTA:
+            status = 'faster'
+        else:
+            status = 'ok'
+        rows.append((name, result['seconds'], reference['seconds'], change,
+                     status))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[2])
+    parser.add_argument('--only', help='Run only the cases matching this regex.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--sizes', default='1M,64M',
+                        help='Comma separated file sizes for the hash cases.')
+    parser.add_argument('--upload-mb', type=int, default=64)
+    parser.add_argument('--tasks', type=int, default=20000,
+                        help='Tasks in the listing for importer_duplicate.')
+    parser.add_argument('--baseline',
+                        default=os.path.join(BASELINE_DIR, '%s.json' %
+                                             platform.node().split('.')[0]))
+    parser.add_argument('--threshold', type=float, default=None,
+                        help='Allowed slowdown as a fraction, overriding the '
+                             'baseline\'s (%s by default).' % DEFAULT_THRESHOLD)
+    parser.add_argument('--save', action='store_true',
+                        help='Store these results as the baseline.')
+    parser.add_argument('--output', help='Also write the results as JSON here.')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.tasks)
+
+    install_processor_shim()
+    import BESHTTP
+
+    work_dir = tempfile.mkdtemp()
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                               '--serve', '--tasks', str(args.tasks)],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        base = json.loads(server.stdout.readline().decode('utf-8'))['base']
+
+        # Safari's User-Agent list is not there off a Mac
+        agents = os.path.join(work_dir, 'UserAgents.plist')
+        with open(agents, 'wb') as file_handle:
+            plistlib.dump([{'user-agent': 'bench_suite'}], file_handle)
+        BESHTTP.user_agent(agents)
+
+        print("Running against %s" % base)
+        results = run_cases(args, work_dir, base)
+    finally:
+        server.stdin.close()
+        server.wait()
+        shutil.rmtree(work_dir)
+
+    report = {
+        'created': datetime.datetime.now().isoformat(),
+        'machine': {'node': platform.node(), 'platform': platform.platform(),
+                    'python': platform.python_version()},
+        'threshold': (DEFAULT_THRESHOLD if args.threshold is None
+                      else args.threshold),
+        'results': results,
+    }
+
+    status = 0
+    if args.save:
+        if not os.path.isdir(os.path.dirname(args.baseline)):
+            os.makedirs(os.path.dirname(args.baseline))
+        with open(args.baseline, 'w') as file_handle:
+            json.dump(report, file_handle, indent=2, sort_keys=True)
+        print("Saved baseline %s" % args.baseline)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as file_handle:
+            baseline = json.load(file_handle)
+        rows = compare(results, baseline, args.threshold)
+        print("Compared with %s:" % args.baseline)
+        for name, seconds, reference, change, row_status in rows:
+            if reference is None:
+                print("  %-24s %10.4fs  %10s  %8s  %s" % (name, seconds, '-',
+                                                          '-', row_status))
+            else:
+                print("  %-24s %10.4fs  %9.4fs  %+7.1f%%  %s" % (
+                    name, seconds, reference, change * 100, row_status))
+        report['comparison'] = dict((row[0], row[4]) for row in rows)
+        if any(row[4] == 'REGRESSION' for row in rows):
+            status = 1
+    else:
+        print("No baseline at %s, run with --save to create one" % args.baseline)
+
+    if args.output:
+        with open(args.output, 'w') as file_handle:
+            json.dump(report, file_handle, indent=2, sort_keys=True)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+bench_templater.py
+
+Render time of BESTemplater for --recipes recipes that share one set of
+templates in BES_TEMPLATES, comparing:
+
+  uncached  a new Environment and ChoiceLoader for every recipe, as
+            BESTemplater did before environments were cached
+  cold      cached environment, empty bytecode cache (first autopkg run)
+  warm      cached environment, bytecode cache filled by the cold run
+
+Each mode runs in a fresh process. Needs jinja2; autopkglib comes from
+an AutoPkg install if there is one, otherwise BESFleet's stand-in.
+
+Usage: bench_templater.py [--recipes N] [--blocks N]
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir, 'Code'))
+sys.path.insert(0, os.path.join(HERE, os.pardir, 'Code', 'BESHelpers'))
+
+from BESFleet import install_processor_shim
+
+BASE_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+{% macro relevance(lines) -%}
+{% for line in lines %}    <Relevance><![CDATA[{{ line }}]]></Relevance>
+{% endfor %}
+{%- endmacro %}
+<BES xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="BES.xsd">
+  <Task>
+    <Title>Deploy {{ NAME }} {{ version }}</Title>
+    <Description><![CDATA[{% block description %}{% endblock %}]]></Description>
+{{ relevance(bes_relevance) }}
+    <Category>Software Deployment</Category>
+{% block actions %}{% endblock %}
+  </Task>
+</BES>
+"""
+
+TASK_BLOCK = """
+{%% if bes_actions[%(n)d] is defined %%}
+    <Action ID="Action%(n)d">
+      <Description><PreLink>Click </PreLink><Link>here</Link><PostLink> to deploy {{ NAME|e }} {{ version|e }}.</PostLink></Description>
+      <ActionScript MIMEType="application/x-Fixlet-Windows-Shell"><![CDATA[
+{%% for line in bes_actions[%(n)d] %%}{{ loop.index }}: {{ line|replace('"', '\\\\"')|trim }}
+{%% endfor %%}]]></ActionScript>
+    </Action>
+{%% endif %%}"""
+
+
+def make_tree(root, recipe_count, block_count):
+    templates = os.path.join(root, 'templates')
+    os.makedirs(templates)
+    with open(os.path.join(templates, 'base.bes.j2'), 'w') as file_handle:
+        file_handle.write(BASE_TEMPLATE)
+    with open(os.path.join(templates, 'task.bes.j2'), 'w') as file_handle:
+        file_handle.write('{% extends "base.bes.j2" %}\n'
+                          '{% block description %}Deploys {{ NAME }}.'
+                          '{% endblock %}\n{% block actions %}' +
+                          ''.join(TASK_BLOCK % {'n': n}
+                                  for n in range(block_count)) +
+                          '{% endblock %}\n')
+
+    envs = []
+    for number in range(recipe_count):
+        recipe_dir = os.path.join(root, 'recipes', 'Vendor%d' % number,
+                                  'App%d' % number)
+        cache_dir = os.path.join(root, 'cache', 'local.bes.App%d' % number)
+        os.makedirs(recipe_dir)
+        os.makedirs(cache_dir)
+        envs.append({
+            'NAME': 'App%d' % number, 'version': '1.%d' % number,
+            'RECIPE_DIR': recipe_dir, 'RECIPE_CACHE_DIR': cache_dir,
+            'BES_TEMPLATES': templates, 'template_name': 'task.bes.j2',
+            'bes_relevance': ['mac of operating system',
+                              'not exists folder "/Applications/App%d.app"'
+                              % number],
+            'bes_actions': dict((n, ['echo "step %d"' % step
+                                     for step in range(5)])
+                                for n in range(0, block_count, 3)),
+        })
+    return envs
+
+
+def render_uncached(env):
+    """The previous BESTemplater.main, minus writing the file."""
+    from jinja2 import Environment, ChoiceLoader, FileSystemLoader
+
+    uppath = lambda _path, n: os.sep.join(_path.split(os.sep)[:-n])
+    recipe_dir = env['RECIPE_DIR']
+    jinja_env = Environment(loader=ChoiceLoader([
+        FileSystemLoader(os.getcwd()),
+        FileSystemLoader('templates'),
+        FileSystemLoader(os.path.join(recipe_dir, 'templates')),
+        FileSystemLoader(os.path.join(uppath(recipe_dir, 1), 'templates')),
+        FileSystemLoader(os.path.join(uppath(recipe_dir, 2), 'Templates')),
+        FileSystemLoader(env['BES_TEMPLATES'])
+    ]))
+    rendered = jinja_env.get_template(env['template_name']).render(**env)
+    with open(os.path.join(env['RECIPE_CACHE_DIR'], 'uncached.bes'),
+              'w') as file_handle:
+        file_handle.write(rendered)
+
+
+def child(mode, envs):
+    install_processor_shim()
+    from BESTemplater import BESTemplater
+
+    times = []
+    for env in envs:
+        start = time.perf_counter()
+        if mode == 'uncached':
+            render_uncached(env)
+        else:
+            processor = BESTemplater(dict(env))
+            processor.output = lambda *args, **kwargs: None
+            processor.main()
+        times.append(time.perf_counter() - start)
+
+    print(json.dumps({'total': sum(times), 'first': times[0],
+                      'rest_mean': sum(times[1:]) / max(1, len(times) - 1)}))
+    return 0
+
+
+def run_child(mode, manifest):
+    output = subprocess.check_output([
+        sys.executable, os.path.abspath(__file__), '--child', mode,
+        '--manifest', manifest])
+    return json.loads(output.decode('utf-8'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[2])
+    parser.add_argument('--recipes', type=int, default=100)
+    parser.add_argument('--blocks', type=int, default=60,
+                        help='Action blocks in the shared template.')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--manifest', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        with open(args.manifest) as file_handle:
+            envs = json.load(file_handle, object_hook=lambda value: dict(
+                (int(key) if key.isdigit() else key, item)
+                for key, item in value.items()))
+        return child(args.child, envs)
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        envs = make_tree(temp_dir, args.recipes, args.blocks)
+        manifest = os.path.join(temp_dir, 'manifest.json')
+        with open(manifest, 'w') as file_handle:
+            json.dump(envs, file_handle)
+
+        results = [(mode, run_child(mode, manifest))
+                   for mode in ('uncached', 'cold', 'warm')]
+    finally:
+        shutil.rmtree(temp_dir)
+
+    print("%d recipes sharing a %d block template:" % (args.recipes,
+                                                        args.blocks))
+    for mode, result in results:
+        print("  %-9s %8.3fs total  %8.2f ms first  %8.2f ms per later recipe"
+              % (mode, result['total'], result['first'] * 1000,
+                 result['rest_mean'] * 1000))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
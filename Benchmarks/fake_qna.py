@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# Copyright 2014 The Pennsylvania State University.
+#
+"""
+fake_qna.py
+
+Local stand-in for the BigFix QnA utility. Reads one relevance expression
+per line from stdin and answers in QnA's Q:/A:/E: format.
+
+  "text"            A: text
+  true / false      A: True / A: False
+  123               A: 123
+  *nonexistent*     E: Singular expression refers to nonexistent object.
+  fake crash        exits immediately with status 3
+  fake sleep N      sleeps N seconds before answering True
+  anything else     A: True
+
+FAKE_QNA_DELAY (seconds) adds a fixed delay to every answer, and
+FAKE_QNA_STARTUP (seconds) a delay before the first one, to mimic the
+cost of a real QnA spawn.
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import time
+
+
+def answer(relevance):
+    relevance = relevance.strip()
+
+    if relevance == 'fake crash':
+        sys.exit(3)
+    if relevance.startswith('fake sleep'):
+        time.sleep(float(relevance.split()[-1]))
+        return 'A', 'True'
+    if 'nonexistent' in relevance:
+        return 'E', 'Singular expression refers to nonexistent object.'
+    if len(relevance) > 1 and relevance[0] == relevance[-1] == '"':
+        return 'A', relevance[1:-1]
+    if relevance in ('true', 'false'):
+        return 'A', relevance.capitalize()
+    if relevance.isdigit():
+        return 'A', relevance
+    return 'A', 'True'
+
+
+def main():
+    delay = float(os.environ.get('FAKE_QNA_DELAY', 0))
+    time.sleep(float(os.environ.get('FAKE_QNA_STARTUP', 0)))
+
+    for line in iter(sys.stdin.readline, ''):
+        if not line.strip():
+            continue
+        if delay:
+            time.sleep(delay)
+        kind, value = answer(line)
+        sys.stdout.write('Q: %s: %s\n' % (kind, value))
+        sys.stdout.flush()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+stub_bigfix.py
+
+Local stand-in for the parts of the BigFix REST API the BES processors
+use, for exercising them without a root server.
+
+  GET  /api/login                  accept any credentials
+  POST /api/upload                 store the body, return FileUpload XML
+  POST /api/upload + Content-Range store one part of a multi-part upload,
+                                   202 until every byte has arrived. This
+                                   is the stub's own protocol for
+                                   BESUploader's part mode, not the
+                                   console's. With state.accept_parts
+                                   False each part is stored as a whole
+                                   upload, as by a server without it
+  GET  /api/upload/<sha1>/<name>   return an earlier FileUpload or 404
+  GET  /api/tasks/custom/<site>    list the site's tasks, or return
+                                   state.listings[site] if set
+  POST /api/tasks/custom/<site>    import every item of a BES document,
+                                   returning their new IDs in order
+  GET  /api/task/custom/<site>/<id> return an imported task or 404
+  GET  /api/query?relevance=...    answer BESSiteIndex's changed tasks
+                                   query; any other relevance gets an
+                                   <Error>, as unsupported relevance does
+
+It also stands in for a vendor's download CDN:
+
+  GET|HEAD /download/<name>        302 redirect to /cdn/<name>
+  GET|HEAD /cdn/<name>             serve state.files[name] or 404
+
+Run it directly to serve on a port, or call start_server() from another
+script. Uploaded files are kept in memory. Setting state.fail_parts_after
+to N makes every part request after the Nth fail with a 503, to simulate
+a connection dropping partway through an upload. Imports are rejected
+with a 400, like the console does for invalid content, if any item's
+title contains state.reject_marker. Setting state.drop_import_ids to N
+imports every item but leaves the last N out of the reply, as a response
+the processors cannot map back. state.rename_task() renames a task
+the way an operator would on the console.
+"""
+from __future__ import absolute_import, print_function
+
+import re
+import sys
+import time
+import hashlib
+import argparse
+import threading
+import xml.etree.ElementTree as ElementTree
+from email.utils import formatdate, parsedate_to_datetime
+from xml.sax.saxutils import escape
+from urllib.parse import unquote, urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+UPLOAD_XML = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<BESAPI xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    'xsi:noNamespaceSchemaLocation="BESAPI.xsd">'
+    '<FileUpload Resource="%(base)s/api/upload/%(sha1)s/%(name)s">'
+    '<Name>%(name)s</Name>'
+    '<URL>%(base)s/Uploads/%(sha1)s/%(name)s</URL>'
+    '<Size>%(size)d</Size>'
+    '<SHA1>%(sha1)s</SHA1>'
+    '<SHA256>%(sha256)s</SHA256>'
+    '</FileUpload></BESAPI>')
+
+BESAPI_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<BESAPI xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    'xsi:noNamespaceSchemaLocation="BESAPI.xsd">')
+
+QUERY_XML = (
+    BESAPI_HEADER + '<Query Resource="%(relevance)s"><Result>%(answers)s'
+    '</Result>%(error)s</Query></BESAPI>')
+
+# The only session relevance the stub evaluates: BESSiteIndex's query for
+# the tasks of a custom site modified since a time
+CHANGED_TASKS = re.compile(
+    r'name of site of it = "CustomSite_(?P<site>[^"]*)" and '
+    r'modification time of it >= "(?P<since>[^"]*)" as time')
+
+TASK_XML = (
+    '<%(type)s Resource="%(base)s/api/task/custom/%(site)s/%(id)d" '
+    'LastModified="%(last_modified)s">'
+    '<Name>%(name)s</Name><ID>%(id)d</ID></%(type)s>')
+
+
+class StubState(object):
+    """What the stub has stored, and counters for the requests it served."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.uploads = {}
+        self.partial = {}
+        self.listings = {}
+        self.files = {}
+        self.sites = {}
+        self.next_id = 1000
+        self.import_posts = 0
+        self.reject_marker = 'INVALID'
+        self.drop_import_ids = 0
+        self.requests = {}
+        self.part_requests = 0
+        self.fail_parts_after = None
+        self.accept_parts = True
+
+    def count(self, name):
+        with self.lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+    def rename_task(self, site, task_id, title):
+        """Retitle an imported task, updating its LastModified time."""
+        with self.lock:
+            for task in self.sites.get(site, []):
+                if str(task['id']) == str(task_id):
+                    root = ElementTree.fromstring(task['content'])
+                    root[0].find('Title').text = title
+                    task.update(name=title, content=ElementTree.tostring(
+                        root, encoding='unicode'), **_modified_now())
+                    return task
+        raise KeyError(task_id)
+
+
+def _modified_now():
+    now = time.time()
+    return {'modified': now, 'last_modified': formatdate(now, usegmt=True)}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    @property
+    def base(self):
+        return 'http://%s:%d' % self.server.server_address[:2]
+
+    def reply(self, code, body, content_type='application/xml', headers=None):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading early, e.g. a streamed search
+            self.close_connection = True
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        sha1 = hashlib.sha1()
+        sha256 = hashlib.sha256()
+        size = 0
+        while size < length:
+            chunk = self.rfile.read(min(1024 * 1024, length - size))
+            if not chunk:
+                break
+            sha1.update(chunk)
+            sha256.update(chunk)
+            size += len(chunk)
+        return sha1.hexdigest(), sha256.hexdigest(), size
+
+    def path_parts(self):
+        return [unquote(part) for part in
+                self.path.split('?')[0].strip('/').split('/')]
+
+    def do_GET(self):
+        parts = self.path_parts()
+        self.state.count(self.command + ' ' + '/'.join(parts[:2]))
+
+        if parts == ['api', 'login']:
+            return self.reply(200, 'ok', 'text/plain')
+
+        if parts[:2] == ['api', 'upload'] and len(parts) == 4:
+            record = self.state.uploads.get((parts[2], parts[3]))
+            if record:
+                return self.reply(200, UPLOAD_XML % dict(record, base=self.base))
+            return self.reply(404, 'Upload not found', 'text/plain')
+
+        if parts[:3] == ['api', 'tasks', 'custom'] and len(parts) == 4:
+            listing = self.state.listings.get(parts[3])
+            if listing is not None:
+                return self.reply(200, listing)
+            if parts[3] in self.state.sites:
+                return self.reply(200, self.task_listing(parts[3]))
+            return self.reply(404, 'Site not found', 'text/plain')
+
+        if parts[:3] == ['api', 'task', 'custom'] and len(parts) == 5:
+            for task in self.state.sites.get(parts[3], []):
+                if str(task['id']) == parts[4]:
+                    return self.reply(200, task['content'])
+            return self.reply(404, 'Task not found', 'text/plain')
+
+        if parts == ['api', 'query']:
+            return self.query()
+
+        if parts[0] in ('download', 'cdn') and len(parts) == 2:
+            return self.serve_file(parts[0], parts[1])
+
+        self.reply(404, 'Not found', 'text/plain')
+
+    do_HEAD = do_GET
+
+    def query(self):
+        query = parse_qs(urlsplit(self.path).query)
+        relevance = query.get('relevance', [''])[0]
+        match = CHANGED_TASKS.search(relevance)
+        answers, error = [], ''
+        if match:
+            since = parsedate_to_datetime(match.group('since')).timestamp()
+            with self.state.lock:
+                tasks = list(self.state.sites.get(match.group('site'), []))
+            answers = ['<Answer type="string">%s</Answer>' % escape(
+                '%(id)d|%(last_modified)s|%(name)s' % task)
+                for task in tasks if task['modified'] >= since]
+        else:
+            error = '<Error>The stub cannot evaluate this relevance</Error>'
+        self.reply(200, QUERY_XML % {
+            'relevance': escape(relevance, {'"': '&quot;'}),
+            'answers': ''.join(answers), 'error': error})
+
+    def serve_file(self, route, name):
+        if route == 'download':
+            return self.reply(302, '', 'text/plain',
+                              {'Location': '%s/cdn/%s' % (self.base, name)})
+        content = self.state.files.get(name)
+        if content is None:
+            return self.reply(404, 'File not found', 'text/plain')
+        return self.reply(200, content, 'application/octet-stream',
+                          {'ETag': '"%s"' % hashlib.sha1(content).hexdigest()})
+
+    def do_POST(self):
+        parts = self.path_parts()
+        self.state.count('POST ' + '/'.join(parts[:2]))
+
+        if (parts == ['api', 'upload'] and self.state.accept_parts and
+                self.headers.get('Content-Range')):
+            return self.receive_part()
+
+        if parts == ['api', 'upload']:
+            disposition = self.headers.get('Content-Disposition', '')
+            name = disposition.split('filename="')[-1].rstrip('"') or 'upload'
+            sha1, sha256, size = self.read_body()
+            record = {'name': name, 'sha1': sha1, 'sha256': sha256,
+                      'size': size}
+            with self.state.lock:
+                self.state.uploads[(sha1, name)] = record
+            return self.reply(200, UPLOAD_XML % dict(record, base=self.base))
+
+        if parts[:3] == ['api', 'tasks', 'custom'] and len(parts) == 4:
+            return self.import_content(parts[3])
+
+        self.reply(404, 'Not found', 'text/plain')
+
+    def task_xml(self, task, site):
+        return TASK_XML % dict(task, base=self.base, site=site,
+                               name=escape(task['name']))
+
+    def task_listing(self, site):
+        with self.state.lock:
+            tasks = list(self.state.sites.get(site, []))
+        return BESAPI_HEADER + ''.join(
+            self.task_xml(task, site) for task in tasks) + '</BESAPI>'
+
+    def import_content(self, site):
+        with self.state.lock:
+            self.state.import_posts += 1
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            root = ElementTree.fromstring(self.rfile.read(length))
+        except ElementTree.ParseError as error:
+            return self.reply(400, str(error), 'text/plain')
+
+        items = list(root)
+        for item in items:
+            if self.state.reject_marker in (item.findtext('Title') or ''):
+                return self.reply(400, 'Invalid content: %s' %
+                                  item.findtext('Title'), 'text/plain')
+
+        created = []
+        with self.state.lock:
+            for item in items:
+                self.state.next_id += 1
+                wrapper = ElementTree.Element('BES')
+                wrapper.append(item)
+                created.append(dict(
+                    _modified_now(),
+                    type=item.tag,
+                    id=self.state.next_id,
+                    name=item.findtext('Title') or '',
+                    content=ElementTree.tostring(wrapper, encoding='unicode')))
+            self.state.sites.setdefault(site, []).extend(created)
+            reported = created[:len(created) - self.state.drop_import_ids]
+
+        self.reply(200, BESAPI_HEADER + ''.join(
+            self.task_xml(task, site) for task in reported) + '</BESAPI>')
+
+    def receive_part(self):
+        with self.state.lock:
+            self.state.part_requests += 1
+            failing = (self.state.fail_parts_after is not None and
+                       self.state.part_requests > self.state.fail_parts_after)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        if failing:
+            return self.reply(503, 'Injected failure', 'text/plain')
+
+        # Content-Range: bytes <first>-<last>/<total>
+        span, total = self.headers['Content-Range'].split()[-1].split('/')
+        first = int(span.split('-')[0])
+        total = int(total)
+        disposition = self.headers.get('Content-Disposition', '')
+        name = disposition.split('filename="')[-1].rstrip('"') or 'upload'
+        key = (self.headers.get('X-File-SHA1', ''), name)
+
+        with self.state.lock:
+            upload = self.state.partial.setdefault(key, {})
+            upload[first] = body
+            received = sum(len(chunk) for chunk in upload.values())
+            if received < total:
+                return self.reply(202, 'Part received', 'text/plain')
+
+            data = b''.join(upload[offset] for offset in sorted(upload))
+            del self.state.partial[key]
+            sha1 = hashlib.sha1(data).hexdigest()
+            record = {'name': name, 'sha1': sha1,
+                      'sha256': hashlib.sha256(data).hexdigest(),
+                      'size': len(data)}
+            self.state.uploads[(sha1, name)] = record
+
+        self.reply(200, UPLOAD_XML % dict(record, base=self.base))
+
+
+def start_server(host='127.0.0.1', port=0, handler=StubHandler):
+    """
+    Serve the stub on a background thread. Returns (server, base_url);
+    call server.shutdown() when done.
+    """
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.state = StubState()
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server, 'http://%s:%d' % server.server_address[:2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[2])
+    parser.add_argument('--port', type=int, default=52311)
+    args = parser.parse_args()
+
+    server, url = start_server(port=args.port)
+    print("Serving stub BigFix REST API on %s" % url)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -16,27 +16,59 @@ Adding support for python3
 from __future__ import absolute_import
 
 import os
-import base64
-import hashlib
+import sys
+import json
 import getpass
 import datetime
-import subprocess
+import time
 
 
 from time import gmtime, strftime
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
 from lxml import etree
-import plistlib
 from autopkglib import Processor, ProcessorError, get_autopkg_version
 
+# Shared BES helper modules live in BESHelpers next to the processors, out
+# of the directory autopkglib loads every .py file from as a processor.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'BESHelpers'))
+import BESHTTP
+import BESIcon
+from BESCache import shared_cache_dir
+from BESFingerprint import (FINGERPRINT_MIME, VOLATILE_MIME, ContentHasher,
+                            input_fingerprint)
+from BESHashing import cached_hash_file, hash_file
+from BESQnA import get_pool, DEFAULT_TIMEOUT
+from BESSchema import DEFAULT_SCHEMA, validate_file
+from BESProfile import profiled, PROFILE_INPUTS, PROFILE_OUTPUTS
+from BESTimings import timed, NULL_TIMER, TIMING_INPUTS, TIMING_OUTPUTS
+
 
 __all__ = ["AutoPkgBESEngine"]
 __version__ = '2.0'
 
 QNA = '/usr/local/bin/QnA'
 
+XSI_NAMESPACE = "http://www.w3.org/2001/XMLSchema-instance"
+ROOT_NSMAP = {'xsi': XSI_NAMESPACE}
+ROOT_SCHEMA = {"{%s}noNamespaceSchemaLocation" % XSI_NAMESPACE: 'BES.xsd'}
+
+MODIFICATION_TIME_MIME = 'x-fixlet-modification-time'
+
+# Inputs that change the generated task. Cache locations, timeouts and
+# the like are left out so changing them does not force a rebuild.
+FINGERPRINT_INPUTS = (
+    "NAME", "url", "bes_overrideurl", "skip_prefetch", "filesize",
+    "bes_filename", "bes_prefetch", "bes_version", "bes_title",
+    "bes_description", "bes_category", "bes_relevance", "bes_actions",
+    "bes_preactionscript", "bes_postactionscript", "bes_ssa",
+    "bes_ssaaction", "bes_icon", "bes_icon_max_size",
+    "bes_additionalmimefields", "SSATitle", "OfferCategory",
+    "OfferDescriptionHTML",
+)
+
 class AutoPkgBESEngine(Processor):
     """
     AutoPkg Processor for BES (BigFix) XML Tasks and Fixlets
@@ -105,11 +137,95 @@ class AutoPkgBESEngine(Processor):
             "description":
                 "Base64 encoded icon to add to self-service app UI metadata."
         },
+        "bes_icon_max_size": {
+            "required": False,
+            "description": (
+                "Largest icon edge in pixels before it is downscaled and "
+                "recompressed as PNG, defaults to 256. 0 keeps the original.")
+        },
+        "bes_icon_cache_dir": {
+            "required": False,
+            "description": (
+                "Directory for the encoded icon cache, defaults to "
+                "%RECIPE_CACHE_DIR%. Set to '' to disable.")
+        },
         "bes_additionalmimefields": {
             "required": False,
             "description":
                 "A dictionary of additional MIME fields to add to the task."
         },
+        "bes_xml_writer": {
+            "required": False,
+            "description": (
+                "'tree' builds the whole document in memory before writing "
+                "it, 'stream' writes it element by element. Both produce "
+                "identical files; 'stream' uses far less memory for tasks "
+                "with large scripts or icons. Defaults to 'tree'.")
+        },
+        "bes_force_rebuild": {
+            "required": False,
+            "description": (
+                "Rebuild the task even when its inputs are unchanged since "
+                "the last run, defaults to False.")
+        },
+        "bes_validate_xsd": {
+            "required": False,
+            "description": (
+                "Validate the written task against BES.xsd and fail the "
+                "recipe if it is invalid, defaults to False.")
+        },
+        "bes_xsd_path": {
+            "required": False,
+            "description": (
+                "Path to the BES.xsd to validate with, defaults to "
+                "the one in BESHelpers.")
+        },
+        "bes_http_timeout": {
+            "required": False,
+            "description": (
+                "Seconds to wait on URL resolution and icon downloads, "
+                "either 'read' or 'connect,read'. Defaults to 10,60.")
+        },
+        "bes_redirect_cache_ttl": {
+            "required": False,
+            "description": (
+                "Seconds to reuse a resolved prefetch URL before revalidating "
+                "it, or a dictionary of host to seconds with an optional "
+                "'default'. Defaults to 86400.")
+        },
+        "bes_redirect_refresh": {
+            "required": False,
+            "description":
+                "Ignore the redirect cache and resolve the URL again, defaults to False."
+        },
+        "bes_redirect_cache_dir": {
+            "required": False,
+            "description": (
+                "Directory for the redirect cache, defaults to "
+                "%RECIPE_CACHE_DIR%. Set to '' to disable.")
+        },
+        "bes_qna_path": {
+            "required": False,
+            "description":
+                "Path to the QnA utility, defaults to /usr/local/bin/QnA."
+        },
+        "bes_qna_timeout": {
+            "required": False,
+            "description":
+                "Seconds to wait for each QnA answer, defaults to 30."
+        },
+        "bes_qna_concurrency": {
+            "required": False,
+            "description":
+                "Number of relevance lines to validate at once, defaults to 4."
+        },
+        "bes_digest_cache_dir": {
+            "required": False,
+            "description": (
+                "Directory for the persistent sha1/sha256/size cache, "
+                "defaults to %RECIPE_CACHE_DIR%. Point several recipes at "
+                "one directory to share it, or set to '' to disable.")
+        },
         "skip_prefetch": {
             "required": False,
             "description":
@@ -121,9 +237,29 @@ class AutoPkgBESEngine(Processor):
             "description":
                 "The file path to the final .bes file."
         },
+        "bes_fingerprint": {
+            "description": (
+                "Content fingerprint of the task, also stored in its %s "
+                "MIME field." % FINGERPRINT_MIME)
+        },
+        "bes_icon_bytes_saved": {
+            "description":
+                "Bytes removed from the task by downscaling the self-service icon."
+        },
+        "bes_rebuilt": {
+            "description": (
+                "True if the task was written by this run, False if the "
+                "last build was reused because its inputs are unchanged.")
+        },
     }
+    input_variables.update(TIMING_INPUTS)
+    output_variables.update(TIMING_OUTPUTS)
+    input_variables.update(PROFILE_INPUTS)
+    output_variables.update(PROFILE_OUTPUTS)
     __doc__ = description
 
+    timer = NULL_TIMER
+
     def __init__(self, env):
         self.env = env
         self.doc = etree.ElementTree()
@@ -133,62 +269,61 @@ class AutoPkgBESEngine(Processor):
         Return a direct url for a download link and spoof the User-Agent.
         """
 
-        useragentsplist = ('/Applications/Safari.app/Contents/Resources/UserAgents.plist')
         # Source: https://github.com/autopkg/autopkg/blob/34874d2f1f91dadfdafaaf5aba63f8231936657f/Code/autopkglib/PlistEditor.py
-        useragents = ""
-        if not useragentsplist:
-            return {}
         try:
-            with open(useragentsplist, "rb") as f:
-                useragents = plistlib.load(f)
+            useragent = BESHTTP.user_agent()
         except Exception as err:
-            raise ProcessorError("Could not read user agent plist: {err}")
-            
-        useragent = useragents[0]['user-agent']
-
-        headers = {'User-Agent' : useragent.encode('ascii')}
-        request = requests.head(url, headers=headers)
+            raise ProcessorError("Could not read user agent plist: %s" % err)
+
+        cache_dir = shared_cache_dir(self.env, "bes_redirect_cache_dir")
+
+        headers = {'User-Agent' : useragent}
+        with self.timer.phase('resolve_url'):
+            location, how = BESHTTP.resolve_location(
+                url, headers=headers,
+                cache=BESHTTP.RedirectCache(cache_dir) if cache_dir else None,
+                ttl=BESHTTP.host_ttl(self.env.get("bes_redirect_cache_ttl"), url),
+                force=str(self.env.get("bes_redirect_refresh")) in ['True', 'true'],
+                timeout=BESHTTP.parse_timeout(self.env.get("bes_http_timeout")))
+
+        if how == 'stale':
+            self.output("Could not reach %s, using cached location: %s" % (
+                url, location))
+        else:
+            self.output("Resolved %s (%s): %s" % (url, how, location),
+                        verbose_level=2)
 
-        return request.headers.get('location', request.url).encode('ascii')
+        return location.encode('ascii')
 
     def get_prefetch(self, file_path, file_name, url):
         """
         Return a prepared prefetch statement string.
         """
 
-        sha1 = self.get_sha1(file_path)
-        sha256 = self.get_sha256(file_path)
-        size = self.get_size(file_path)
+        digests = self.get_digests(file_path)
 
-        return "prefetch %s sha1:%s size:%d %s sha256:%s" % (file_name, sha1,
-                                                             size, url.decode(), sha256)
+        return "prefetch %s sha1:%s size:%d %s sha256:%s" % (file_name,
+                                                             digests['sha1'],
+                                                             digests['size'],
+                                                             url.decode(),
+                                                             digests['sha256'])
 
-    def get_sha1(self, filename=""):
+    def get_digests(self, filename=""):
+        """
+        Return the sha1, sha256 and size of a file from a single read.
+        """
         if not filename:
             filename = self.env.get("bes_softwareinstaller", self.env.get("pathname"))
-        h  = hashlib.sha1()
-        with open(filename, 'rb') as file:
-            while True:
-                # Reading is buffered, so we can read smaller chunks.
-                chunk = file.read(h.block_size)
-                if not chunk:
-                    break
-                h.update(chunk)
-        return h.hexdigest()
-
-    #https://stackoverflow.com/questions/22058048/hashing-a-file-in-python
+
+        with self.timer.phase('hash'):
+            return cached_hash_file(filename, shared_cache_dir(
+                self.env, "bes_digest_cache_dir"))
+
+    def get_sha1(self, filename=""):
+        return self.get_digests(filename)['sha1']
+
     def get_sha256(self, filename=""):
-        if not filename:
-            filename = self.env.get("bes_softwareinstaller", self.env.get("pathname"))
-        h  = hashlib.sha256()
-        with open(filename, 'rb') as file:
-            while True:
-                # Reading is buffered, so we can read smaller chunks.
-                chunk = file.read(h.block_size)
-                if not chunk:
-                    break
-                h.update(chunk)
-        return h.hexdigest()
+        return self.get_digests(filename)['sha256']
 
     def get_size(self, file_path=""):
         if not file_path:
@@ -197,13 +332,84 @@ class AutoPkgBESEngine(Processor):
         return os.path.getsize(file_path)
 
     def get_icon(self, bes_icon):
-        r = requests.get(bes_icon)
+        cache_dir = shared_cache_dir(self.env, "bes_icon_cache_dir")
+
+        # Overrides often leave the value empty to mean the default
+        max_size = self.env.get("bes_icon_max_size")
+        if max_size in (None, ''):
+            max_size = BESIcon.DEFAULT_MAX_SIZE
+        try:
+            max_size = int(max_size)
+        except (TypeError, ValueError):
+            raise ProcessorError("bes_icon_max_size must be a whole number "
+                                 "of pixels, not %r" % (max_size,))
+
+        with self.timer.phase('icon'):
+            data_uri, stats = BESIcon.fetch_icon(
+                bes_icon,
+                cache=BESIcon.IconCache(cache_dir) if cache_dir else None,
+                max_size=max_size,
+                timeout=BESHTTP.parse_timeout(self.env.get("bes_http_timeout")))
+
+        self.env['bes_icon_bytes_saved'] = stats['bytes_saved']
+        self.output("Icon %s: %d bytes, %d bytes after resizing, "
+                    "%d bytes saved in task" % (stats['source'],
+                                                stats['original_bytes'],
+                                                stats['final_bytes'],
+                                                stats['bytes_saved']))
+
+        return data_uri
+
+    def get_input_fingerprint(self, skip_prefetch):
+        """
+        Return a fingerprint of everything the task is built from: the
+        inputs in FINGERPRINT_INPUTS, the installer's digests and this
+        processor's version.
+        """
+        inputs = dict((key, self.env.get(key)) for key in FINGERPRINT_INPUTS)
+
+        # Volatile fields would defeat the comparison
+        if isinstance(inputs["bes_additionalmimefields"], dict):
+            inputs["bes_additionalmimefields"] = dict(
+                (name, value) for name, value in
+                inputs["bes_additionalmimefields"].items()
+                if name not in VOLATILE_MIME)
 
-        b64content = base64.b64encode(r.content)
-        #content_type = r.headers['Content-Type']
-        content_type = "image/%s" % r.url.split('.')[-1]
+        if not skip_prefetch:
+            inputs["digests"] = self.get_digests()
+        inputs["source"] = [os.path.basename(__file__), __version__,
+                            str(get_autopkg_version()), getpass.getuser()]
 
-        return "data:%s;base64,%s" % (content_type, b64content.decode())
+        return input_fingerprint(inputs)
+
+    def load_build_record(self, bes_file, fingerprint):
+        """
+        Return the outputs saved with bes_file if it was built from inputs
+        with the same fingerprint and its bytes are unchanged since,
+        otherwise None.
+        """
+        try:
+            with open(bes_file + '.inputs.json', 'r') as file_handle:
+                record = json.load(file_handle)
+            if record.get('inputs') != fingerprint:
+                return None
+            # Any edit counts, not only one that updates the fingerprint field
+            if hash_file(bes_file, ('sha256',))['sha256'] != record['sha256']:
+                return None
+            outputs = record['outputs']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+        return outputs
+
+    def save_build_record(self, bes_file, fingerprint, outputs):
+        """Save the input fingerprint, file digest and outputs next to bes_file."""
+        try:
+            sha256 = hash_file(bes_file, ('sha256',))['sha256']
+            with open(bes_file + '.inputs.json', 'w') as file_handle:
+                json.dump({'inputs': fingerprint, 'sha256': sha256,
+                           'outputs': outputs}, file_handle)
+        except (IOError, OSError) as error:
+            self.output("Could not save build record: %s" % error)
 
     def new_node(self, element_name, node_text="", element_attributes={}):
         """
@@ -310,30 +516,162 @@ class AutoPkgBESEngine(Processor):
 
         return new_action_element
 
+    def task_elements(self, task):
+        """
+        Yield the children of the Task element in document order, built
+        one at a time from the values main() prepared.
+        """
+        # Title and Description
+        yield self.new_node('Title', task['title'])
+        yield self.new_node('Description', task['description'])
+
+        # Relevance
+        for line in task['relevance']:
+            yield self.new_node('Relevance', line)
+
+        # Details Dictionary
+        for key, value in task['details'].items():
+            yield self.new_node(key, value)
+
+        # Self-Service UI Data
+        if task['ui_metadata'] is not None:
+            yield self.new_mime('action-ui-metadata', task['ui_metadata'])
+
+        # MIME Source Data, Additional MIME Fields and Modification Time
+        yield self.new_mime('x-fixlet-source', task['source'])
+        for name, value in task['mime_fields']:
+            yield self.new_mime(name, value)
+        yield self.new_mime(MODIFICATION_TIME_MIME, task['modification_time'])
+
+        yield self.new_node('Domain', 'BESC')
+
+        # Actions
+        for action_dict, ssa in task['actions']:
+            yield self.new_action(action_dict, ssa=ssa)
+
+    def write_tree(self, bes_file, task):
+        """
+        Build the whole document tree, then write it. Returns the content
+        fingerprint.
+        """
+        root = self.new_node('BES', None, ROOT_SCHEMA)
+        self.doc._setroot(root)
+
+        # Create Top Level 'Task' Tag
+        node = self.new_node('Task', None)
+        root.append(node)
+
+        # Hash each child before it joins the tree, as write_stream() does,
+        # rather than canonicalizing a copy of the finished document
+        hasher = ContentHasher(ROOT_SCHEMA, ROOT_NSMAP)
+        for element in self.task_elements(task):
+            hasher.update(element)
+            node.append(element)
+
+        # Add Content Fingerprint, once the rest of the task is complete
+        bes_fingerprint = hasher.hexdigest()
+        for element in node.iterchildren('MIMEField'):
+            if element.findtext('Name') == MODIFICATION_TIME_MIME:
+                element.addnext(self.new_mime(FINGERPRINT_MIME,
+                                              bes_fingerprint))
+                break
+
+        self.doc.write(bes_file, encoding="UTF-8", xml_declaration=True)
+        return bes_fingerprint
+
+    def write_stream(self, bes_file, task):
+        """
+        Write the document one Task child at a time with lxml's incremental
+        xmlfile writer, never holding more than one element in memory. The
+        elements are generated twice, first to compute the content
+        fingerprint that precedes the actions. The output is byte-identical
+        to write_tree(). Returns the content fingerprint.
+        """
+        hasher = ContentHasher(ROOT_SCHEMA, ROOT_NSMAP)
+        for element in self.task_elements(task):
+            hasher.update(element)
+        bes_fingerprint = hasher.hexdigest()
+
+        with etree.xmlfile(bes_file, encoding="UTF-8") as xml_file:
+            xml_file.write_declaration()
+            with xml_file.element('BES', ROOT_SCHEMA, nsmap=ROOT_NSMAP):
+                with xml_file.element('Task'):
+                    for element in self.task_elements(task):
+                        xml_file.write(element)
+                        if (element.tag == 'MIMEField' and
+                                element.findtext('Name') == MODIFICATION_TIME_MIME):
+                            xml_file.write(self.new_mime(FINGERPRINT_MIME,
+                                                         bes_fingerprint))
+        return bes_fingerprint
+
+    def get_qna_pool(self, workers=1):
+        """
+        Return the shared QnA session pool.
+        """
+        return get_pool(self.env.get("bes_qna_path", QNA),
+                        workers=workers,
+                        timeout=float(self.env.get("bes_qna_timeout",
+                                                   DEFAULT_TIMEOUT)))
+
     def validate_relevance(self, relevance):
         """
         Validate a line of relevance by parsing the output of the QnA utility.
         """
+        return self.validate_relevance_lines([relevance])
+
+    def validate_relevance_lines(self, relevance_lines):
+        """
+        Validate lines of relevance concurrently across QnA sessions.
+        Errors are reported in the original line order.
+        """
+        concurrency = max(1, min(int(self.env.get("bes_qna_concurrency", 4)),
+                                 len(relevance_lines)))
+
+        def timed_evaluate(relevance):
+            start = time.time()
+            result = pool.evaluate(relevance)
+            return result, time.time() - start
+
         try:
-            proc = subprocess.Popen(QNA,
-                                    bufsize=-1,
-                                    stdin=subprocess.PIPE,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE)
-            out, err = proc.communicate(relevance.encode())
-
-            output = {}
-            for line in out.decode().strip().split('\n'):
-                output[line.split(':')[0].strip()] = line.split(':')[1].strip()
-
-            if output.get('E', None):
-                self.output("Relevance Error: {%s} -- %s" %
-                            (relevance, output.get('E')))
+            pool = self.get_qna_pool(concurrency)
+
+            start = time.time()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                timed_results = list(executor.map(timed_evaluate,
+                                                  relevance_lines))
+            wall_time = time.time() - start
+
+            for result, _ in timed_results:
+                if result.error:
+                    self.output("Relevance Error: {%s} -- %s" %
+                                (result.relevance, result.error))
+
+            self.output("Validated %d relevance lines in %.3fs "
+                        "(%.3fs summed per line, %d at a time)" % (
+                            len(relevance_lines), wall_time,
+                            sum(elapsed for _, elapsed in timed_results),
+                            concurrency))
             return True
         except Exception as error:
-            self.output("Relevance Error: (%s) -- %s" % (QNA, error))
+            self.output("Relevance Error: (%s) -- %s" % (
+                self.env.get("bes_qna_path", QNA), error))
             return True
 
+    def validate_xsd(self, bes_file):
+        """Raise ProcessorError if bes_file does not validate against BES.xsd."""
+        schema_path = self.env.get("bes_xsd_path") or DEFAULT_SCHEMA
+        if not os.path.isfile(schema_path):
+            raise ProcessorError("Schema not found: %s" % schema_path)
+
+        result = validate_file(bes_file, schema_path)
+        if not result['valid']:
+            raise ProcessorError("%s does not validate against %s:\n%s" % (
+                bes_file, schema_path, '\n'.join(result['errors'][:10])))
+        self.output("Validated against %s in %.3fs" % (
+            schema_path, result['seconds']), verbose_level=2)
+
+    @profiled
+    @timed
     def main(self):
         """
         Create a BES software distribution task.
@@ -344,7 +682,24 @@ class AutoPkgBESEngine(Processor):
         # Check for URL, set to skip 
         if ((self.env.get("bes_overrideurl") == None) and (self.env.get("url") == None)) or (self.env.get("skip_prefetch") == "True"):
             skipPrefetch = True
-        else:
+
+        # Reuse the last build if nothing it was built from has changed
+        bes_file = "%s/Deploy %s %s.bes" % (self.env.get("RECIPE_CACHE_DIR"),
+                                            self.env.get("NAME"),
+                                            self.env.get("bes_version"))
+        inputs_fingerprint = self.get_input_fingerprint(skipPrefetch)
+        if str(self.env.get("bes_force_rebuild")) not in ['True', 'true']:
+            with self.timer.phase('build_record'):
+                outputs = self.load_build_record(bes_file, inputs_fingerprint)
+            if outputs is not None:
+                self.env.update(outputs)
+                self.env['bes_file'] = bes_file
+                self.env['bes_rebuilt'] = False
+                self.output("Inputs unchanged, reusing BES File: '%s'" %
+                            bes_file)
+                return
+
+        if not skipPrefetch:
             # Assign Application Variables
             url = self.get_direct_url(
                 self.env.get("bes_overrideurl",
@@ -437,64 +792,27 @@ class AutoPkgBESEngine(Processor):
         self.output("Building 'Deploy %s %s.bes'" %
                     (bes_displayname, bes_version))
 
-        root_schema = {
-            "{http://www.w3.org/2001/XMLSchema-instance}" +
-            "noNamespaceSchemaLocation": 'BES.xsd'
-        }
-
-        root = self.new_node('BES', None, root_schema)
-        self.doc._setroot(root)
-
-        # Create Top Level 'Task' Tag
-        node = self.new_node('Task', None)
-        root.append(node)
-
-        # Append Title and Description
-        node.append(self.new_node('Title', bes_title))
-        node.append(self.new_node('Description', bes_description))
-
-        # Append Relevance
-        for line in bes_relevance:
-            if os.path.isfile(QNA):
-                self.validate_relevance(line)
-
-            node.append(self.new_node('Relevance', line))
-
-        # Append Details Dictionary
-        for key, value in details.items():
-            node.append(self.new_node(key, value))
+        # Validate Relevance
+        if bes_relevance and os.path.isfile(self.env.get("bes_qna_path", QNA)):
+            with self.timer.phase('qna'):
+                self.validate_relevance_lines(bes_relevance)
 
         # Add Self-Service UI Data, If Specified
+        ui_metadata = None
         if bes_ssa in ['True', 'true']:
             if bes_icon:
                 bes_b64icon = self.get_icon(bes_icon)
-                node.append(self.new_mime('action-ui-metadata',
-                                          ("{\"version\": \"%s\","
-                                           "\"size\": \"%s\","
-                                           "\"icon\": \"%s\"}") % (bes_version,
-                                                                   bes_size,
-                                                                   bes_b64icon)))
+                ui_metadata = ("{\"version\": \"%s\","
+                               "\"size\": \"%s\","
+                               "\"icon\": \"%s\"}") % (bes_version,
+                                                      bes_size,
+                                                      bes_b64icon)
             else:
-                node.append(self.new_mime('action-ui-metadata',
-                                          '{"version": "%s", "size": "%s"}' % (bes_version,
-                                                                               bes_size)))
-
-        # Append MIME Source Data
-        node.append(self.new_mime('x-fixlet-source',
-                                  fileBaseName))
+                ui_metadata = '{"version": "%s", "size": "%s"}' % (bes_version,
+                                                                   bes_size)
 
-        # Add Additional MIME Fields
-        if bes_additionalmimefields:
-            for name, value in bes_additionalmimefields.items():
-                node.append(self.new_mime(name, value))
-
-        # Add Modification Time
-        node.append(
-            self.new_mime('x-fixlet-modification-time', gmtime_now))
-
-        node.append(self.new_node('Domain', 'BESC'))
-
-        # Append Default Action
+        # Order Actions, Default Action first
+        actions = []
         bes_ssaaction_copy = None
         for action in sorted(bes_actions.keys()):
 
@@ -502,30 +820,55 @@ class AutoPkgBESEngine(Processor):
                 bes_ssaaction_copy = bes_actions[action]
 
             if bes_actions[action].get('ActionName', None) == 'DefaultAction':
-                node.append(self.new_action(bes_actions[action]))
+                actions.append((bes_actions[action], False))
                 bes_actions.pop(action, None)
 
-        # Append Actions
         for action in sorted(bes_actions.keys()):
-            node.append(self.new_action(bes_actions[action]))
+            actions.append((bes_actions[action], False))
 
-        # Append SSA Action
+        # SSA Action last
         if bes_ssaaction and bes_ssaaction_copy:
+                bes_ssaaction_copy = dict(bes_ssaaction_copy)
                 bes_ssaaction_copy['Description'] = ['',
                                                      'Make available',
                                                      ' in Self Service']
                 bes_ssaaction_copy['ActionNumber'] = 'Action10'
                 bes_ssaaction_copy['ActionName'] = 'Action'
 
-                node.append(self.new_action(bes_ssaaction_copy, ssa=True))
+                actions.append((bes_ssaaction_copy, True))
+
+        task = {
+            'title': bes_title,
+            'description': bes_description,
+            'relevance': bes_relevance,
+            'details': details,
+            'ui_metadata': ui_metadata,
+            'source': fileBaseName,
+            'mime_fields': list((bes_additionalmimefields or {}).items()),
+            'modification_time': gmtime_now,
+            'actions': actions,
+        }
 
         # Write Final BES File to Disk
-        bes_file = "%s/Deploy %s %s.bes" % (self.env.get("RECIPE_CACHE_DIR"),
-                                            bes_displayname, bes_version)
+        with self.timer.phase('xml_write'):
+            if self.env.get("bes_xml_writer", "tree") == "stream":
+                bes_fingerprint = self.write_stream(bes_file, task)
+            else:
+                bes_fingerprint = self.write_tree(bes_file, task)
+        self.env['bes_fingerprint'] = bes_fingerprint
 
-        self.doc.write(bes_file, encoding="UTF-8", xml_declaration=True)
+        if str(self.env.get("bes_validate_xsd")) in ['True', 'true']:
+            with self.timer.phase('validate_xsd'):
+                self.validate_xsd(bes_file)
+
+        outputs = {'bes_fingerprint': bes_fingerprint}
+        if 'bes_icon_bytes_saved' in self.env:
+            outputs['bes_icon_bytes_saved'] = self.env['bes_icon_bytes_saved']
+        with self.timer.phase('build_record'):
+            self.save_build_record(bes_file, inputs_fingerprint, outputs)
 
         self.env['bes_file'] = bes_file
+        self.env['bes_rebuilt'] = True
         self.output("Output BES File: '%s'" % self.env.get("bes_file"))
 
 if __name__ == "__main__":
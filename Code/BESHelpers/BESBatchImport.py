@@ -0,0 +1,280 @@
+#!/usr/local/autopkg/python
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+BESBatchImport.py
+
+Batch import of many .bes files into a BigFix custom site.
+
+The content of the files is merged into multi-document BES payloads of
+up to max_bytes each, and each payload is imported with a single POST to
+tasks/custom/<site>. The IDs the console returns come back in document
+order and are mapped back to the file each item came from. If the console
+rejects a merged payload, its files are retried one at a time so that one
+bad file does not fail the rest. A payload the console accepted but whose
+IDs cannot be mapped is never posted again, since its items already exist.
+
+Used by BESImporter when bes_files is set, and runnable on its own:
+
+  BESBatchImport.py --site SITE [--server URL] [--user NAME] PATH [PATH ...]
+
+BES_ROOT_SERVER, BES_USERNAME and BES_PASSWORD are read from the
+environment when the options are not given.
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import glob
+import getpass
+import argparse
+
+from lxml import etree
+
+__all__ = ["collect_bes_files", "read_bes_file", "build_batches",
+           "batch_payload", "import_files", "UnmappedResponse",
+           "DEFAULT_MAX_BYTES"]
+
+# Keep payloads well under the console's request size limits.
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+
+BES_HEADER = (
+    b'<?xml version="1.0" encoding="UTF-8"?>\n'
+    b'<BES xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    b'xsi:noNamespaceSchemaLocation="BES.xsd">')
+BES_FOOTER = b'</BES>'
+
+
+class BESFile(object):
+    """The serialized content items of one .bes file."""
+
+    def __init__(self, path, items, titles):
+        self.path = path
+        self.items = items
+        self.titles = titles
+        self.size = sum(len(item) for item in items)
+
+
+class UnmappedResponse(Exception):
+    """The console accepted a payload but its IDs could not be mapped."""
+
+
+def collect_bes_files(paths):
+    """
+    Expand a list of files and directories into a sorted list of .bes
+    files. A single string is treated as a one-item list.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.bes'))))
+        else:
+            files.append(path)
+    return files
+
+
+def read_bes_file(path):
+    """Read a .bes file into a BESFile with one serialized item per content element."""
+    root = etree.parse(path).getroot()
+    items = []
+    titles = []
+    for element in root:
+        if not isinstance(element.tag, str):
+            continue
+        items.append(etree.tostring(element, encoding='UTF-8'))
+        titles.append(element.findtext('Title'))
+    return BESFile(path, items, titles)
+
+
+def build_batches(bes_files, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Group BESFile objects, in order, into lists whose merged payload stays
+    under max_bytes. A file bigger than max_bytes gets a batch of its own.
+    """
+    batch = []
+    size = 0
+    for bes_file in bes_files:
+        if batch and size + bes_file.size > max_bytes:
+            yield batch
+            batch = []
+            size = 0
+        batch.append(bes_file)
+        size += bes_file.size
+    if batch:
+        yield batch
+
+
+def batch_payload(batch):
+    """Return the multi-document BES XML for a batch of BESFile objects."""
+    return b''.join([BES_HEADER] +
+                    [item for bes_file in batch for item in bes_file.items] +
+                    [BES_FOOTER])
+
+
+def _post_batch(connection, site, batch):
+    """
+    POST one batch. Returns the list of (id, name, last_modified) of the
+    created items. Raises ValueError with the console's message if it
+    rejected the payload, or UnmappedResponse if it accepted the payload
+    but answered with something other than one ID per item.
+    """
+    result = connection.post('tasks/custom/%s' % site, batch_payload(batch))
+    status = result.request.status_code
+    if not 200 <= status < 300:
+        raise ValueError("HTTP %s: %s" % (status, result.request.text.strip()))
+
+    try:
+        created = [(element.findtext('ID'), element.findtext('Name'),
+                    element.get('LastModified'))
+                   for element in etree.fromstring(result.request.content)
+                   if isinstance(element.tag, str)]
+    except (ValueError, etree.XMLSyntaxError) as error:
+        raise UnmappedResponse("Imported, IDs unknown: %s" % error)
+
+    expected = sum(len(bes_file.items) for bes_file in batch)
+    if len(created) != expected:
+        raise UnmappedResponse(
+            "Imported, IDs unknown: expected %d IDs in the response, got %d" % (
+                expected, len(created)))
+    return created
+
+
+def _failed(bes_file, error):
+    return {'file': bes_file.path, 'result': 'Failed', 'error': str(error)}
+
+
+def _map_results(batch, created):
+    results = []
+    for bes_file in batch:
+        items = created[:len(bes_file.items)]
+        created = created[len(bes_file.items):]
+        results.append({
+            'file': bes_file.path,
+            'ids': [item[0] for item in items],
+            'names': [item[1] for item in items],
+            'last_modified': [item[2] for item in items],
+            'result': 'Created',
+        })
+    return results
+
+
+def import_files(connection, site, paths, max_bytes=DEFAULT_MAX_BYTES,
+                 existing_titles=None, log=None):
+    """
+    Import the .bes files in paths into a custom site with as few POSTs as
+    the size limit allows. Files whose titles are all in existing_titles
+    are skipped as duplicates.
+
+    Returns one dictionary per file with 'file', 'result' ('Created',
+    'Duplicate' or 'Failed') and the 'ids' and 'names' of its items in
+    order, with their 'last_modified' when created, or the 'error'.
+    """
+    log = log or (lambda message: None)
+    existing_titles = existing_titles or {}
+
+    results = {}
+    pending = []
+    for path in collect_bes_files(paths):
+        try:
+            bes_file = read_bes_file(path)
+        except (IOError, OSError, etree.XMLSyntaxError) as error:
+            results[path] = {'file': path, 'result': 'Failed',
+                             'error': str(error)}
+            continue
+
+        if bes_file.titles and all(title in existing_titles
+                                   for title in bes_file.titles):
+            results[path] = {'file': path, 'result': 'Duplicate',
+                             'ids': [existing_titles[title][0]
+                                     for title in bes_file.titles],
+                             'names': bes_file.titles}
+            continue
+        pending.append(bes_file)
+
+    for batch in build_batches(pending, max_bytes):
+        log("Importing %d files to tasks/custom/%s" % (len(batch), site))
+        try:
+            created = _post_batch(connection, site, batch)
+        except UnmappedResponse as error:
+            # The items were created, so posting them again would duplicate them
+            for bes_file in batch:
+                results[bes_file.path] = _failed(bes_file, error)
+            continue
+        except ValueError as error:
+            if len(batch) == 1:
+                results[batch[0].path] = _failed(batch[0], error)
+                continue
+
+            # Find the file the console rejected by importing one at a time
+            log("Batch rejected (%s), importing its files singly" % error)
+            for bes_file in batch:
+                try:
+                    created = _post_batch(connection, site, [bes_file])
+                except (ValueError, UnmappedResponse) as single_error:
+                    results[bes_file.path] = _failed(bes_file, single_error)
+                    continue
+                for result in _map_results([bes_file], created):
+                    results[result['file']] = result
+            continue
+
+        for result in _map_results(batch, created):
+            results[result['file']] = result
+
+    return [results[path] for path in collect_bes_files(paths)
+            if path in results]
+
+
+def main():
+    from BESConnections import BESConnection
+    from BESSiteIndex import parse_task_listing, open_task_listing, \
+        LISTING_CHUNK_SIZE
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[2])
+    parser.add_argument('paths', nargs='+',
+                        help='.bes files, or directories of them.')
+    parser.add_argument('--site', required=True, help='Custom site name.')
+    parser.add_argument('--server', default=os.environ.get('BES_ROOT_SERVER'))
+    parser.add_argument('--user', default=os.environ.get('BES_USERNAME'))
+    parser.add_argument('--max-bytes', type=int, default=DEFAULT_MAX_BYTES,
+                        help='Largest merged payload to POST.')
+    parser.add_argument('--allow-duplicates', action='store_true',
+                        help='Import files whose titles already exist.')
+    args = parser.parse_args()
+
+    if not args.server or not args.user:
+        parser.error('--server and --user (or BES_ROOT_SERVER and '
+                     'BES_USERNAME) are required')
+    password = os.environ.get('BES_PASSWORD') or getpass.getpass()
+
+    connection = BESConnection(args.user, password, args.server,
+                               verify=False)
+
+    existing_titles = {}
+    if not args.allow_duplicates:
+        response = open_task_listing(connection, args.site)
+        try:
+            existing_titles = parse_task_listing(
+                response.iter_content(LISTING_CHUNK_SIZE))
+        finally:
+            response.close()
+
+    failed = 0
+    for result in import_files(connection, args.site, args.paths,
+                               args.max_bytes, existing_titles, print):
+        if result['result'] == 'Failed':
+            failed += 1
+            print("%s: Failed: %s" % (result['file'], result['error']))
+        else:
+            print("%s: %s [%s]" % (result['file'], result['result'],
+                                   ', '.join(result['ids'])))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.exit(main())
@@ -0,0 +1,155 @@
+#!/usr/local/autopkg/python
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+BESCache.py
+
+Small on-disk JSON caches shared by the BES (BigFix) processors.
+
+Each cache is a single JSON file. Reads and updates hold a flock() on a
+sidecar lock file and writes go through an atomic rename, so several
+autopkg processes can share one cache directory. Entries can expire
+after a TTL and the least recently used ones are evicted past
+max_entries.
+"""
+from __future__ import absolute_import
+
+import os
+import json
+import time
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__all__ = ["JSONCache", "shared_cache_dir"]
+
+
+def shared_cache_dir(env, key=None, shared=False):
+    """
+    Return the cache directory to use for a processor env: the value of
+    the key input if set, otherwise RECIPE_CACHE_DIR. With shared set, the
+    default is the cache directory every recipe shares instead (CACHE_DIR,
+    or the parent of RECIPE_CACHE_DIR). An empty string disables caching
+    and is returned as None.
+    """
+    if key and key in env:
+        return env.get(key) or None
+    recipe_cache_dir = env.get("RECIPE_CACHE_DIR") or None
+    if shared:
+        if env.get("CACHE_DIR"):
+            return env.get("CACHE_DIR")
+        if recipe_cache_dir:
+            return os.path.dirname(recipe_cache_dir.rstrip(os.sep))
+    return recipe_cache_dir
+
+
+class JSONCache(object):
+    """A locked, size-bounded JSON dictionary on disk."""
+
+    MAX_ENTRIES = 1000
+
+    def __init__(self, cache_dir, filename, max_entries=MAX_ENTRIES, ttl=None):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = os.path.join(cache_dir, filename)
+        self.lock_path = self.path + '.lock'
+
+    def _lock(self, exclusive):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        handle = open(self.lock_path, 'a')
+        if fcntl:
+            fcntl.flock(handle, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        return handle
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as file_handle:
+                entries = json.load(file_handle)
+            if isinstance(entries, dict):
+                return entries
+        except (IOError, OSError, ValueError):
+            pass
+        return {}
+
+    def _save(self, entries):
+        handle, temp_path = tempfile.mkstemp(
+            dir=self.cache_dir,
+            prefix='.%s.' % os.path.basename(self.path))
+        try:
+            with os.fdopen(handle, 'w') as file_handle:
+                json.dump(entries, file_handle)
+            os.rename(temp_path, self.path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def _expired(self, entry, now):
+        return bool(self.ttl) and now - entry.get('created', 0) > self.ttl
+
+    def get_entry(self, key, validate=None):
+        """
+        Return the raw entry for key, or None if it is missing, expired
+        or rejected by validate(entry). A hit marks the entry as used.
+        """
+        now = time.time()
+        with self._lock(exclusive=True):
+            entries = self._load()
+            entry = entries.get(key)
+
+            if not entry or 'value' not in entry or self._expired(entry, now):
+                return None
+            if validate is not None and not validate(entry):
+                return None
+
+            entry['last_used'] = now
+            self._save(entries)
+            return entry
+
+    def get(self, key, validate=None):
+        """Return the cached value for key, or None."""
+        entry = self.get_entry(key, validate)
+        if entry is None:
+            return None
+        return entry['value']
+
+    def put(self, key, value, **metadata):
+        """Store value under key with optional metadata fields."""
+        now = time.time()
+
+        entry = dict(metadata)
+        entry['value'] = value
+        entry['created'] = now
+        entry['last_used'] = now
+
+        with self._lock(exclusive=True):
+            entries = self._load()
+            entries[key] = entry
+
+            for stale in [name for name in entries
+                          if self._expired(entries[name], now)]:
+                del entries[stale]
+
+            if len(entries) > self.max_entries:
+                oldest = sorted(entries,
+                                key=lambda name: entries[name].get('last_used', 0))
+                for name in oldest[:len(entries) - self.max_entries]:
+                    del entries[name]
+
+            self._save(entries)
+
+    def delete(self, key):
+        with self._lock(exclusive=True):
+            entries = self._load()
+            if entries.pop(key, None) is not None:
+                self._save(entries)
+
+    def clear(self):
+        with self._lock(exclusive=True):
+            self._save({})
@@ -0,0 +1,116 @@
+#!/usr/local/autopkg/python
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+BESConnections.py
+
+Process-wide, authenticated BigFix REST API connections shared by the
+BES (BigFix) processors.
+
+get_connection() keeps one besapi BESConnection per root server and user
+for the life of the process. A recipe that uploads and then imports, or
+an autopkg run of many recipes, therefore logs in and sets up its
+keep-alive connections only once. Every response received on a managed
+connection is timed (time to response headers, from requests), and
+latency_stats() reports counts and times per method and API resource.
+"""
+from __future__ import absolute_import
+
+import time
+import threading
+from urllib.parse import urlsplit
+
+try:
+    # Current besapi releases keep the class in the besapi.besapi module
+    from besapi.besapi import BESConnection
+except ImportError:
+    from besapi import BESConnection
+
+import BESHTTP
+
+__all__ = ["get_connection", "latency_stats", "reset_latency_stats"]
+
+_LOCK = threading.Lock()
+_STATS_LOCK = threading.Lock()
+_CONNECTIONS = {}
+_STATS = {}
+
+
+def _normalize(root_server):
+    # The same defaults besapi applies, so equivalent spellings share a key
+    root_server = root_server.rstrip('/')
+    if not root_server.startswith('http'):
+        root_server = 'https://' + root_server
+    if root_server.count(':') != 2:
+        root_server = root_server + ':52311'
+    return root_server.lower()
+
+
+def _resource(url):
+    """'https://bes:52311/api/task/custom/Site/12' -> 'task'"""
+    path = urlsplit(url).path
+    if '/api/' in path:
+        path = path.split('/api/', 1)[1]
+    return path.strip('/').split('/')[0] or '/'
+
+
+def _record(key, seconds):
+    with _STATS_LOCK:
+        stats = _STATS.setdefault(key, {'count': 0, 'total_seconds': 0.0,
+                                        'max_seconds': 0.0})
+        stats['count'] += 1
+        stats['total_seconds'] += seconds
+        stats['max_seconds'] = max(stats['max_seconds'], seconds)
+
+
+def _record_latency(response, *args, **kwargs):
+    _record('%s %s' % (response.request.method, _resource(response.request.url)),
+            response.elapsed.total_seconds())
+
+
+def get_connection(root_server, username, password, verify=False):
+    """
+    Return the shared, logged in besapi BESConnection for root_server and
+    username, creating it on first use. A connection is replaced if it was
+    created with a different password or verify setting.
+    """
+    key = (_normalize(root_server), username)
+    with _LOCK:
+        connection = _CONNECTIONS.get(key)
+        if (connection is not None and
+                connection.session.auth == (username, password) and
+                connection.verify == verify):
+            return connection
+
+        # besapi logs in while it is constructed, before the hook is added
+        start = time.time()
+        connection = BESConnection(username, password, root_server,
+                                   verify=verify)
+        _record('GET login', time.time() - start)
+        connection.session.hooks['response'].append(_record_latency)
+        BESHTTP.share_adapter(connection.session, connection.rootserver)
+
+        _CONNECTIONS[key] = connection
+        return connection
+
+
+def latency_stats():
+    """
+    Return {'<METHOD> <resource>': {'count', 'total_seconds',
+    'mean_seconds', 'max_seconds'}} for every request made on a managed
+    connection in this process, e.g. 'GET task' or 'POST upload'.
+    """
+    with _STATS_LOCK:
+        return dict((key, {
+            'count': stats['count'],
+            'total_seconds': round(stats['total_seconds'], 3),
+            'mean_seconds': round(stats['total_seconds'] / stats['count'], 3),
+            'max_seconds': round(stats['max_seconds'], 3),
+        }) for key, stats in _STATS.items())
+
+
+def reset_latency_stats():
+    with _STATS_LOCK:
+        _STATS.clear()
@@ -0,0 +1,127 @@
+#!/usr/local/autopkg/python
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+BESFingerprint.py
+
+Content fingerprints for generated BES (BigFix) tasks.
+
+AutoPkgBESEngine stores a SHA-256 of the task's canonical XML in a MIME
+field. Fields that change on every run without changing the task, such
+as x-fixlet-modification-time, are left out of the fingerprint.
+BESImporter compares the field with the copy on the root server and
+skips the PUT when they match, so an unchanged task keeps its
+LastModified and relays and clients have nothing new to gather.
+
+input_fingerprint() does the same for the processor inputs a task is
+built from, so AutoPkgBESEngine can skip rebuilding an unchanged task.
+"""
+from __future__ import absolute_import
+
+import copy
+import json
+import hashlib
+
+from lxml import etree
+
+__all__ = ["FINGERPRINT_MIME", "VOLATILE_MIME", "content_fingerprint",
+           "ContentHasher", "read_fingerprint", "input_fingerprint"]
+
+FINGERPRINT_MIME = 'x-autopkg-fingerprint'
+
+# Regenerated on every run without the task itself changing
+VOLATILE_MIME = ('x-fixlet-modification-time', FINGERPRINT_MIME)
+VOLATILE_ELEMENTS = ('SourceReleaseDate',)
+
+
+def _mime_fields(root, name):
+    return [mime for mime in root.iter('MIMEField')
+            if mime.findtext('Name') == name]
+
+
+def content_fingerprint(root):
+    """
+    Return the hex SHA-256 of the canonical (C14N) XML of a BES element
+    tree, leaving out the volatile MIME fields and elements.
+    """
+    if isinstance(root, etree._ElementTree):
+        root = root.getroot()
+    root = copy.deepcopy(root)
+
+    for name in VOLATILE_MIME:
+        for mime in _mime_fields(root, name):
+            mime.getparent().remove(mime)
+    for tag in VOLATILE_ELEMENTS:
+        for element in list(root.iter(tag)):
+            element.getparent().remove(element)
+
+    return hashlib.sha256(etree.tostring(root, method='c14n')).hexdigest()
+
+
+def _is_volatile(element):
+    if element.tag in VOLATILE_ELEMENTS:
+        return True
+    return (element.tag == 'MIMEField' and
+            element.findtext('Name') in VOLATILE_MIME)
+
+
+class ContentHasher(object):
+    """
+    Computes content_fingerprint() for a BES document with a single Task
+    from that Task's children, fed in order one at a time, so the whole
+    document never has to be in memory.
+    """
+
+    def __init__(self, root_attrib=None, nsmap=None, task_tag='Task'):
+        # Canonical form of the document around the Task's children
+        skeleton = etree.Element('BES', root_attrib or {}, nsmap=nsmap)
+        etree.SubElement(skeleton, task_tag)
+        end_tag = ('</%s>' % task_tag).encode('utf-8')
+        head, tail = etree.tostring(skeleton, method='c14n').split(end_tag)
+
+        self.tail = end_tag + tail
+        self.hash = hashlib.sha256(head)
+
+    def update(self, element):
+        """Add the next child of the Task, which must not be in a tree."""
+        if not _is_volatile(element):
+            self.hash.update(etree.tostring(element, method='c14n'))
+
+    def hexdigest(self):
+        final = self.hash.copy()
+        final.update(self.tail)
+        return final.hexdigest()
+
+
+def read_fingerprint(root):
+    """Return the fingerprint stored in a BES element tree, or None."""
+    for mime in _mime_fields(root, FINGERPRINT_MIME):
+        return mime.findtext('Value')
+    return None
+
+
+
+def _canonical(value):
+    # Sorted [key, value] pairs, since env dictionaries may mix int and
+    # str keys (bes_actions) that json cannot sort.
+    if isinstance(value, dict):
+        return sorted([str(key), _canonical(item)]
+                      for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def input_fingerprint(inputs):
+    """
+    Return the hex SHA-256 of a dictionary of processor inputs, independent
+    of dictionary ordering.
+    """
+    encoded = json.dumps(_canonical(inputs), separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
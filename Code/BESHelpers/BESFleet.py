@@ -0,0 +1,232 @@
+#!/usr/local/autopkg/python
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+BESFleet.py
+
+Batch driver that runs AutoPkgBESEngine for many recipes without autopkg.
+
+Each recipe is a snapshot of the env AutoPkgBESEngine would get from
+autopkg, saved as a plist or JSON dictionary. The snapshots are built in
+a pool of worker processes. Every worker imports the engine once and
+keeps its HTTP session and QnA processes for all the recipes it builds.
+The on-disk digest, redirect and icon caches, which lock for use across
+processes, default to one directory shared by every worker.
+
+When autopkglib cannot be imported, a minimal stand-in with Processor,
+ProcessorError and get_autopkg_version is used, so a catalog can be
+rebuilt on a machine without AutoPkg installed.
+
+  BESFleet.py [--workers N] [--cache-dir DIR] [--summary FILE] PATH [PATH ...]
+
+PATH may be a snapshot file or a directory of .plist and .json snapshots.
+Exits 1 if any recipe failed.
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import glob
+import json
+import time
+import types
+import argparse
+import plistlib
+import traceback
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+__all__ = ["install_processor_shim", "load_snapshots", "build_one",
+           "build_all"]
+
+CACHE_INPUTS = ("bes_digest_cache_dir", "bes_redirect_cache_dir",
+                "bes_icon_cache_dir")
+
+# The processors are in the directory above BESHelpers
+PROCESSOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _processor_shim():
+    """A stand-in autopkglib module with what the BES processors use."""
+    module = types.ModuleType('autopkglib')
+
+    class ProcessorError(Exception):
+        pass
+
+    class Processor(object):
+        def __init__(self, env=None, infile=None, outfile=None):
+            self.env = env or {}
+
+        def output(self, msg, verbose_level=1):
+            if int(self.env.get('verbose', 0)) >= verbose_level:
+                print(msg)
+
+    module.ProcessorError = ProcessorError
+    module.Processor = Processor
+    # Set per recipe from the snapshot's AUTOPKG_VERSION
+    module.AUTOPKG_VERSION = 'unknown'
+    module.get_autopkg_version = lambda: module.AUTOPKG_VERSION
+    module.is_shim = True
+    return module
+
+
+def install_processor_shim():
+    """
+    Make autopkglib importable, from an AutoPkg install if there is one
+    and the stand-in otherwise. Returns the autopkglib module.
+    """
+    if '/Library/AutoPkg' not in sys.path:
+        sys.path.append('/Library/AutoPkg')
+    try:
+        import autopkglib
+    except ImportError:
+        autopkglib = sys.modules['autopkglib'] = _processor_shim()
+    return autopkglib
+
+
+def _import_engine():
+    if PROCESSOR_DIR not in sys.path:
+        sys.path.insert(0, PROCESSOR_DIR)
+    install_processor_shim()
+
+    from AutoPkgBESEngine import AutoPkgBESEngine
+    return AutoPkgBESEngine
+
+
+def _read_snapshot(path):
+    with open(path, 'rb') as file_handle:
+        content = file_handle.read()
+    if content.lstrip().startswith(b'{'):
+        return json.loads(content.decode('utf-8'))
+    return plistlib.loads(content)
+
+
+def load_snapshots(paths):
+    """
+    Return [(path, env)] for the snapshot files in paths, expanding
+    directories to the .plist and .json files in them.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.plist')) +
+                                glob.glob(os.path.join(path, '*.json'))))
+        else:
+            files.append(path)
+    return [(path, _read_snapshot(path)) for path in files]
+
+
+def build_one(snapshot, cache_dir=None):
+    """
+    Run AutoPkgBESEngine.main for one (path, env) snapshot. Returns a
+    dictionary with the 'snapshot' path, 'name', 'result' ('Built',
+    'Unchanged' or 'Failed'), 'seconds', the engine's 'messages' and
+    either the 'bes_file' or the 'error'.
+    """
+    path, env = snapshot
+    engine_class = _import_engine()
+    env = dict(env)
+    if cache_dir:
+        env.setdefault("CACHE_DIR", cache_dir)
+        for key in CACHE_INPUTS:
+            env.setdefault(key, cache_dir)
+
+    autopkglib = sys.modules['autopkglib']
+    if getattr(autopkglib, 'is_shim', False):
+        autopkglib.AUTOPKG_VERSION = env.get('AUTOPKG_VERSION', 'unknown')
+
+    messages = []
+    engine = engine_class(env)
+    engine.output = lambda msg, verbose_level=1: messages.append(msg)
+
+    result = {'snapshot': path, 'messages': messages,
+              'name': "%s %s" % (env.get('NAME'), env.get('bes_version',
+                                                          env.get('version')))}
+    start = time.time()
+    try:
+        engine.main()
+    except Exception as error:
+        # One bad recipe must not stop the rest of the catalog
+        result.update({'result': 'Failed', 'seconds': time.time() - start,
+                       'error': '%s: %s' % (error.__class__.__name__, error)})
+        if not isinstance(error, autopkglib.ProcessorError):
+            result['traceback'] = traceback.format_exc()
+        return result
+
+    result.update({'result': 'Built' if env.get('bes_rebuilt') else 'Unchanged',
+                   'seconds': time.time() - start,
+                   'bes_file': env.get('bes_file')})
+    return result
+
+
+def build_all(snapshots, workers=None, cache_dir=None):
+    """
+    Build every (path, env) snapshot in a pool of worker processes.
+    Returns (results, summary) with results in snapshot order and summary
+    holding the counts per result, 'wall_seconds', 'build_seconds' (the
+    sum over recipes), 'recipes_per_second' and 'workers'.
+    """
+    snapshots = list(snapshots)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(snapshots) or 1))
+    build = partial(build_one, cache_dir=cache_dir)
+
+    start = time.time()
+    if workers == 1:
+        results = [build(snapshot) for snapshot in snapshots]
+    else:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_import_engine) as executor:
+            results = list(executor.map(build, snapshots))
+    wall_seconds = time.time() - start
+
+    summary = {'recipes': len(results), 'workers': workers,
+               'wall_seconds': round(wall_seconds, 3),
+               'build_seconds': round(sum(result['seconds']
+                                          for result in results), 3),
+               'recipes_per_second': round(len(results) / wall_seconds, 2)
+                                     if wall_seconds else None}
+    for name in ('Built', 'Unchanged', 'Failed'):
+        summary[name.lower()] = sum(1 for result in results
+                                    if result['result'] == name)
+    return results, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[2])
+    parser.add_argument('paths', nargs='+',
+                        help='Snapshot files, or directories of them.')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes, defaults to the CPU count.')
+    parser.add_argument('--cache-dir',
+                        help='Digest, redirect and icon cache shared by all '
+                             'recipes, unless a snapshot sets its own.')
+    parser.add_argument('--summary',
+                        help='Also write the results and summary as JSON here.')
+    args = parser.parse_args()
+
+    results, summary = build_all(load_snapshots(args.paths), args.workers,
+                                 args.cache_dir)
+
+    for result in results:
+        if result['result'] == 'Failed':
+            print("%-40s Failed: %s" % (result['name'], result['error']))
+        else:
+            print("%-40s %-9s %8.3fs  %s" % (result['name'], result['result'],
+                                             result['seconds'],
+                                             result['bes_file']))
+
+    print("%(recipes)d recipes in %(wall_seconds).3fs with %(workers)d "
+          "workers (%(recipes_per_second)s/s): %(built)d built, "
+          "%(unchanged)d unchanged, %(failed)d failed" % summary)
+
+    if args.summary:
+        with open(args.summary, 'w') as file_handle:
+            json.dump({'summary': summary, 'results': results}, file_handle,
+                      indent=2)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
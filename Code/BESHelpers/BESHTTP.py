@@ -0,0 +1,200 @@
+#!/usr/local/autopkg/python
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+BESHTTP.py
+
+Shared HTTP client for the BES (BigFix) processors.
+
+Keeps one pooled, keep-alive requests.Session per host for the life of
+the process, applies a default timeout to every request and loads the
+spoofed User-Agent only once. RedirectCache remembers where download
+URLs redirect to between runs.
+"""
+from __future__ import absolute_import
+
+import time
+import threading
+import plistlib
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from BESCache import JSONCache
+
+__all__ = ["get_session", "share_adapter", "request", "head", "get",
+           "user_agent", "parse_timeout", "DEFAULT_TIMEOUT",
+           "RedirectCache", "resolve_location", "host_ttl"]
+
+# (connect, read) seconds
+DEFAULT_TIMEOUT = (10, 60)
+
+POOL_MAXSIZE = 10
+
+USER_AGENTS_PLIST = '/Applications/Safari.app/Contents/Resources/UserAgents.plist'
+
+_LOCK = threading.Lock()
+_SESSIONS = {}
+_ADAPTERS = {}
+_USER_AGENT = []
+
+
+def _host_key(url):
+    parts = urlsplit(url)
+    return "%s://%s/" % (parts.scheme.lower(), parts.netloc.lower())
+
+
+def _adapter(key):
+    adapter = _ADAPTERS.get(key)
+    if adapter is None:
+        adapter = _ADAPTERS[key] = HTTPAdapter(pool_connections=1,
+                                               pool_maxsize=POOL_MAXSIZE)
+    return adapter
+
+
+def get_session(url):
+    """
+    Return the process-wide requests.Session for the host of url.
+    """
+    key = _host_key(url)
+    with _LOCK:
+        session = _SESSIONS.get(key)
+        if session is None:
+            session = _SESSIONS[key] = requests.Session()
+            session.mount(key, _adapter(key))
+        return session
+
+
+def share_adapter(session, url):
+    """
+    Mount the pooled adapter for the host of url onto another session,
+    e.g. one owned by besapi, so both reuse the same connections.
+    """
+    key = _host_key(url)
+    with _LOCK:
+        session.mount(key, _adapter(key))
+    return session
+
+
+def parse_timeout(value, default=DEFAULT_TIMEOUT):
+    """
+    Parse a timeout input such as '30' or '10,60' into a value requests
+    accepts. Empty values return default.
+    """
+    if value in (None, ''):
+        return default
+    if isinstance(value, (int, float, tuple)):
+        return value
+    parts = [float(part) for part in str(value).split(',')]
+    return parts[0] if len(parts) == 1 else tuple(parts[:2])
+
+
+def request(method, url, timeout=None, **kwargs):
+    """Send a request through the pooled session for url's host."""
+    if timeout is None:
+        timeout = DEFAULT_TIMEOUT
+    return get_session(url).request(method, url, timeout=timeout, **kwargs)
+
+
+def head(url, **kwargs):
+    # Like requests.head, report redirects rather than following them.
+    kwargs.setdefault('allow_redirects', False)
+    return request('HEAD', url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def user_agent(plist_path=USER_AGENTS_PLIST):
+    """
+    Return Safari's first User-Agent string, read from disk only once per
+    process. Raises IOError/OSError or ValueError if it cannot be read.
+    """
+    if not _USER_AGENT:
+        with open(plist_path, "rb") as f:
+            useragents = plistlib.load(f)
+        _USER_AGENT.append(useragents[0]['user-agent'])
+    return _USER_AGENT[0]
+
+
+class RedirectCache(JSONCache):
+    """
+    On-disk map of source URLs to the location they redirect to, with the
+    validators needed to revalidate an expired entry.
+    """
+
+    FILENAME = 'bes_redirect_cache.json'
+    DEFAULT_TTL = 24 * 60 * 60
+
+    def __init__(self, cache_dir, max_entries=JSONCache.MAX_ENTRIES):
+        super(RedirectCache, self).__init__(cache_dir, self.FILENAME,
+                                            max_entries=max_entries)
+
+
+def host_ttl(value, url, default=RedirectCache.DEFAULT_TTL):
+    """
+    Return the TTL in seconds for url's host. value is either a number of
+    seconds or a dictionary of host to seconds, with an optional 'default'.
+    """
+    if value in (None, ''):
+        return default
+    if isinstance(value, dict):
+        host = urlsplit(url).hostname or ''
+        value = value.get(host, value.get('default', default))
+    return float(value)
+
+
+def resolve_location(url, headers=None, cache=None, ttl=RedirectCache.DEFAULT_TTL,
+                     force=False, timeout=None):
+    """
+    Resolve where url redirects to with a HEAD request, using cache when
+    given. Returns (location, how), where how is one of 'cached',
+    'revalidated', 'resolved' or 'stale'.
+
+    Fresh cache entries are used without a request. Expired entries are
+    revalidated with If-None-Match/If-Modified-Since, and are still used
+    if the server cannot be reached or answers with an error. Only 2xx and
+    3xx answers are cached. force skips the cache lookup.
+    """
+    headers = dict(headers or {})
+    now = time.time()
+
+    entry = None
+    if cache is not None and not force:
+        entry = cache.get_entry(url)
+        if entry and entry.get('expires', 0) > now:
+            return entry['value'], 'cached'
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    try:
+        response = head(url, headers=headers, timeout=timeout)
+    except requests.exceptions.RequestException:
+        if entry:
+            return entry['value'], 'stale'
+        raise
+
+    if response.status_code >= 400:
+        # A passing error must not be remembered for the whole TTL
+        if entry:
+            return entry['value'], 'stale'
+        return response.headers.get('location', response.url), 'resolved'
+
+    if response.status_code == 304 and entry:
+        location, how = entry['value'], 'revalidated'
+    else:
+        location, how = response.headers.get('location', response.url), 'resolved'
+
+    if cache is not None:
+        cache.put(url, location,
+                  etag=response.headers.get('etag'),
+                  last_modified=response.headers.get('last-modified'),
+                  expires=now + ttl)
+
+    return location, how
@@ -0,0 +1,195 @@
+#!/usr/local/autopkg/python
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+BESHashing.py
+
+Shared file hashing helpers for the BES (BigFix) processors.
+
+Reads a file once, in large chunks through a reusable buffer, and feeds
+every requested digest from the same pass. DigestCache keeps the results
+on disk so an unchanged installer is not hashed again on the next run.
+"""
+from __future__ import absolute_import
+
+import os
+import hashlib
+
+from BESCache import JSONCache
+
+__all__ = ["hash_file", "cached_hash_file", "DigestCache", "HashingReader",
+           "DEFAULT_ALGORITHMS", "BLOCK_SIZE"]
+
+DEFAULT_ALGORITHMS = ('sha1', 'sha256')
+
+# 1 MiB keeps the number of read() syscalls low without holding much memory.
+BLOCK_SIZE = 1024 * 1024
+
+
+def hash_file(filename, algorithms=DEFAULT_ALGORITHMS, block_size=BLOCK_SIZE):
+    """
+    Hash a file in a single read pass.
+
+    Returns a dictionary of hex digests keyed by algorithm name,
+    plus the number of bytes read under 'size'.
+    """
+
+    hashes = [(name, hashlib.new(name)) for name in algorithms]
+
+    buf = bytearray(block_size)
+    view = memoryview(buf)
+    size = 0
+
+    with open(filename, 'rb', buffering=0) as file_handle:
+        while True:
+            count = file_handle.readinto(buf)
+            if not count:
+                break
+            chunk = view[:count]
+            for _, h in hashes:
+                h.update(chunk)
+            size += count
+
+    result = dict((name, h.hexdigest()) for name, h in hashes)
+    result['size'] = size
+
+    return result
+
+
+class HashingReader(object):
+    """
+    Iterate over a file in block_size chunks, hashing each chunk as it is
+    handed out, so a file can be streamed somewhere and hashed in the same
+    read pass. Only one chunk is held in memory at a time.
+
+    Defines __len__ so HTTP clients send a Content-Length rather than
+    chunked encoding. progress(bytes_read, size) is called per chunk.
+    offset and length restrict it to one range of the file.
+    """
+
+    def __init__(self, filename, algorithms=DEFAULT_ALGORITHMS,
+                 block_size=BLOCK_SIZE, progress=None, offset=0, length=None):
+        self.filename = filename
+        self.algorithms = algorithms
+        self.block_size = block_size
+        self.progress = progress
+        self.offset = offset
+        if length is None:
+            length = os.path.getsize(filename) - offset
+        self.size = length
+        self.bytes_read = 0
+        self.hashes = []
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        # Start over on every iteration so a retried request hashes cleanly.
+        self.hashes = [(name, hashlib.new(name)) for name in self.algorithms]
+        self.bytes_read = 0
+
+        buf = bytearray(self.block_size)
+        view = memoryview(buf)
+
+        with open(self.filename, 'rb', buffering=0) as file_handle:
+            file_handle.seek(self.offset)
+            while self.bytes_read < self.size:
+                count = file_handle.readinto(
+                    view[:min(self.block_size, self.size - self.bytes_read)])
+                if not count:
+                    break
+                chunk = view[:count]
+                for _, h in self.hashes:
+                    h.update(chunk)
+                self.bytes_read += count
+                if self.progress:
+                    self.progress(self.bytes_read, self.size)
+                yield chunk
+
+    def digests(self):
+        """Return the digests of everything read so far, like hash_file."""
+        result = dict((name, h.hexdigest()) for name, h in self.hashes)
+        result['size'] = self.bytes_read
+        return result
+
+
+class DigestCache(JSONCache):
+    """
+    Persistent digest cache keyed by file path, inode, size and mtime_ns.
+
+    Entries are only returned while the file's stat identity still matches
+    the one recorded when it was hashed.
+    """
+
+    FILENAME = 'bes_digest_cache.json'
+
+    def __init__(self, cache_dir, max_entries=JSONCache.MAX_ENTRIES):
+        super(DigestCache, self).__init__(cache_dir, self.FILENAME,
+                                          max_entries=max_entries)
+
+    @staticmethod
+    def identity(filename):
+        """Return the stat fields that identify a file's contents."""
+        stat = os.stat(filename)
+        return {'inode': stat.st_ino,
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns}
+
+    def get(self, filename):
+        """
+        Return cached digests for filename, or None if the file is unknown
+        or has changed since it was hashed.
+        """
+        identity = self.identity(filename)
+
+        return super(DigestCache, self).get(
+            os.path.abspath(filename),
+            lambda entry: all(entry.get(key) == value
+                              for key, value in identity.items()))
+
+    def put(self, filename, digests, identity):
+        """Store digests for filename as of the given identity."""
+        super(DigestCache, self).put(os.path.abspath(filename), digests,
+                                     **identity)
+
+    def hash_file(self, filename, algorithms=DEFAULT_ALGORITHMS):
+        """
+        Return digests for filename, hashing only on a cache miss.
+        """
+        cached = self.get(filename)
+        if cached and all(name in cached for name in algorithms):
+            return cached
+
+        identity = self.identity(filename)
+        digests = hash_file(filename, algorithms)
+
+        # Only trust the result if the file did not change while reading.
+        if self.identity(filename) == identity:
+            self.put(filename, digests, identity)
+
+        return digests
+
+
+def cached_hash_file(filename, cache_dir=None, algorithms=DEFAULT_ALGORITHMS):
+    """
+    Hash filename through a DigestCache in cache_dir, or directly when no
+    cache directory is given or the cache cannot be used.
+    """
+    if cache_dir:
+        try:
+            return DigestCache(cache_dir).hash_file(filename, algorithms)
+        except (IOError, OSError):
+            pass
+    return hash_file(filename, algorithms)
+
+
+if __name__ == "__main__":
+    import sys
+
+    for path in sys.argv[1:]:
+        digests = hash_file(path)
+        print("%s sha1:%s sha256:%s size:%d" % (
+            os.path.basename(path), digests['sha1'],
+            digests['sha256'], digests['size']))
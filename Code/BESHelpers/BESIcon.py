@@ -0,0 +1,158 @@
+#!/usr/local/autopkg/python
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+BESIcon.py
+
+Self-service icon pipeline for the BES (BigFix) processors.
+
+Downloads an icon, downscales it to a maximum edge length and caches the
+resulting base64 data URI by URL so later runs only revalidate it with
+ETag/Last-Modified. Downscaling uses Pillow when installed, otherwise
+macOS's sips, and leaves the icon untouched when neither is available.
+"""
+from __future__ import absolute_import
+
+import io
+import os
+import base64
+import tempfile
+import subprocess
+
+import requests
+
+import BESHTTP
+from BESCache import JSONCache
+
+__all__ = ["IconCache", "fetch_icon", "downscale", "DEFAULT_MAX_SIZE"]
+
+# Largest edge in pixels; the self-service app displays icons far smaller.
+DEFAULT_MAX_SIZE = 256
+
+SIPS = '/usr/bin/sips'
+
+
+class IconCache(JSONCache):
+    """On-disk cache of icon data URIs keyed by URL and maximum size."""
+
+    FILENAME = 'bes_icon_cache.json'
+
+    def __init__(self, cache_dir, max_entries=JSONCache.MAX_ENTRIES):
+        super(IconCache, self).__init__(cache_dir, self.FILENAME,
+                                        max_entries=max_entries)
+
+
+def _downscale_pillow(content, max_size):
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(content))
+    if max(image.size) <= max_size:
+        return content
+
+    image.thumbnail((max_size, max_size), Image.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, format='PNG', optimize=True)
+    return output.getvalue()
+
+
+def _downscale_sips(content, max_size):
+    temp_dir = tempfile.mkdtemp()
+    source = os.path.join(temp_dir, 'icon')
+    resized = os.path.join(temp_dir, 'icon.png')
+    try:
+        with open(source, 'wb') as file_handle:
+            file_handle.write(content)
+
+        # sips -Z never upscales, so small icons come back at their own size.
+        subprocess.check_call([SIPS, '-Z', str(max_size), '-s', 'format', 'png',
+                               source, '--out', resized],
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+        with open(resized, 'rb') as file_handle:
+            return file_handle.read()
+    finally:
+        for path in (source, resized):
+            if os.path.exists(path):
+                os.remove(path)
+        os.rmdir(temp_dir)
+
+
+def downscale(content, max_size=DEFAULT_MAX_SIZE):
+    """
+    Return (content, changed). The icon is shrunk to fit max_size and
+    recompressed as PNG, and kept as-is if that does not make it smaller.
+    """
+    if not max_size:
+        return content, False
+
+    try:
+        resized = _downscale_pillow(content, max_size)
+    except ImportError:
+        if not os.path.exists(SIPS):
+            return content, False
+        try:
+            resized = _downscale_sips(content, max_size)
+        except (subprocess.CalledProcessError, OSError):
+            return content, False
+    except Exception:
+        return content, False
+
+    if len(resized) < len(content):
+        return resized, True
+    return content, False
+
+
+def _encoded_length(size):
+    return 4 * ((size + 2) // 3)
+
+
+def fetch_icon(url, cache=None, max_size=DEFAULT_MAX_SIZE, timeout=None):
+    """
+    Return (data_uri, stats) for the icon at url. stats holds the original
+    and final byte counts, the base64 bytes saved and how the icon was
+    obtained ('revalidated', 'downloaded' or 'stale').
+    """
+    key = '%s@%s' % (url, max_size)
+    headers = {}
+
+    entry = cache.get_entry(key) if cache is not None else None
+    if entry and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry and entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+
+    try:
+        response = BESHTTP.get(url, headers=headers, timeout=timeout)
+    except requests.exceptions.RequestException:
+        if entry:
+            return entry['value'], dict(entry['stats'], source='stale')
+        raise
+
+    if entry and response.status_code == 304:
+        return entry['value'], dict(entry['stats'], source='revalidated')
+
+    content, changed = downscale(response.content, max_size)
+
+    if changed:
+        content_type = "image/png"
+    else:
+        content_type = "image/%s" % response.url.split('.')[-1]
+
+    data_uri = "data:%s;base64,%s" % (content_type,
+                                      base64.b64encode(content).decode())
+
+    stats = {
+        'original_bytes': len(response.content),
+        'final_bytes': len(content),
+        'bytes_saved': (_encoded_length(len(response.content)) -
+                        _encoded_length(len(content))),
+    }
+
+    if cache is not None and response.status_code == 200:
+        cache.put(key, data_uri, stats=stats,
+                  etag=response.headers.get('etag'),
+                  last_modified=response.headers.get('last-modified'))
+
+    return data_uri, dict(stats, source='downloaded')
@@ -0,0 +1,162 @@
+#!/usr/local/autopkg/python
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+BESProfile.py
+
+Opt-in profiling of the BES (BigFix) processors.
+
+A processor's main() is wrapped with @profiled. Setting the bes_profile
+input, or BES_PROFILE in the env or the process environment (so that it
+can be switched on for a run on a build host without editing recipes),
+picks the profiler:
+
+  cprofile     cProfile; writes a .pstats file for pstats/snakeviz
+  tracemalloc  tracemalloc; writes a .tracemalloc snapshot for
+               tracemalloc.Snapshot.load
+
+Either way the profile is written to RECIPE_CACHE_DIR as
+<recipe>-<processor>-<timestamp>.<ext>, next to a .txt summary of the
+top bes_profile_top (BES_PROFILE_TOP, default 30) entries, also when
+main() fails. The paths are added to the bes_profile_files output.
+PROFILE_INPUTS and PROFILE_OUTPUTS are the entries each processor merges
+into its input_variables and output_variables.
+"""
+from __future__ import absolute_import
+
+import io
+import os
+import re
+import time
+import pstats
+import cProfile
+import tempfile
+import functools
+import tracemalloc
+
+__all__ = ["profiled", "PROFILERS", "PROFILE_INPUTS", "PROFILE_OUTPUTS"]
+
+DEFAULT_TOP = 30
+
+PROFILE_INPUTS = {
+    "bes_profile": {
+        "required": False,
+        "description": (
+            "'cprofile' or 'tracemalloc' to profile this processor, "
+            "writing the profile and a text summary to "
+            "%RECIPE_CACHE_DIR%. Defaults to $BES_PROFILE.")
+    },
+    "bes_profile_top": {
+        "required": False,
+        "description": (
+            "Entries in the profile's text summary, defaults to %d." %
+            DEFAULT_TOP)
+    },
+}
+
+PROFILE_OUTPUTS = {
+    "bes_profile_files": {
+        "description":
+            "Profiles and summaries written when bes_profile is set."
+    },
+}
+
+RECIPE_EXTENSIONS = re.compile(r'(\.recipe)?(\.yaml|\.plist)?$')
+
+
+def _setting(env, name, default=None):
+    return (env.get(name.lower()) or env.get(name) or
+            os.environ.get(name) or default)
+
+
+def _profile_base(processor):
+    """RECIPE_CACHE_DIR/<recipe>-<processor>-<timestamp>, without extension."""
+    env = processor.env
+    recipe = (RECIPE_EXTENSIONS.sub('', os.path.basename(
+        env.get('RECIPE_PATH') or '')) or env.get('NAME') or 'recipe')
+    name = '%s-%s-%s' % (recipe, processor.__class__.__name__,
+                         time.strftime('%Y%m%d-%H%M%S'))
+    directory = env.get('RECIPE_CACHE_DIR') or tempfile.gettempdir()
+    return os.path.join(directory, re.sub(r'[^\w.-]+', '_', name))
+
+
+def _run_cprofile(main, processor, base, top):
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        return main(processor)
+    finally:
+        profile.disable()
+        profile.dump_stats(base + '.pstats')
+
+        summary = io.StringIO()
+        stats = pstats.Stats(profile, stream=summary)
+        stats.sort_stats('cumulative').print_stats(top)
+        stats.sort_stats('tottime').print_stats(top)
+        with io.open(base + '.txt', 'w', encoding='utf-8') as file_handle:
+            file_handle.write(summary.getvalue())
+
+        _record(processor, base + '.pstats', base + '.txt')
+
+
+def _run_tracemalloc(main, processor, base, top):
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(25)
+    tracemalloc.reset_peak()
+    start = time.time()
+    try:
+        return main(processor)
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if started:
+            tracemalloc.stop()
+        snapshot.dump(base + '.tracemalloc')
+
+        lines = ["%s: %.3fs, %d bytes traced at exit, %d bytes peak" % (
+            processor.__class__.__name__, time.time() - start, current, peak),
+                 "", "Top %d allocation sites by size:" % top]
+        lines.extend(str(stat) for stat in
+                     snapshot.statistics('lineno')[:top])
+        lines.extend(["", "Largest allocation traceback:"])
+        largest = snapshot.statistics('traceback')[:1]
+        for stat in largest:
+            lines.extend(stat.traceback.format())
+        with io.open(base + '.txt', 'w', encoding='utf-8') as file_handle:
+            file_handle.write('\n'.join(lines) + '\n')
+
+        _record(processor, base + '.tracemalloc', base + '.txt')
+
+
+PROFILERS = {
+    'cprofile': _run_cprofile,
+    'tracemalloc': _run_tracemalloc,
+}
+
+
+def _record(processor, *paths):
+    processor.env['bes_profile_files'] = (
+        list(processor.env.get('bes_profile_files') or []) + list(paths))
+    processor.output("Profile written to %s" % ', '.join(paths))
+
+
+def profiled(main):
+    """Decorator for Processor.main that runs it under the chosen profiler."""
+    @functools.wraps(main)
+    def run(self):
+        mode = _setting(self.env, 'BES_PROFILE')
+        if not mode:
+            return main(self)
+
+        profiler = PROFILERS.get(str(mode).lower())
+        if profiler is None:
+            self.output("Unknown BES_PROFILE '%s', expected one of: %s" % (
+                mode, ', '.join(sorted(PROFILERS))))
+            return main(self)
+
+        return profiler(main, self, _profile_base(self),
+                        int(_setting(self.env, 'BES_PROFILE_TOP', DEFAULT_TOP)))
+    return run
@@ -0,0 +1,295 @@
+#!/usr/local/autopkg/python
+# encoding: utf-8
+#
+# Copyright 2014 The Pennsylvania State University.
+#
+"""
+BESQnA.py
+
+Persistent QnA sessions shared by the BES (BigFix) processors.
+
+Keeps QnA processes alive over stdin/stdout and evaluates relevance in
+batches instead of spawning QnA for every expression. Each expression is
+followed by a unique sentinel expression so its answers can be told
+apart from the next one's. RelevanceCache remembers results on disk
+between runs.
+"""
+from __future__ import absolute_import
+
+import os
+import re
+import json
+import uuid
+import queue
+import atexit
+import threading
+import subprocess
+from collections import namedtuple
+
+from BESCache import JSONCache
+
+__all__ = ["QnAError", "QnAResult", "QnAWorker", "QnAPool", "get_pool",
+           "parse_line", "RelevanceCache", "relevance_fingerprint"]
+
+QNA = '/usr/local/bin/QnA'
+
+DEFAULT_TIMEOUT = 30
+
+# failed is set when QnA itself crashed or timed out, rather than the
+# expression producing an error.
+QnAResult = namedtuple('QnAResult', ['relevance', 'answers', 'error', 'failed'])
+QnAResult.__new__.__defaults__ = (False,)
+
+
+class QnAError(Exception):
+    """Raised when a QnA process dies or stops answering."""
+    pass
+
+
+def parse_line(line):
+    """
+    Split a line of QnA output into its (kind, value) pair, e.g. ('A', 'x').
+
+    QnA prints a 'Q: ' prompt without a newline when reading from a pipe,
+    so any leading prompts are dropped first. Returns (None, None) for
+    lines that carry no answer.
+    """
+    line = line.rstrip('\r\n')
+    while line.startswith('Q:'):
+        line = line[2:].lstrip()
+
+    if len(line) < 2 or line[1] != ':':
+        return None, None
+
+    return line[0], line[2:].strip()
+
+
+class QnAWorker(object):
+    """A single long-lived QnA process."""
+
+    def __init__(self, executable=QNA, timeout=DEFAULT_TIMEOUT):
+        self.executable = executable
+        self.timeout = timeout
+        self.sentinel = 'BESQNA-%s' % uuid.uuid4().hex
+        self.proc = None
+        self.lines = None
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self):
+        self.stop()
+        self.proc = subprocess.Popen([self.executable],
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.DEVNULL,
+                                     universal_newlines=True)
+        self.lines = queue.Queue()
+
+        reader = threading.Thread(target=self._read,
+                                  args=(self.proc.stdout, self.lines))
+        reader.daemon = True
+        reader.start()
+
+    @staticmethod
+    def _read(stream, lines):
+        for line in iter(stream.readline, ''):
+            lines.put(line)
+        stream.close()
+        lines.put(None)
+
+    def stop(self):
+        if self.proc is None:
+            return
+        try:
+            if self.proc.poll() is None:
+                self.proc.kill()
+            self.proc.wait()
+            self.proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        self.proc = None
+
+    def _collect(self, relevance):
+        answers = []
+        error = None
+        while True:
+            try:
+                line = self.lines.get(timeout=self.timeout)
+            except queue.Empty:
+                raise QnAError("QnA timed out after %ss" % self.timeout)
+            if line is None:
+                raise QnAError("QnA exited with status %s" % self.proc.wait())
+
+            kind, value = parse_line(line)
+            if kind == 'A' and value == self.sentinel:
+                return QnAResult(relevance, answers, error)
+            elif kind == 'A':
+                answers.append(value)
+            elif kind == 'E':
+                error = value
+
+    def evaluate(self, expressions):
+        """
+        Evaluate a batch of relevance expressions, returning one QnAResult
+        per expression. A crash or timeout is reported as that expression's
+        error and the process is restarted for the rest of the batch.
+        """
+        results = []
+        pending = [' '.join(expr.splitlines()) for expr in expressions]
+
+        while pending:
+            if not self.alive():
+                self.start()
+            try:
+                self.proc.stdin.write(''.join(
+                    '%s\n"%s"\n' % (expr, self.sentinel) for expr in pending))
+                self.proc.stdin.flush()
+            except (IOError, OSError) as error:
+                self.stop()
+                results.extend(
+                    QnAResult(expr, [], "Could not write to QnA: %s" % error,
+                              True)
+                    for expr in pending)
+                break
+
+            while pending:
+                try:
+                    results.append(self._collect(pending[0]))
+                except QnAError as error:
+                    self.stop()
+                    results.append(QnAResult(pending[0], [], str(error), True))
+                    pending.pop(0)
+                    break
+                pending.pop(0)
+
+        return results
+
+
+class QnAPool(object):
+    """
+    A bounded set of QnAWorkers. Workers are started on first use and
+    handed out to one caller at a time.
+    """
+
+    def __init__(self, executable=QNA, workers=1, timeout=DEFAULT_TIMEOUT):
+        self.executable = executable
+        self.timeout = timeout
+        self.size = max(1, int(workers))
+        self.idle = queue.Queue()
+        for _ in range(self.size):
+            self.idle.put(QnAWorker(executable, timeout))
+        self.all = list(self.idle.queue)
+
+    def evaluate_batch(self, expressions):
+        """Evaluate expressions on the next idle worker."""
+        worker = self.idle.get()
+        try:
+            worker.timeout = self.timeout
+            return worker.evaluate(list(expressions))
+        finally:
+            self.idle.put(worker)
+
+    def evaluate(self, relevance):
+        """Evaluate a single expression and return its QnAResult."""
+        return self.evaluate_batch([relevance])[0]
+
+    def close(self):
+        for worker in self.all:
+            worker.stop()
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(executable=QNA, workers=1, timeout=DEFAULT_TIMEOUT):
+    """
+    Return the process-wide QnAPool for executable, growing it if more
+    workers are requested than it currently holds.
+    """
+    with _POOLS_LOCK:
+        pool = _POOLS.get(executable)
+        if pool is None:
+            pool = _POOLS[executable] = QnAPool(executable, workers, timeout)
+        else:
+            pool.timeout = timeout
+            while pool.size < workers:
+                worker = QnAWorker(executable, timeout)
+                pool.all.append(worker)
+                pool.idle.put(worker)
+                pool.size += 1
+        return pool
+
+
+def relevance_fingerprint(relevance):
+    """
+    Return [path, size, mtime_ns] for every existing absolute path quoted
+    in a relevance expression. Bundles also include their Info.plist, since
+    version lookups read it rather than the folder itself.
+    """
+    fingerprint = []
+    for literal in re.findall(r'"([^"]+)"', relevance):
+        path = os.path.expanduser(literal)
+        if not os.path.isabs(path) or not os.path.exists(path):
+            continue
+        for candidate in (path, os.path.join(path, 'Contents', 'Info.plist')):
+            if os.path.exists(candidate):
+                stat = os.stat(candidate)
+                fingerprint.append([candidate, stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+
+class RelevanceCache(JSONCache):
+    """
+    On-disk cache of relevance results keyed by the expression text plus
+    either an explicit cache key or the fingerprints of the files it names.
+    """
+
+    FILENAME = 'bes_relevance_cache.json'
+    DEFAULT_TTL = 24 * 60 * 60
+
+    def __init__(self, cache_dir, ttl=DEFAULT_TTL,
+                 max_entries=JSONCache.MAX_ENTRIES):
+        super(RelevanceCache, self).__init__(cache_dir, self.FILENAME,
+                                             max_entries=max_entries, ttl=ttl)
+
+    @staticmethod
+    def key(relevance, cache_key=None):
+        if cache_key:
+            return 'key:%s\n%s' % (cache_key, relevance)
+        return 'files:%s\n%s' % (json.dumps(relevance_fingerprint(relevance)),
+                                  relevance)
+
+    def lookup(self, relevance, cache_key=None):
+        """Return the cached QnAResult for relevance, or None."""
+        value = self.get(self.key(relevance, cache_key))
+        if value is None:
+            return None
+        return QnAResult(relevance, value['answers'], value['error'])
+
+    def store(self, result, cache_key=None):
+        """Cache a QnAResult unless QnA itself failed to produce it."""
+        if result.failed:
+            return
+        self.put(self.key(result.relevance, cache_key),
+                 {'answers': result.answers, 'error': result.error})
+
+
+@atexit.register
+def _close_pools():
+    for pool in list(_POOLS.values()):
+        pool.close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    executable = os.environ.get('BES_QNA_PATH', QNA)
+    for result in get_pool(executable).evaluate_batch(
+            [line for line in sys.stdin.read().splitlines() if line.strip()]):
+        print("Q: %s" % result.relevance)
+        for answer in result.answers:
+            print("A: %s" % answer)
+        if result.error:
+            print("E: %s" % result.error)
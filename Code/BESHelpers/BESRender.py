@@ -0,0 +1,318 @@
+#!/usr/local/autopkg/python
+# encoding: utf-8
+#
+# Copyright 2015 The Pennsylvania State University.
+#
+"""
+BESRender.py
+
+Jinja2 rendering of BES (BigFix) tasks for BESTemplater, one at a time
+or in batches.
+
+One Jinja2 Environment is kept per template search path for the life of
+the process, so recipes that share templates compile them once. Compiled
+templates are also kept in a FileSystemBytecodeCache in the shared cache
+directory, so later runs skip compiling too. Rendered tasks are written
+atomically, so an interrupted run never leaves a partial .bes file.
+
+render_batch() renders a manifest of env dictionaries in a process pool,
+which is much faster than an autopkg run per recipe when a whole catalog
+has to be regenerated after a template change. It is runnable on its own:
+
+  BESRender.py [--workers N] [--output-dir DIR] [--set KEY=VALUE] MANIFEST
+
+MANIFEST is a JSON or plist file holding a list of items, or a dictionary
+with the list in 'items' and env values shared by all of them in
+'defaults'. Each item is an env dictionary, or the path of a recipe
+override (plist or JSON) whose Input is used, with RECIPE_DIR set to the
+override's directory.
+"""
+from __future__ import absolute_import, print_function
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import plistlib
+import tempfile
+import threading
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+# Also runnable as a script, so make its sibling helpers importable.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from BESCache import shared_cache_dir
+from BESTimings import NULL_TIMER
+
+__all__ = ["template_search_path", "get_environment", "template_cache_dir",
+           "render_task", "load_manifest", "render_batch"]
+
+BYTECODE_CACHE_SUBDIR = 'bes_jinja_bytecode'
+
+_LOCK = threading.Lock()
+_ENVIRONMENTS = {}
+_LOCATIONS = {}
+
+
+def template_search_path(recipe_dir, bes_templates):
+    """
+    Return the directories searched for templates, in order: the working
+    directory, ./templates, templates next to the recipe and one level
+    up, Templates two levels up, and BES_TEMPLATES.
+    """
+    # http://stackoverflow.com/a/14150750/2626090
+    uppath = lambda _path, n: os.sep.join(_path.split(os.sep)[:-n])
+
+    search_path = [os.getcwd(), os.path.abspath('templates')]
+    if recipe_dir:
+        search_path.extend([os.path.join(recipe_dir, 'templates'),
+                            os.path.join(uppath(recipe_dir, 1), 'templates'),
+                            os.path.join(uppath(recipe_dir, 2), 'Templates')])
+    if bes_templates:
+        search_path.append(bes_templates)
+    return tuple(search_path)
+
+
+def _load_template(search_path, name):
+    """
+    FunctionLoader callback. Looks in the directory name was last found
+    in first, and only searches the whole path when it is no longer there.
+    """
+    from jinja2.loaders import split_template_path
+
+    pieces = split_template_path(name)
+    key = (search_path, name)
+    filename = _LOCATIONS.get(key)
+    if filename is None or not os.path.isfile(filename):
+        for directory in search_path:
+            filename = os.path.join(directory, *pieces)
+            if os.path.isfile(filename):
+                _LOCATIONS[key] = filename
+                break
+        else:
+            _LOCATIONS.pop(key, None)
+            return None
+
+    mtime = os.path.getmtime(filename)
+    with io.open(filename, encoding='utf-8') as file_handle:
+        source = file_handle.read()
+
+    def uptodate():
+        try:
+            return os.path.getmtime(filename) == mtime
+        except OSError:
+            return False
+
+    return source, filename, uptodate
+
+
+def get_environment(search_path, bytecode_cache_dir=None):
+    """
+    Return the process-wide Jinja2 Environment for a template search
+    path, creating it on first use. Compiled templates are stored in
+    bytecode_cache_dir when it is set.
+    """
+    from jinja2 import Environment, FileSystemBytecodeCache, FunctionLoader
+
+    key = (search_path, bytecode_cache_dir)
+    with _LOCK:
+        jinja_env = _ENVIRONMENTS.get(key)
+        if jinja_env is None:
+            bytecode_cache = None
+            if bytecode_cache_dir:
+                if not os.path.isdir(bytecode_cache_dir):
+                    os.makedirs(bytecode_cache_dir)
+                bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+
+            jinja_env = _ENVIRONMENTS[key] = Environment(
+                loader=FunctionLoader(partial(_load_template, search_path)),
+                bytecode_cache=bytecode_cache)
+        return jinja_env
+
+
+def template_cache_dir(env):
+    """
+    Return the bytecode cache directory for an env: bes_template_cache_dir,
+    defaulting to the cache directory shared by all recipes, or None.
+    """
+    cache_dir = shared_cache_dir(env, "bes_template_cache_dir", shared=True)
+    if not cache_dir:
+        return None
+    return os.path.join(cache_dir, BYTECODE_CACHE_SUBDIR)
+
+
+def _environment_for(env):
+    search_path = template_search_path(env.get("RECIPE_DIR"),
+                                       env.get("BES_TEMPLATES"))
+    return get_environment(search_path, template_cache_dir(env))
+
+
+def _write_atomic(path, text):
+    handle, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or '.',
+        prefix='.%s.' % os.path.basename(path))
+    try:
+        with io.open(handle, 'w', encoding='utf-8') as file_handle:
+            file_handle.write(text)
+        os.chmod(temp_path, 0o644)
+        os.rename(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def render_task(env, output_dir=None, timer=NULL_TIMER):
+    """
+    Render env's template_name with env and write it to 'Deploy NAME
+    version.bes' in output_dir, defaulting to RECIPE_CACHE_DIR. Returns
+    (path, size in bytes). Jinja2 errors, such as TemplateNotFound, are
+    passed on. The steps are timed as phases of timer.
+    """
+    output_dir = output_dir or env.get("RECIPE_CACHE_DIR")
+    if not output_dir:
+        raise ValueError("No RECIPE_CACHE_DIR or output directory")
+
+    with timer.phase('load_template'):
+        template_task = _environment_for(env).get_template(
+            env.get("template_name"))
+    with timer.phase('render'):
+        rendered_task = template_task.render(**env)
+
+    bes_file = "%s/Deploy %s %s.bes" % (output_dir, env.get("NAME"),
+                                        env.get("version"))
+    with timer.phase('write'):
+        _write_atomic(bes_file, rendered_task)
+    return bes_file, len(rendered_task.encode('utf-8'))
+
+
+def _read_plist_or_json(path):
+    with open(path, 'rb') as file_handle:
+        content = file_handle.read()
+    if content.lstrip().startswith((b'{', b'[')):
+        return json.loads(content.decode('utf-8'))
+    return plistlib.loads(content)
+
+
+def load_manifest(path):
+    """
+    Read a manifest into a list of env dictionaries. See the module
+    documentation for its format.
+    """
+    manifest = _read_plist_or_json(path)
+    defaults = {}
+    if isinstance(manifest, dict):
+        defaults = manifest.get('defaults', {})
+        manifest = manifest.get('items', [])
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    envs = []
+    for item in manifest:
+        env = dict(defaults)
+        if isinstance(item, dict):
+            env.update(item)
+        else:
+            override = os.path.join(base_dir, item)
+            env['RECIPE_DIR'] = os.path.dirname(override)
+            env.update(_read_plist_or_json(override).get('Input', {}))
+        envs.append(env)
+    return envs
+
+
+def _describe(env):
+    return "%s %s" % (env.get("NAME"), env.get("version"))
+
+
+def _render_one(env, output_dir=None):
+    from jinja2 import TemplateError
+
+    start = time.time()
+    try:
+        bes_file, size = render_task(env, output_dir)
+    except (TemplateError, OSError, ValueError) as error:
+        return {'name': _describe(env), 'result': 'Failed',
+                'error': '%s: %s' % (error.__class__.__name__, error),
+                'seconds': time.time() - start}
+    return {'name': _describe(env), 'result': 'Rendered', 'file': bes_file,
+            'bytes': size, 'seconds': time.time() - start}
+
+
+def render_batch(envs, workers=None, output_dir=None):
+    """
+    Render every env in a process pool. The templates are compiled in this
+    process first, which fills the bytecode cache the workers load them
+    from (and, where workers are forked, hands them the compiled
+    environments outright).
+
+    Returns (results, timing): one dictionary per env, in order, with the
+    'name', 'result' ('Rendered' or 'Failed'), 'seconds' and either the
+    'file' and its size in 'bytes' or the 'error'; and the 'wall_seconds'
+    and 'workers' used.
+    """
+    from jinja2 import TemplateError
+
+    envs = list(envs)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(envs) or 1))
+    start = time.time()
+
+    for env in envs:
+        try:
+            _environment_for(env).get_template(env.get("template_name"))
+        except (TemplateError, OSError):
+            # Reported per env by the worker that renders it
+            pass
+
+    render = partial(_render_one, output_dir=output_dir)
+    if workers == 1:
+        results = [render(env) for env in envs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                render, envs,
+                chunksize=max(1, len(envs) // (workers * 4))))
+
+    return results, {'wall_seconds': time.time() - start, 'workers': workers}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[2])
+    parser.add_argument('manifest', help='JSON or plist manifest.')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes, defaults to the CPU count.')
+    parser.add_argument('--output-dir',
+                        help='Write every task here instead of its '
+                             'RECIPE_CACHE_DIR.')
+    parser.add_argument('--set', action='append', default=[],
+                        metavar='KEY=VALUE',
+                        help='Env value for every item, e.g. BES_TEMPLATES.')
+    parser.add_argument('--report', help='Also write the report as JSON here.')
+    args = parser.parse_args()
+
+    overrides = dict(value.split('=', 1) for value in args.set)
+    envs = [dict(env, **overrides) for env in load_manifest(args.manifest)]
+    results, timing = render_batch(envs, args.workers, args.output_dir)
+
+    failed = 0
+    for result in results:
+        if result['result'] == 'Failed':
+            failed += 1
+            print("%-40s Failed: %s" % (result['name'], result['error']))
+        else:
+            print("%-40s %8.1f ms %10d bytes  %s" % (
+                result['name'], result['seconds'] * 1000, result['bytes'],
+                result['file']))
+
+    print("Rendered %d of %d tasks in %.3fs with %d workers (%d bytes)" % (
+        len(results) - failed, len(results), timing['wall_seconds'],
+        timing['workers'], sum(result.get('bytes', 0) for result in results)))
+
+    if args.report:
+        with open(args.report, 'w') as file_handle:
+            json.dump({'results': results, 'timing': timing}, file_handle,
+                      indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+#!/usr/local/autopkg/python
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+BESSchema.py
+
+XSD validation of BES (BigFix) content against the BES.xsd shipped
+next to this module in BESHelpers.
+
+Schemas are compiled once per process and cached, keyed by path and
+modification time. validate_files() checks many files in parallel worker
+processes (each compiles the schema once) and reports timings. The module
+is also a command line bulk validator:
+
+  BESSchema.py [--schema BES.xsd] [--workers N] PATH [PATH ...]
+
+PATH may be a .bes file or a directory of them. Exits 1 if any file is
+invalid.
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import time
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from lxml import etree
+
+__all__ = ["DEFAULT_SCHEMA", "get_schema", "validate_file", "validate_files"]
+
+DEFAULT_SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'BES.xsd')
+
+# lxml validators keep their error log on the object, so each thread gets
+# its own compiled copy.
+_CACHE = threading.local()
+_COMPILE_SECONDS = []
+
+
+def get_schema(path=DEFAULT_SCHEMA):
+    """
+    Return the compiled XMLSchema for path, compiling it only the first
+    time it is used (or after it changes) in this process and thread.
+    Included schemas are resolved relative to path.
+    """
+    path = os.path.realpath(path)
+    key = (path, os.stat(path).st_mtime_ns)
+
+    schemas = getattr(_CACHE, 'schemas', None)
+    if schemas is None:
+        schemas = _CACHE.schemas = {}
+
+    schema = schemas.get(key)
+    if schema is None:
+        start = time.time()
+        schema = schemas[key] = etree.XMLSchema(etree.parse(path))
+        _COMPILE_SECONDS.append(time.time() - start)
+    return schema
+
+
+def validate_file(path, schema_path=DEFAULT_SCHEMA):
+    """
+    Validate one file. Returns a dictionary with the 'file', whether it is
+    'valid', a list of 'errors' as 'line N: message' and the 'seconds'
+    spent parsing and validating it.
+    """
+    schema = get_schema(schema_path)
+    start = time.time()
+    try:
+        document = etree.parse(path)
+    except (IOError, OSError, etree.XMLSyntaxError) as error:
+        return {'file': path, 'valid': False, 'errors': [str(error)],
+                'seconds': time.time() - start}
+
+    valid = schema.validate(document)
+    errors = ["line %d: %s" % (error.line, error.message)
+              for error in schema.error_log] if not valid else []
+    return {'file': path, 'valid': valid, 'errors': errors,
+            'seconds': time.time() - start}
+
+
+def _validate_chunk(paths, schema_path):
+    # A worker may be handed several chunks, so only count the compiles
+    # done for this one
+    compiled = len(_COMPILE_SECONDS)
+    results = [validate_file(path, schema_path) for path in paths]
+    return results, sum(_COMPILE_SECONDS[compiled:])
+
+
+def validate_files(paths, schema_path=DEFAULT_SCHEMA, workers=None):
+    """
+    Validate many files across worker processes. Returns (results,
+    timing), with results in the order of paths and timing holding the
+    'wall_seconds', the summed per-file 'validate_seconds', the
+    'compile_seconds' spent compiling schemas and the 'workers' used.
+    """
+    paths = list(paths)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(paths) or 1))
+    start = time.time()
+
+    if workers == 1:
+        results, compile_seconds = _validate_chunk(paths, schema_path)
+    else:
+        # Interleaved chunks, one per worker, so large and small files mix
+        chunks = [paths[index::workers] for index in range(workers)]
+        results_by_path = {}
+        compile_seconds = 0.0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for chunk_results, chunk_compile in executor.map(
+                    _validate_chunk, chunks, [schema_path] * workers):
+                compile_seconds += chunk_compile
+                for result in chunk_results:
+                    results_by_path[result['file']] = result
+        results = [results_by_path[path] for path in paths]
+
+    return results, {
+        'wall_seconds': time.time() - start,
+        'validate_seconds': sum(result['seconds'] for result in results),
+        'compile_seconds': compile_seconds,
+        'workers': workers,
+    }
+
+
+def main():
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from BESBatchImport import collect_bes_files
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[2])
+    parser.add_argument('paths', nargs='+',
+                        help='.bes files, or directories of them.')
+    parser.add_argument('--schema', default=DEFAULT_SCHEMA)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes, defaults to the CPU count.')
+    args = parser.parse_args()
+
+    results, timing = validate_files(collect_bes_files(args.paths),
+                                     args.schema, args.workers)
+
+    invalid = [result for result in results if not result['valid']]
+    for result in invalid:
+        print("%s: invalid" % result['file'])
+        for error in result['errors']:
+            print("  %s" % error)
+
+    print("Validated %d files (%d invalid) in %.3fs with %d workers: "
+          "%.3fs parsing and validating, %.3fs compiling schemas" % (
+              len(results), len(invalid), timing['wall_seconds'],
+              timing['workers'], timing['validate_seconds'],
+              timing['compile_seconds']))
+    return 1 if invalid else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+#!/usr/local/autopkg/python
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+BESSiteIndex.py
+
+Persistent title index of BigFix custom site tasks for BESImporter.
+
+Keeps a title -> [ID, LastModified] map per root server and site on disk.
+The first use, and any use after max_age, downloads the full task
+listing. In between, only tasks modified since the last sync are fetched
+with a session relevance query.
+
+Listings are parsed incrementally straight off the response stream, so
+memory stays bounded however large the site is, and find_task() stops
+reading at the first matching title.
+"""
+from __future__ import absolute_import
+
+import time
+from contextlib import closing
+from time import gmtime, strftime
+from urllib.parse import quote
+
+from lxml import etree
+
+from BESCache import JSONCache
+
+__all__ = ["SiteIndex", "parse_task_listing", "iter_tasks", "find_task",
+           "open_task_listing"]
+
+# Relevance timestamps are compared with the server's clock, so look back
+# a little further than the last sync to cover clock skew.
+CLOCK_SKEW = 10 * 60
+
+LISTING_CHUNK_SIZE = 64 * 1024
+
+CHANGED_TASKS_RELEVANCE = (
+    '(id of it as string & "|" & (modification time of it as string) & "|" '
+    '& name of it) of bes fixlets whose (task flag of it and name of site of '
+    'it = "CustomSite_%s" and modification time of it >= "%s" as time)')
+
+
+def open_task_listing(connection, site):
+    """
+    Return the streamed tasks/custom/<site> response from a BESConnection,
+    without reading the body. Raises requests.HTTPError on failure.
+    """
+    response = connection.session.get(
+        connection.url('tasks/custom/%s' % site),
+        verify=connection.verify, stream=True)
+    response.raise_for_status()
+    return response
+
+
+def iter_tasks(chunks):
+    """
+    Yield each Task element of a task listing fed in as an iterable of byte
+    chunks. Elements are discarded as soon as the caller moves on, so only
+    one chunk and one task are held in memory at a time.
+    """
+    parser = etree.XMLPullParser(events=('end',), tag='Task')
+    for chunk in chunks:
+        parser.feed(chunk)
+        for _, task in parser.read_events():
+            yield task
+            task.clear()
+            while task.getprevious() is not None:
+                del task.getparent()[0]
+    parser.close()
+
+
+def _task_entry(task):
+    return [task.findtext('ID'), task.get('LastModified')]
+
+
+def parse_task_listing(chunks):
+    """
+    Return {title: [id, last_modified]} from a tasks/custom/<site> listing,
+    given as bytes or an iterable of byte chunks.
+    """
+    if isinstance(chunks, bytes):
+        chunks = [chunks]
+    return dict((task.findtext('Name'), _task_entry(task))
+                for task in iter_tasks(chunks))
+
+
+def find_task(chunks, title):
+    """
+    Return [id, last_modified] of the first Task named title in a listing
+    given as an iterable of byte chunks, or None. Stops reading as soon as
+    it is found.
+    """
+    for task in iter_tasks(chunks):
+        if task.findtext('Name') == title:
+            return _task_entry(task)
+    return None
+
+
+def _bes_time(seconds):
+    return strftime("%a, %d %b %Y %H:%M:%S +0000", gmtime(seconds))
+
+
+class SiteIndex(JSONCache):
+    """
+    On-disk title index for custom sites, one entry per root server/site.
+    """
+
+    FILENAME = 'bes_site_index.json'
+    DEFAULT_MAX_AGE = 24 * 60 * 60
+
+    def __init__(self, cache_dir, max_age=DEFAULT_MAX_AGE,
+                 max_entries=JSONCache.MAX_ENTRIES):
+        super(SiteIndex, self).__init__(cache_dir, self.FILENAME,
+                                        max_entries=max_entries)
+        self.max_age = max_age
+
+    @staticmethod
+    def key(connection, site):
+        return '%s|%s' % (connection.rootserver, site)
+
+    def full_sync(self, connection, site):
+        """Rebuild the index for site from the full task listing."""
+        now = time.time()
+        with closing(open_task_listing(connection, site)) as response:
+            titles = parse_task_listing(
+                response.iter_content(LISTING_CHUNK_SIZE))
+
+        self.put(self.key(connection, site), titles,
+                 synced=now, full_synced=now)
+        return titles
+
+    def changed_tasks(self, connection, site, since):
+        """
+        Return {title: [id, last_modified]} for tasks modified since the
+        given epoch time, or None if the query failed.
+        """
+        relevance = CHANGED_TASKS_RELEVANCE % (site.replace('"', '%22'),
+                                               _bes_time(since - CLOCK_SKEW))
+        result = connection.get('query?relevance=%s' % quote(relevance))
+        if result.request.status_code != 200:
+            return None
+
+        root = etree.fromstring(result.request.content)
+        if root.find('.//Error') is not None:
+            return None
+
+        titles = {}
+        for answer in root.iter('Answer'):
+            task_id, last_modified, name = answer.text.split('|', 2)
+            titles[name] = [task_id, last_modified]
+        return titles
+
+    def refresh(self, connection, site, force=False):
+        """
+        Return the up-to-date title map for site, syncing only what changed
+        unless the index is missing, too old or force is set.
+        """
+        now = time.time()
+        entry = None if force else self.get_entry(self.key(connection, site))
+
+        if not entry or now - entry.get('full_synced', 0) > self.max_age:
+            return self.full_sync(connection, site)
+
+        try:
+            changed = self.changed_tasks(connection, site, entry['synced'])
+        except Exception:
+            changed = None
+        if changed is None:
+            return self.full_sync(connection, site)
+
+        titles = entry['value']
+        if changed:
+            # Drop the old titles of changed tasks, in case they were renamed
+            changed_ids = set(task_id for task_id, _ in changed.values())
+            titles = dict((title, task) for title, task in titles.items()
+                          if task[0] not in changed_ids)
+            titles.update(changed)
+        self.put(self.key(connection, site), titles,
+                 synced=now, full_synced=entry['full_synced'])
+        return titles
+
+    def add(self, connection, site, title, task_id, last_modified):
+        """Record a task that was just imported."""
+        entry = self.get_entry(self.key(connection, site))
+        if not entry:
+            return
+        entry['value'][title] = [str(task_id), last_modified]
+        self.put(self.key(connection, site), entry['value'],
+                 synced=entry['synced'], full_synced=entry['full_synced'])
+
+    def remove(self, connection, site, title):
+        """Forget a title whose task was deleted or renamed."""
+        entry = self.get_entry(self.key(connection, site))
+        if not entry or title not in entry['value']:
+            return
+        del entry['value'][title]
+        self.put(self.key(connection, site), entry['value'],
+                 synced=entry['synced'], full_synced=entry['full_synced'])
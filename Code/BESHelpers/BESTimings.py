@@ -0,0 +1,149 @@
+#!/usr/local/autopkg/python
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+BESTimings.py
+
+Per-phase timers for the BES (BigFix) processors.
+
+A processor's main() is wrapped with @timed, and the slow steps inside it
+run under self.timer.phase('name'). The bes_timing input picks the mode:
+
+  off      the default; phase() hands back a shared do-nothing context
+  summary  add the phases to the bes_timings output variable and to the
+           bes_timings summary block in autopkg's report
+  log      as summary, and also print each phase as it ends
+
+The timings of every BES processor in a recipe are collected together,
+keyed by processor name. TIMING_INPUTS and TIMING_OUTPUTS are the entries
+each processor merges into its input_variables and output_variables.
+"""
+from __future__ import absolute_import
+
+import time
+import functools
+from contextlib import contextmanager
+from collections import OrderedDict
+
+__all__ = ["timed", "phase_timer", "PhaseTimer", "NULL_TIMER", "SUMMARY_KEY",
+           "TIMING_INPUTS", "TIMING_OUTPUTS"]
+
+SUMMARY_KEY = 'bes_timings_summary_result'
+SUMMARY_TEXT = "Time spent in each phase of the BES processors:"
+
+TIMING_INPUTS = {
+    "bes_timing": {
+        "required": False,
+        "description": (
+            "'summary' to report the time spent in each phase in "
+            "bes_timings and autopkg's summary, 'log' to also print "
+            "them as they happen. Defaults to 'off'.")
+    },
+}
+
+TIMING_OUTPUTS = {
+    "bes_timings": {
+        "description":
+            "Seconds spent in each phase, per processor, when bes_timing is on."
+    },
+    SUMMARY_KEY: {
+        "description":
+            "Phase timings for autopkg's report, when bes_timing is on."
+    },
+}
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _NullTimer(object):
+    """The timer used when timing is off."""
+
+    enabled = False
+    _phase = _NullPhase()
+
+    def phase(self, name):
+        return self._phase
+
+    def export(self, processor):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+class PhaseTimer(object):
+    """Accumulates the time spent in each named phase of one processor run."""
+
+    enabled = True
+
+    def __init__(self, name, log=None):
+        self.name = name
+        self.log = log
+        self.phases = OrderedDict()
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+            if self.log:
+                self.log("%s %s: %.3fs" % (self.name, name, elapsed))
+
+    def results(self):
+        """Return {phase: seconds} in the order the phases ran, and the 'total'."""
+        results = OrderedDict((name, round(seconds, 4))
+                              for name, seconds in self.phases.items())
+        results['total'] = round(time.perf_counter() - self.start, 4)
+        return results
+
+    def export(self, processor):
+        """Add the results to the processor's bes_timings and summary block."""
+        results = self.results()
+        env = processor.env
+
+        timings = dict(env.get('bes_timings') or {})
+        timings[self.name] = results
+        env['bes_timings'] = timings
+
+        summary = env.get(SUMMARY_KEY) or {'summary_text': SUMMARY_TEXT,
+                                           'report_fields': [], 'data': {}}
+        if self.name not in summary['report_fields']:
+            summary['report_fields'].append(self.name)
+        summary['data'][self.name] = ', '.join(
+            '%s %.3fs' % (name, seconds) for name, seconds in results.items())
+        env[SUMMARY_KEY] = summary
+
+        if self.log:
+            self.log("%s total: %.3fs" % (self.name, results['total']))
+
+
+def phase_timer(processor):
+    """Return the timer for a processor run, per its bes_timing input."""
+    mode = str(processor.env.get('bes_timing') or 'off').lower()
+    if mode in ('off', 'false', 'none'):
+        return NULL_TIMER
+    return PhaseTimer(processor.__class__.__name__,
+                      log=processor.output if mode == 'log' else None)
+
+
+def timed(main):
+    """Decorator for Processor.main that sets up and exports self.timer."""
+    @functools.wraps(main)
+    def run(self):
+        self.timer = phase_timer(self)
+        result = main(self)
+        self.timer.export(self)
+        return result
+    return run
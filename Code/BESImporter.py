@@ -16,10 +16,27 @@ Adding support for python3
 """
 from __future__ import absolute_import
 
-import besapi
+import os
+import sys
+from contextlib import closing
+
+from lxml import etree
 
 from autopkglib import Processor, ProcessorError
 
+# Shared BES helper modules live in BESHelpers next to the processors, out
+# of the directory autopkglib loads every .py file from as a processor.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'BESHelpers'))
+from BESBatchImport import import_files, DEFAULT_MAX_BYTES
+from BESCache import shared_cache_dir
+from BESConnections import get_connection, latency_stats
+from BESFingerprint import content_fingerprint, read_fingerprint
+from BESProfile import profiled, PROFILE_INPUTS, PROFILE_OUTPUTS
+from BESTimings import timed, NULL_TIMER, TIMING_INPUTS, TIMING_OUTPUTS
+from BESSiteIndex import (SiteIndex, find_task, open_task_listing,
+                          parse_task_listing, LISTING_CHUNK_SIZE)
+
 import requests
 try:
     requests.packages.urllib3.disable_warnings()
@@ -28,14 +45,30 @@ except:
 
 __all__ = ["BESImporter"]
 
+SUMMARY_TEXT = "The following tasks were imported into BigFix or already up to date:"
+REPORT_FIELDS = ["Task ID", "Task Name", "Site", "Result"]
+
 class BESImporter(Processor):
     """AutoPkg Processor for importing tasks using the BigFix RESTAPI"""
     description = "Generates BigFix XML to install application."
     input_variables = {
         "bes_file": {
-            "required": True,
+            "required": False,
             "description":
-                "Path to BES XML file for console import."
+                "Path to BES XML file for console import. Required unless bes_files is set."
+        },
+        "bes_files": {
+            "required": False,
+            "description": (
+                "A directory or list of .bes files (or directories) to import "
+                "into bes_customsite together, merged into as few POSTs as "
+                "bes_batch_max_bytes allows. Takes the place of bes_file.")
+        },
+        "bes_batch_max_bytes": {
+            "required": False,
+            "description": (
+                "Largest merged payload POSTed in batch mode, defaults to "
+                "%d." % DEFAULT_MAX_BYTES)
         },
         "bes_customsite": {
             "required": True,
@@ -47,6 +80,31 @@ class BESImporter(Processor):
             "description":
                 "Task ID to import (overwrite), performs HTTP PUT."
         },
+        "bes_force_update": {
+            "required": False,
+            "description": (
+                "PUT the task even when its content fingerprint matches "
+                "the copy on the server, defaults to False.")
+        },
+        "bes_site_index_dir": {
+            "required": False,
+            "description": (
+                "Directory for the custom site title index used to find "
+                "duplicate tasks, shared by all recipes. Defaults to the "
+                "parent of %RECIPE_CACHE_DIR%. Set to '' to scan the full "
+                "task listing on every run instead.")
+        },
+        "bes_site_index_max_age": {
+            "required": False,
+            "description": (
+                "Seconds between full resyncs of the site index, with only "
+                "changed tasks fetched in between. Defaults to 86400.")
+        },
+        "bes_site_index_resync": {
+            "required": False,
+            "description":
+                "Rebuild the site index from the full task listing, defaults to False."
+        },
         "BES_ROOT_SERVER": {
             "required": True,
             "description":
@@ -68,13 +126,157 @@ class BESImporter(Processor):
             "description":
                 "The resulting ID of the BES console import."
         },
+        "bes_batch_results": {
+            "description": (
+                "Batch mode only: one dictionary per file with its 'file', "
+                "'result' (Created, Duplicate or Failed) and the 'ids' of "
+                "its items or the 'error'.")
+        },
+        "bes_api_latency": {
+            "description": (
+                "Request counts and latencies per REST API resource for this "
+                "process, e.g. {'GET task': {'count': 2, 'mean_seconds': ...}}.")
+        },
         "bes_importer_summary_result": {
             "description": "Description of BigFix import results."
         },
     }
+    input_variables.update(TIMING_INPUTS)
+    output_variables.update(TIMING_OUTPUTS)
+    input_variables.update(PROFILE_INPUTS)
+    output_variables.update(PROFILE_OUTPUTS)
     __doc__ = description
 
-
+    timer = NULL_TIMER
+
+    def get_site_index(self):
+        """
+        Return the custom site title index, or None if it is disabled.
+        """
+        cache_dir = shared_cache_dir(self.env, "bes_site_index_dir",
+                                     shared=True)
+        if not cache_dir:
+            return None
+
+        return SiteIndex(cache_dir, max_age=float(self.env.get(
+            "bes_site_index_max_age", SiteIndex.DEFAULT_MAX_AGE)))
+
+    def find_duplicate(self, connection, site, title):
+        """
+        Look up title in the site index and confirm the task still exists
+        under that title. Returns (ID, LastModified) or None.
+        """
+        index = self.get_site_index()
+        resync = str(self.env.get("bes_site_index_resync")) in ['True', 'true']
+
+        titles = index.refresh(connection, site, force=resync)
+        match = titles.get(title)
+        if not match:
+            return None
+
+        task = connection.get('task/custom/%s/%s' % (site, match[0]))
+        if (task.request.status_code != 200 or
+                self.task_title(task) != title):
+            # Deleted or renamed since the index was synced
+            index.remove(connection, site, title)
+            return None
+
+        return match
+
+    def task_title(self, task):
+        """Return the Title of a fetched task, or None."""
+        try:
+            return etree.fromstring(task.request.content).findtext('*/Title')
+        except etree.XMLSyntaxError:
+            return None
+
+    def is_unchanged(self, bes_file, task):
+        """
+        Return True if the content fingerprint of bes_file matches the one
+        stored in the server copy of the task.
+        """
+        if str(self.env.get("bes_force_update")) in ['True', 'true']:
+            return False
+
+        local_tree = etree.parse(bes_file)
+        local_fingerprint = (read_fingerprint(local_tree) or
+                             content_fingerprint(local_tree))
+        try:
+            server_fingerprint = read_fingerprint(
+                etree.fromstring(task.request.content))
+        except etree.XMLSyntaxError:
+            return False
+
+        return local_fingerprint == server_fingerprint
+
+    def import_batch(self, connection, site, bes_files):
+        """
+        Import many .bes files with as few POSTs as possible, skipping any
+        whose titles already exist in the site.
+        """
+        site_index = self.get_site_index()
+        if site_index:
+            resync = str(self.env.get("bes_site_index_resync")) in ['True', 'true']
+            existing_titles = site_index.refresh(connection, site, force=resync)
+        else:
+            with closing(open_task_listing(connection, site)) as tasks:
+                existing_titles = parse_task_listing(
+                    tasks.iter_content(LISTING_CHUNK_SIZE))
+
+        results = import_files(connection, site, bes_files,
+                               max_bytes=int(self.env.get(
+                                   "bes_batch_max_bytes", DEFAULT_MAX_BYTES)),
+                               existing_titles=existing_titles,
+                               log=self.output)
+
+        for result in results:
+            if result['result'] == 'Failed':
+                self.output("Failed: '%s' %s" % (result['file'],
+                                                 result['error']))
+                continue
+
+            self.output("%s: '%s' [%s]" % (result['result'], result['file'],
+                                           ', '.join(result['ids'])))
+            if site_index and result['result'] == 'Created':
+                for task_id, name, last_modified in zip(
+                        result['ids'], result['names'], result['last_modified']):
+                    site_index.add(connection, site, name, task_id,
+                                   last_modified)
+
+        self.env['bes_batch_results'] = results
+        self.batch_summary(site, results)
+
+        failed = [result['file'] for result in results
+                  if result['result'] == 'Failed']
+        if failed:
+            raise ProcessorError("Failed to import %d of %d files: %s" % (
+                len(failed), len(results), ', '.join(failed)))
+
+    def batch_summary(self, site, results):
+        """
+        Set bes_importer_summary_result for the created and duplicate
+        items of a batch import, listing them in order in each field.
+        """
+        rows = [(task_id, name, result['result'])
+                for result in results if result['result'] != 'Failed'
+                for task_id, name in zip(result['ids'], result['names'])]
+        if not rows:
+            return
+
+        self.env["bes_importer_summary_result"] = {
+            "summary_text": SUMMARY_TEXT,
+            "report_fields": REPORT_FIELDS,
+
+            "data": {
+                "Task ID": ", ".join(str(row[0]) for row in rows),
+                "Task Name": ", ".join(str(row[1]) for row in rows),
+                "Site": str(site),
+                "Result": ", ".join(row[2] for row in rows),
+            }
+        }
+
+    @profiled
+    @timed
     def main(self):
         """BESImporter Main Method"""
         # Assign BES Console Variables
@@ -82,32 +284,65 @@ class BESImporter(Processor):
         bes_title = self.env.get("bes_title")
         bes_customsite = self.env.get("bes_customsite")
         bes_taskid = self.env.get("bes_taskid", None)
+        bes_files = self.env.get("bes_files")
+
+        if not bes_file and not bes_files:
+            raise ProcessorError("Either bes_file or bes_files is required.")
 
         BES_USERNAME = self.env.get("BES_USERNAME")
         BES_PASSWORD = self.env.get("BES_PASSWORD")
         BES_ROOT_SERVER = self.env.get("BES_ROOT_SERVER")
 
-        # BES Console Connection
-        B = besapi.BESConnection(BES_USERNAME,
-                                 BES_PASSWORD,
-                                 BES_ROOT_SERVER,
-                                 verify=False)
+        # BES Console Connection, shared with other processors in this run
+        with self.timer.phase('connect'):
+            B = get_connection(BES_ROOT_SERVER, BES_USERNAME, BES_PASSWORD,
+                               verify=False)
+
+        # Batch POST, create many tasks
+        if bes_files:
+            with self.timer.phase('batch_import'):
+                self.import_batch(B, bes_customsite, bes_files)
 
         # PUT, update task
-        if bes_taskid:
+        elif bes_taskid:
             self.output("Searching: '%s' for ID '%s'" % (bes_customsite,
                                                          bes_taskid))
 
-            task = B.get('task/custom/%s/%s' % (bes_customsite, bes_taskid))
+            with self.timer.phase('fetch_task'):
+                task = B.get('task/custom/%s/%s' % (bes_customsite, bes_taskid))
+
+            with self.timer.phase('compare'):
+                unchanged = (task.request.status_code == 200 and
+                             self.is_unchanged(bes_file, task))
+
+            if unchanged:
+                self.output("Unchanged:[%s] '%s', skipping import." % (
+                    bes_taskid, task().Task.Title))
+
+                self.env['bes_id'] = str(bes_taskid)
+
+                # Create summary result data
+                self.env["bes_importer_summary_result"] = {
+                    "summary_text": SUMMARY_TEXT,
+                    "report_fields": REPORT_FIELDS,
+
+                    "data": {
+                        "Task ID": str(bes_taskid),
+                        "Task Name": str(task().Task.Title),
+                        "Site": str(bes_customsite),
+                        "Result": "Unchanged",
+                    }
+                }
 
-            if task.request.status_code == 200:
+            elif task.request.status_code == 200:
                 self.output("Found:[%s] '%s'   " % (
                     bes_taskid, task().Task.Title))
 
                 self.output("Importing: '%s' to %s/tasks/custom/%s" %
                             (bes_file, BES_ROOT_SERVER, bes_customsite))
 
-                with open(bes_file, 'r') as file_handle:
+                with self.timer.phase('update'), \
+                        open(bes_file, 'r') as file_handle:
                     upload_result = B.put('task/custom/%s/%s' % (bes_customsite,
                                                                  bes_taskid), file_handle)
                     updated_task = B.get('task/custom/%s/%s' % (bes_customsite,
@@ -122,13 +357,14 @@ class BESImporter(Processor):
 
                 # Create summary result data
                 self.env["bes_importer_summary_result"] = {
-                    "summary_text": "The following tasks were imported into BigFix:",
-                    "report_fields": ["Task ID", "Task Name", "Site"],
+                    "summary_text": SUMMARY_TEXT,
+                    "report_fields": REPORT_FIELDS,
 
                     "data": {
                         "Task ID": str(upload_result),
                         "Task Name": str(updated_task().Task.Title),
                         "Site": str(bes_customsite),
+                        "Result": "Updated",
                     }
                 }
             else:
@@ -138,23 +374,31 @@ class BESImporter(Processor):
         # POST, create task
         else:
             self.output("Searching: '%s' for '%s'" % (bes_customsite, bes_title))
-            tasks = B.get('tasks/custom/%s' % bes_customsite)
 
             duplicate_task = False
-            for task in tasks().iterchildren():
-                if task.Name == bes_title:
-
-                    duplicate_task = True
-
-                    self.output("Found:[%s] '%s' - %s    " % (
-                        task.ID, task.Name, task.get('LastModified')))
+            site_index = self.get_site_index()
+            with self.timer.phase('duplicate_search'):
+                if site_index:
+                    match = self.find_duplicate(B, bes_customsite, bes_title)
+                else:
+                    # Stream the listing and stop at the first matching title
+                    with closing(open_task_listing(B, bes_customsite)) as tasks:
+                        match = find_task(
+                            tasks.iter_content(LISTING_CHUNK_SIZE), bes_title)
+
+            if match:
+                duplicate_task = True
+
+                self.output("Found:[%s] '%s' - %s    " % (
+                    match[0], bes_title, match[1]))
 
             if not duplicate_task:
                 self.output("Importing: '%s' to %s/tasks/custom/%s" %
                             (bes_file, BES_ROOT_SERVER, bes_customsite))
 
                 # Upload task
-                with open(bes_file, 'r') as file_handle:
+                with self.timer.phase('import'), \
+                        open(bes_file, 'r') as file_handle:
                     upload_result = B.post('tasks/custom/%s' % bes_customsite, file_handle)
 
                 # Read and parse console return
@@ -165,15 +409,23 @@ class BESImporter(Processor):
                     upload_result().Task.Name,
                     upload_result().Task.get('LastModified')))
 
+                if site_index:
+                    with self.timer.phase('site_index'):
+                        site_index.add(B, bes_customsite,
+                                       str(upload_result().Task.Name),
+                                       upload_result().Task.ID,
+                                       upload_result().Task.get('LastModified'))
+
                 # Create summary result data
                 self.env["bes_importer_summary_result"] = {
-                    "summary_text": "The following tasks were imported into BigFix:",
-                    "report_fields": ["Task ID", "Task Name", "Site"],
+                    "summary_text": SUMMARY_TEXT,
+                    "report_fields": REPORT_FIELDS,
 
                     "data": {
                         "Task ID": str(upload_result().Task.ID),
                         "Task Name": str(upload_result().Task.Name),
                         "Site": str(bes_customsite),
+                        "Result": "Created",
                     }
                 }
 
@@ -181,6 +433,10 @@ class BESImporter(Processor):
                 self.output("Duplicate task, skipping import.")
                 self.env['bes_id'] = None
 
+        self.env['bes_api_latency'] = latency_stats()
+        self.output("REST API latency: %s" % self.env['bes_api_latency'],
+                    verbose_level=2)
+
 if __name__ == "__main__":
     processor = BESImporter()
     processor.execute_shell()
@@ -16,12 +16,21 @@ Adding support for python3
 """
 from __future__ import absolute_import
 
-import hashlib
 import os
-import subprocess
+import sys
 
 from autopkglib import Processor, ProcessorError
 
+# Shared BES helper modules live in BESHelpers next to the processors, out
+# of the directory autopkglib loads every .py file from as a processor.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'BESHelpers'))
+from BESHashing import hash_file, cached_hash_file
+from BESQnA import get_pool, DEFAULT_TIMEOUT, RelevanceCache
+from BESCache import shared_cache_dir
+from BESProfile import profiled, PROFILE_INPUTS, PROFILE_OUTPUTS
+from BESTimings import timed, NULL_TIMER, TIMING_INPUTS, TIMING_OUTPUTS
+
 __all__ = ["BESRelevanceProvider"]
 
 QNA = '/usr/local/bin/QnA'
@@ -39,6 +48,44 @@ class BESRelevanceProvider(Processor):
             "description":
                 "A line of relevance to evaluate in QnA and return the result."
         },
+        "bes_qna_path": {
+            "required": False,
+            "description":
+                "Path to the QnA utility, defaults to /usr/local/bin/QnA."
+        },
+        "bes_qna_timeout": {
+            "required": False,
+            "description":
+                "Seconds to wait for each QnA answer, defaults to 30."
+        },
+        "bes_relevance_cache": {
+            "required": False,
+            "description": (
+                "Reuse earlier results for %bes_relevance% while the files "
+                "it names are unchanged, defaults to False.")
+        },
+        "bes_relevance_cache_key": {
+            "required": False,
+            "description": (
+                "Explicit cache key for %bes_relevance%, used instead of "
+                "the fingerprints of the files it names.")
+        },
+        "bes_relevance_cache_ttl": {
+            "required": False,
+            "description":
+                "Seconds a cached relevance result stays valid, defaults to 86400."
+        },
+        "bes_relevance_cache_dir": {
+            "required": False,
+            "description":
+                "Directory for the relevance result cache, defaults to %RECIPE_CACHE_DIR%."
+        },
+        "bes_digest_cache_dir": {
+            "required": False,
+            "description": (
+                "Directory for the persistent sha1/sha256/size cache, "
+                "defaults to %RECIPE_CACHE_DIR%. Set to '' to disable.")
+        },
         "output_var_name": {
             "required": False,
             "description":
@@ -63,69 +110,83 @@ class BESRelevanceProvider(Processor):
                 "The resulting file size of the %bes_filepath%."
         },
     }
+    input_variables.update(TIMING_INPUTS)
+    output_variables.update(TIMING_OUTPUTS)
+    input_variables.update(PROFILE_INPUTS)
+    output_variables.update(PROFILE_OUTPUTS)
     __doc__ = description
 
+    timer = NULL_TIMER
+
+    def get_relevance_cache(self):
+        """
+        Return the relevance result cache, or None unless it is enabled.
+        """
+        if str(self.env.get("bes_relevance_cache", False)) not in ['True', 'true']:
+            return None
+
+        cache_dir = shared_cache_dir(self.env, "bes_relevance_cache_dir")
+        if not cache_dir:
+            return None
+
+        return RelevanceCache(cache_dir, ttl=float(self.env.get(
+            "bes_relevance_cache_ttl", RelevanceCache.DEFAULT_TTL)))
+
     def eval_relevance(self, relevance):
         # Evaluate Relevance Expression
+        qna = self.env.get("bes_qna_path", QNA)
+        cache = self.get_relevance_cache()
+        cache_key = self.env.get("bes_relevance_cache_key", None)
         try:
-            proc = subprocess.Popen(QNA, bufsize=-1,
-                                    stdin=subprocess.PIPE,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE)
-            out, err = proc.communicate(relevance.encode())
-
-            output = {}
-            for line in out.decode().strip().split('\n'):
-                line_split = line.split(': ')
-                output[line_split[0]] = ''.join(line_split[1:])
-
-            if output.get('E', None):
+            result = cache.lookup(relevance, cache_key) if cache else None
+
+            if result is None:
+                result = get_pool(qna, timeout=float(
+                    self.env.get("bes_qna_timeout", DEFAULT_TIMEOUT))).evaluate(relevance)
+                if cache:
+                    cache.store(result, cache_key)
+            else:
+                self.output("Using cached relevance result", verbose_level=2)
+
+            if result.error:
                 self.output("Relevance Error: {%s} -- %s" %
-                            (relevance, output.get('E')))
+                            (relevance, result.error))
                 return None
+            elif result.answers:
+                return result.answers[-1]
             else:
-                return output.get('A', None)
+                return None
         except BaseException as error:
-            self.output("QnA Error: (%s) -- %s" % (QNA, error))
+            self.output("QnA Error: (%s) -- %s" % (qna, error))
             return None
 
-    #https://stackoverflow.com/questions/22058048/hashing-a-file-in-python
     def sha256sum(self, filename):
-        h  = hashlib.sha256()
-        with open(filename, 'rb') as file:
-            while True:
-                # Reading is buffered, so we can read smaller chunks.
-                chunk = file.read(h.block_size)
-                if not chunk:
-                    break
-                h.update(chunk)
-        return h.hexdigest()
-    
+        return hash_file(filename, ('sha256',))['sha256']
+
     def sha1sum(self, filename):
-        h  = hashlib.sha1()
-        with open(filename, 'rb') as file:
-            while True:
-                # Reading is buffered, so we can read smaller chunks.
-                chunk = file.read(h.block_size)
-                if not chunk:
-                    break
-                h.update(chunk)
-        return h.hexdigest()
+        return hash_file(filename, ('sha1',))['sha1']
 
+    @profiled
+    @timed
     def main(self):
         # Assign BES Console Variables
         bes_filepath = self.env.get("bes_filepath", None)
         bes_relevance = self.env.get("bes_relevance", None)
 
-        if not os.path.isfile(QNA):
+        qna = self.env.get("bes_qna_path", QNA)
+        if not os.path.isfile(qna):
             self.output("QnA utility not found at [%s]."
-                        "\n\n Run `autopkg install QnA`" % QNA)
+                        "\n\n Run `autopkg install QnA`" % qna)
 
         if bes_filepath and os.path.isfile(bes_filepath):
 
-            self.env['bes_sha1'] = self.sha1sum(bes_filepath)
-            self.env['bes_size'] = str(os.path.getsize(bes_filepath))
-            self.env['bes_sha256'] = self.sha256sum(bes_filepath)
+            with self.timer.phase('hash'):
+                digests = cached_hash_file(bes_filepath, shared_cache_dir(
+                    self.env, "bes_digest_cache_dir"))
+
+            self.env['bes_sha1'] = digests['sha1']
+            self.env['bes_size'] = str(digests['size'])
+            self.env['bes_sha256'] = digests['sha256']
             self.env['bes_sha1_short'] = str(self.env.get("bes_sha1"))[-5:]
 
             self.output("bes_sha1 = %s, bes_size = %s, "
@@ -139,7 +200,8 @@ class BESRelevanceProvider(Processor):
             output_var_name = self.env.get("output_var_name",
                                            "bes_relevance_result")
             self.output(bes_relevance)
-            relevance_result = self.eval_relevance(bes_relevance)
+            with self.timer.phase('qna'):
+                relevance_result = self.eval_relevance(bes_relevance)
 
             if relevance_result is not None:
                 self.env[output_var_name] = relevance_result
@@ -8,11 +8,12 @@ BESTemplater.py
 
 Created by Matt Hansen (mah60@psu.edu) on 2015-04-30.
 
-AutoPkg Processor for importing tasks using the BigFix RESTAPI
+AutoPkg Processor for rendering tasks from Jinja2 templates
 
 Updated by Rusty Myers (rzm102@psu.edu) on 2020-02-21.
 
-Work in progress. Does not support Python3.
+Templates are compiled once per process and cached on disk by BESRender;
+see BESRender.py to render many recipes at once.
 """
 from __future__ import absolute_import
 import os
@@ -20,8 +21,17 @@ import sys
 
 from autopkglib import Processor, ProcessorError
 
+# Shared BES helper modules live in BESHelpers next to the processors, out
+# of the directory autopkglib loads every .py file from as a processor.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'BESHelpers'))
+from BESRender import render_task, template_search_path
+from BESProfile import profiled, PROFILE_INPUTS, PROFILE_OUTPUTS
+from BESTimings import timed, NULL_TIMER, TIMING_INPUTS, TIMING_OUTPUTS
+
 __all__ = ["BESTemplater"]
 
+
 class BESTemplater(Processor):
     """AutoPkg Processor for rendering tasks from templates"""
     description = "Generates BigFix XML to install application."
@@ -31,6 +41,13 @@ class BESTemplater(Processor):
             "description":
                 "Name of template file."
         },
+        "bes_template_cache_dir": {
+            "required": False,
+            "description": (
+                "Directory for compiled templates, shared by all recipes. "
+                "Defaults to the parent of %RECIPE_CACHE_DIR%. Set to '' "
+                "to disable.")
+        },
     }
     output_variables = {
         "bes_file": {
@@ -38,51 +55,36 @@ class BESTemplater(Processor):
                 "The resulting BES task rendered from the template."
         },
     }
+    input_variables.update(TIMING_INPUTS)
+    output_variables.update(TIMING_OUTPUTS)
+    input_variables.update(PROFILE_INPUTS)
+    output_variables.update(PROFILE_OUTPUTS)
     __doc__ = description
 
+    timer = NULL_TIMER
 
+    @profiled
+    @timed
     def main(self):
-        """BESImporter Main Method"""
-        
-        # http://stackoverflow.com/a/14150750/2626090
-        uppath = lambda _path, n: os.sep.join(_path.split(os.sep)[:-n])
+        """BESTemplater Main Method"""
 
         try:
-            from jinja2 import Environment, ChoiceLoader, FileSystemLoader
+            from jinja2 import TemplateNotFound
         except ImportError as err:
             raise ProcessorError("jinja2 module is not installed: %s" % err)
-        
-        # Assign variables
-        template_name = self.env.get("template_name")
-        name = self.env.get("NAME")
-        version = self.env.get("version")
-        RECIPE_DIR = self.env.get("RECIPE_DIR")
-        BES_TEMPLATES = self.env.get("BES_TEMPLATES")
-        
-        jinja_env = Environment(loader = ChoiceLoader([
-            FileSystemLoader(os.getcwd()),
-            FileSystemLoader('templates'),
-            FileSystemLoader(os.path.join(RECIPE_DIR, 'templates')),
-            FileSystemLoader(os.path.join(uppath(RECIPE_DIR, 1), 'templates')),
-            FileSystemLoader(os.path.join(uppath(RECIPE_DIR, 2), 'Templates')),
-            FileSystemLoader(BES_TEMPLATES)
-        ]))
-        
-        template_task = jinja_env.get_template(template_name)
-        # print jinja_env.list_templates()
-        rendered_task = template_task.render(**self.env)
-        
-        # Write Final BES File to Disk
-        outputfile_handle = open("%s/Deploy %s %s.bes" %
-                                 (self.env.get("RECIPE_CACHE_DIR"),
-                                  name, version), "wb")
 
-        outputfile_handle.write(rendered_task)
-        outputfile_handle.close()
+        try:
+            bes_file, _ = render_task(self.env, timer=self.timer)
+        except TemplateNotFound as err:
+            raise ProcessorError("Template %s not found in: %s" % (
+                err.name, ', '.join(template_search_path(
+                    self.env.get("RECIPE_DIR"), self.env.get("BES_TEMPLATES")))))
+        except ValueError as err:
+            raise ProcessorError(err)
 
-        self.env['bes_file'] = outputfile_handle.name
+        self.env['bes_file'] = bes_file
         self.output("Output BES File: '%s'" % self.env.get("bes_file"))
 
 if __name__ == "__main__":
-    processor = BESImporter()
+    processor = BESTemplater()
     processor.execute_shell()
@@ -17,14 +17,33 @@ Adding support for python3
 """
 from __future__ import absolute_import
 
-import os, ssl
-import urllib
-import base64
+import os
 import sys
+import time
+import threading
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
 from xml.dom import minidom
 
+import requests
 from autopkglib import Processor, ProcessorError
 
+# Shared BES helper modules live in BESHelpers next to the processors, out
+# of the directory autopkglib loads every .py file from as a processor.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'BESHelpers'))
+import BESHTTP
+from BESCache import JSONCache, shared_cache_dir
+from BESConnections import get_connection, latency_stats
+from BESHashing import HashingReader, DigestCache, BLOCK_SIZE, cached_hash_file
+from BESProfile import profiled, PROFILE_INPUTS, PROFILE_OUTPUTS
+from BESTimings import timed, NULL_TIMER, TIMING_INPUTS, TIMING_OUTPUTS
+
+try:
+    requests.packages.urllib3.disable_warnings()
+except:
+    pass
+
 __all__ = ["BESUploader"]
 
 class BESUploader(Processor):
@@ -56,6 +75,53 @@ class BESUploader(Processor):
             "description":
                 "Filename to use in prefetch statement. Defaults to /$sha1/$filename"
         },
+        "bes_http_timeout": {
+            "required": False,
+            "description": (
+                "Seconds to wait on the console, either 'read' or "
+                "'connect,read'. Defaults to 10,60.")
+        },
+        "bes_upload_chunk_size": {
+            "required": False,
+            "description": (
+                "Bytes read from disk and sent per chunk while streaming the "
+                "upload, defaults to 1048576. This bounds upload memory use.")
+        },
+        "bes_upload_check_existing": {
+            "required": False,
+            "description": (
+                "Ask the console whether a file with the same sha1 and name "
+                "was already uploaded and skip the transfer if so, defaults "
+                "to False.")
+        },
+        "bes_upload_part_size": {
+            "required": False,
+            "description": (
+                "Split files larger than this many bytes into parts that are "
+                "uploaded concurrently and can be resumed after a failure. "
+                "Only for servers that assemble Content-Range parts POSTed "
+                "to /api/upload, which the BigFix REST API itself does not: "
+                "the first part is sent alone, and unless it is accepted "
+                "with a 202 the file is sent as a single streamed upload. "
+                "Defaults to 0, a single streamed upload.")
+        },
+        "bes_upload_workers": {
+            "required": False,
+            "description":
+                "Number of parts to upload at once, defaults to 4."
+        },
+        "bes_upload_retries": {
+            "required": False,
+            "description":
+                "Attempts per part before giving up, defaults to 3."
+        },
+        "bes_digest_cache_dir": {
+            "required": False,
+            "description": (
+                "Directory for the persistent sha1/sha256/size cache that "
+                "the upload's digests are saved to, defaults to "
+                "%RECIPE_CACHE_DIR%. Set to '' to disable.")
+        },
         "output_var_name": {
             "required": False,
             "description":
@@ -87,66 +153,313 @@ class BESUploader(Processor):
             "description":
                 "The compiled prefetch command for the uploaded file."
         },
+        "bes_api_latency": {
+            "description": (
+                "Request counts and latencies per REST API resource for this "
+                "process, e.g. {'POST upload': {'count': 1, 'mean_seconds': ...}}.")
+        },
+        "bes_upload_stats": {
+            "description": (
+                "Dictionary of the upload's bytes, seconds, "
+                "megabytes_per_second and whether it was skipped.")
+        },
     }
+    input_variables.update(TIMING_INPUTS)
+    output_variables.update(TIMING_OUTPUTS)
+    input_variables.update(PROFILE_INPUTS)
+    output_variables.update(PROFILE_OUTPUTS)
     __doc__ = description
 
-    def send_api_request(self, api_url, auth_string, bes_file=None):
+    timer = NULL_TIMER
+
+    def report_progress(self, bytes_read, size):
+        """Print upload progress every 10 percent."""
+        percent = 100 * bytes_read // size if size else 100
+        if percent >= self.next_progress:
+            self.output("Uploaded %d%% (%d of %d bytes)" % (percent,
+                                                           bytes_read, size))
+            self.next_progress = percent - percent % 10 + 10
+
+    def api_request(self, method, path, **kwargs):
+        """
+        Send a request for an API path on the shared, authenticated
+        console connection.
+        """
+        kwargs.setdefault('verify', self.connection.verify)
+        kwargs.setdefault('timeout', BESHTTP.parse_timeout(
+            self.env.get("bes_http_timeout")))
+        return self.connection.session.request(method,
+                                               self.connection.url(path),
+                                               **kwargs)
+
+    def find_existing_upload(self, file_path, sha1):
+        """
+        Return the console's FileUpload XML for an earlier upload of
+        file_path with the same sha1, or None if there is none.
+        """
+        path = "upload/%s/%s" % (sha1, quote(os.path.basename(file_path)))
+        try:
+            response = self.api_request('GET', path)
+        except requests.exceptions.RequestException as error:
+            self.output("Could not check for an existing upload: %s" % error)
+            return None
+
+        if response.status_code != 200 or b'<FileUpload' not in response.content:
+            return None
+
+        # Only trust a record for exactly this content
+        try:
+            result_dom = minidom.parseString(response.content)
+            result_sha1 = result_dom.getElementsByTagName('SHA1')[-1]
+        except Exception:
+            return None
+        if result_sha1.firstChild.nodeValue.lower() != sha1:
+            return None
+
+        return response.content
+
+    def send_api_request(self, path, bes_file=None, bes_data=None):
         """Send generic BES API request"""
         # self.output("Sending BES API Request")
-        request = urllib.request(api_url)
-
-        request.add_header("Authorization", "Basic %s" % auth_string)
-        request.add_header("Content-Type", "application/xml")
+        headers = {
+            "Content-Type": "application/xml",
+        }
 
-        # Read bes_file contents and add to request
+        # Stream bes_file contents from disk, one chunk at a time
         if bes_file:
-            bes_data = open(bes_file).read()
-            request.data(bes_data)
-            request.add_header("Content-Disposition",
-                               'attachment; filename="%s"' %
-                               os.path.basename(bes_file))
+            if bes_data is None:
+                bes_data = HashingReader(bes_file)
+            headers["Content-Disposition"] = ('attachment; filename="%s"' %
+                                              os.path.basename(bes_file))
 
         # Request POST to Console API
         try:
-            # self.output(request.get_full_url())
-            # self.output(request.get_method())
-            # self.output(request)
-            return urllib.request.urlopen(request)
+            response = self.api_request('POST' if bes_file else 'GET', path,
+                                        data=bes_data, headers=headers)
+            response.raise_for_status()
+            return response
+
+        except requests.exceptions.HTTPError as error:
+            raise ProcessorError("HTTPError: [%s] %s" % (
+                error.response.status_code, error.response.text))
+        except requests.exceptions.RequestException as error:
+            raise ProcessorError("URLError: %s" % (error,))
+
+    def upload_parts(self, file_path, digests, part_size):
+        """
+        Upload file_path in part_size ranges over a bounded pool of
+        connections. Finished parts are checkpointed to a state file in
+        RECIPE_CACHE_DIR so an interrupted upload resumes where it stopped.
+        Returns the console's FileUpload XML for the completed file and
+        the number of bytes sent by this run, or None if the server does
+        not take multi-part uploads.
+
+        A fresh upload starts with the first part alone. A server that
+        assembles parts answers it with a 202; one that does not either
+        rejects it or stores it as a whole upload, and the caller falls
+        back to a single upload instead of sending every part in vain.
+        """
+        size = digests['size']
+        file_name = os.path.basename(file_path)
+        workers = int(self.env.get("bes_upload_workers", 4))
+        retries = max(1, int(self.env.get("bes_upload_retries", 3)))
+        parts = [(offset // part_size, offset, min(part_size, size - offset))
+                 for offset in range(0, size, part_size)]
+
+        # Resume from the state file if it describes this exact upload
+        state_dir = self.env.get("RECIPE_CACHE_DIR")
+        state = JSONCache(state_dir, 'bes_upload_state.json') if state_dir else None
+        state_key = os.path.abspath(file_path)
+        done = set()
+        if state:
+            saved = state.get(state_key)
+            if (saved and saved.get('sha1') == digests['sha1'] and
+                    saved.get('part_size') == part_size):
+                done = set(saved.get('done', []))
+        pending = [part for part in parts if part[0] not in done]
+        bytes_sent = sum(part[2] for part in pending)
+
+        if done:
+            self.output("Resuming upload: %d of %d parts already sent" % (
+                len(done), len(parts)))
+
+        lock = threading.Lock()
+
+        def send_part(part):
+            index, offset, length = part
+            headers = {
+                "Content-Type": "application/octet-stream",
+                "Content-Disposition": 'attachment; filename="%s"' % file_name,
+                "Content-Range": "bytes %d-%d/%d" % (offset,
+                                                     offset + length - 1, size),
+                "X-File-SHA1": digests['sha1'],
+            }
+            for attempt in range(retries):
+                try:
+                    response = self.api_request(
+                        'POST', 'upload', headers=headers,
+                        data=HashingReader(file_path, algorithms=(),
+                                           offset=offset, length=length))
+                    # Only retry what may pass: dropped connections and
+                    # server errors other than 501 Not Implemented
+                    if response.status_code < 500 or response.status_code == 501:
+                        return response
+                    response.raise_for_status()
+                except requests.exceptions.RequestException as error:
+                    self.output("Part %d failed (attempt %d of %d): %s" % (
+                        index + 1, attempt + 1, retries, error))
+                    if attempt + 1 == retries:
+                        raise
+                    time.sleep(0.5 * 2 ** attempt)
+
+        def record_part(part):
+            index = part[0]
+            with lock:
+                done.add(index)
+                if state:
+                    state.put(state_key, {'sha1': digests['sha1'],
+                                          'part_size': part_size,
+                                          'done': sorted(done)})
+                self.output("Uploaded part %d of %d" % (len(done), len(parts)))
+
+        def upload_part(part):
+            send_part(part).raise_for_status()
+            record_part(part)
+
+        if not done:
+            try:
+                response = send_part(pending[0])
+            except requests.exceptions.RequestException as error:
+                raise ProcessorError("Upload of %s failed: %s" % (file_path,
+                                                                  error))
+            if response.status_code != 202:
+                self.output("The server answered the first part of %s with "
+                            "HTTP %d, not 202, so it does not take multi-part "
+                            "uploads." % (file_path, response.status_code))
+                return None
+            record_part(pending[0])
+            pending = pending[1:]
+
+        executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        futures = [executor.submit(upload_part, part) for part in pending]
+        try:
+            for future in futures:
+                future.result()
+        except requests.exceptions.RequestException as error:
+            # Parts already in flight finish and are checkpointed
+            for future in futures:
+                future.cancel()
+            raise ProcessorError(
+                "Upload of %s stopped with %d of %d parts sent, run again to "
+                "resume: %s" % (file_path, len(done), len(parts), error))
+        finally:
+            executor.shutdown(wait=True)
+
+        upload_content = self.find_existing_upload(file_path, digests['sha1'])
+        if upload_content is None:
+            raise ProcessorError("All parts of %s were sent but the console "
+                                 "has no matching upload." % file_path)
 
+        if state:
+            state.delete(state_key)
 
-        except urllib.error.HTTPError as error:
-            self.output("HTTPError: [%s] %s" % (error.code, error.read()))
-            sys.exit(1)
-        except urllib.error.URLError as error:
-            self.output("URLError: %s" % (error.args))
-            sys.exit(1)
+        return upload_content, bytes_sent
 
+    @profiled
+    @timed
     def main(self):
         """BESUploader Main Method"""
-        
-        # Disable ssl warnings
-        if (not os.environ.get('PYTHONHTTPSVERIFY', '') and
-            getattr(ssl, '_create_unverified_context', None)): 
-            ssl._create_default_https_context = ssl._create_unverified_context
-            
+
         # Assign Console Variables
         bes_uploadpath = self.env.get("bes_uploadpath")
-        BES_ROOTSERVER = self.env.get("BES_ROOTSERVER").encode('ascii')
+        BES_ROOTSERVER = self.env.get("BES_ROOTSERVER")
         BES_USERNAME = self.env.get("BES_USERNAME")
         BES_PASSWORD = self.env.get("BES_PASSWORD")
 
+        # Console Connection, shared with other processors in this run.
+        # Verify only when PYTHONHTTPSVERIFY is set, as before.
+        with self.timer.phase('connect'):
+            self.connection = get_connection(
+                BES_ROOTSERVER, BES_USERNAME, BES_PASSWORD,
+                verify=bool(os.environ.get('PYTHONHTTPSVERIFY', '')))
+
         self.output("Uploading: %s to %s" % (bes_uploadpath,
-                                             BES_ROOTSERVER + '/api/upload'))
+                                             self.connection.url('upload')))
+        identity = DigestCache.identity(bes_uploadpath)
+        cache_dir = shared_cache_dir(self.env, "bes_digest_cache_dir")
+        local_digests = None
+        upload_content = None
+        skipped = False
+
+        # Pre-flight, skip the transfer if the console already has the file
+        if str(self.env.get("bes_upload_check_existing", False)) in ['True', 'true']:
+            with self.timer.phase('hash'):
+                local_digests = cached_hash_file(bes_uploadpath, cache_dir)
+            with self.timer.phase('find_existing'):
+                upload_content = self.find_existing_upload(
+                    bes_uploadpath, local_digests['sha1'])
+            if upload_content is not None:
+                skipped = True
+                self.output("Found existing upload with sha1:%s, "
+                            "skipping transfer." % local_digests['sha1'])
+                self.env['bes_upload_stats'] = {
+                    'bytes': 0,
+                    'seconds': 0,
+                    'megabytes_per_second': 0,
+                    'skipped': True,
+                }
+
+        part_size = int(self.env.get("bes_upload_part_size", 0))
+        upload_size = os.path.getsize(bes_uploadpath)
 
-        # Console Connection Strings
-        auth_string = base64.encodestring('%s:%s' %
-                                          (BES_USERNAME, BES_PASSWORD)).strip()
-        # Send Request
-        upload_request = self.send_api_request(BES_ROOTSERVER + "/api/upload",
-                                               auth_string, bes_uploadpath)
+        if upload_content is None and part_size and upload_size > part_size:
+            # Send Request as resumable parts
+            if local_digests is None:
+                with self.timer.phase('hash'):
+                    local_digests = cached_hash_file(bes_uploadpath, cache_dir)
+
+            start = time.time()
+            with self.timer.phase('upload'):
+                uploaded = self.upload_parts(bes_uploadpath, local_digests,
+                                             part_size)
+            elapsed = max(time.time() - start, 1e-6)
+            if uploaded is None:
+                self.output("Sending %s as a single upload instead." %
+                            bes_uploadpath)
+            else:
+                upload_content, bytes_sent = uploaded
+
+        if upload_content is None:
+            # Send Request, hashing the file as it is streamed
+            self.next_progress = 10
+            upload_data = HashingReader(
+                bes_uploadpath,
+                block_size=int(self.env.get("bes_upload_chunk_size", BLOCK_SIZE)),
+                progress=self.report_progress)
+
+            start = time.time()
+            with self.timer.phase('upload'):
+                upload_request = self.send_api_request("upload", bes_uploadpath,
+                                                       upload_data)
+            elapsed = max(time.time() - start, 1e-6)
+            local_digests = upload_data.digests()
+            upload_content = upload_request.content
+            bytes_sent = local_digests['size']
+
+        if not skipped:
+            self.env['bes_upload_stats'] = {
+                'bytes': bytes_sent,
+                'seconds': round(elapsed, 3),
+                'megabytes_per_second': round(
+                    bytes_sent / elapsed / (1024 * 1024), 2),
+                'skipped': False,
+            }
+            self.output("Uploaded %(bytes)d bytes in %(seconds).2fs "
+                        "(%(megabytes_per_second).2f MB/s)" %
+                        self.env['bes_upload_stats'])
 
         #Read and Parse Console Return
-        result_dom = minidom.parseString(upload_request.read())
+        result_dom = minidom.parseString(upload_content)
         result_upload = result_dom.getElementsByTagName('FileUpload') or []
         result_name = result_upload[-1].getElementsByTagName('Name')
         result_url = result_upload[-1].getElementsByTagName('URL')
@@ -165,6 +478,24 @@ class BESUploader(Processor):
         self.env['bes_uploadsha1'] = result_sha1[-1].firstChild.nodeValue
         self.env['bes_uploadsha256'] = result_sha256[-1].firstChild.nodeValue
 
+        # Check the console's digests against the ones computed while sending
+        if (self.env['bes_uploadsha1'].lower() != local_digests['sha1'] or
+                self.env['bes_uploadsha256'].lower() != local_digests['sha256']):
+            raise ProcessorError(
+                "Upload digest mismatch for %s: sent sha1:%s sha256:%s, "
+                "console reports sha1:%s sha256:%s" % (
+                    bes_uploadpath, local_digests['sha1'],
+                    local_digests['sha256'], self.env['bes_uploadsha1'],
+                    self.env['bes_uploadsha256']))
+
+        # Save the digests so later processors need not hash the file again
+        if cache_dir and DigestCache.identity(bes_uploadpath) == identity:
+            try:
+                DigestCache(cache_dir).put(bes_uploadpath, local_digests,
+                                           identity)
+            except (IOError, OSError):
+                pass
+
         self.env['bes_prefetch'] = (
             "prefetch %s sha1:%s size:%s %s sha256:%s" % (
                 bes_filename,
@@ -192,6 +523,10 @@ class BESUploader(Processor):
                     (output_var_name,
                      self.env.get(output_var_name)))
 
+        self.env['bes_api_latency'] = latency_stats()
+        self.output("REST API latency: %s" % self.env['bes_api_latency'],
+                    verbose_level=2)
+
 if __name__ == "__main__":
     processor = BESUploader()
     processor.execute_shell()
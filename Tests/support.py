@@ -0,0 +1,75 @@
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+support.py
+
+Shared setup for the tests: makes the processors, their helpers and the
+stand-ins in Benchmarks importable, with BESFleet's autopkglib stand-in
+when AutoPkg is not installed.
+"""
+from __future__ import absolute_import
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, os.pardir)
+for path in ('Benchmarks', os.path.join('Code', 'BESHelpers'), 'Code'):
+    sys.path.insert(0, os.path.join(ROOT, path))
+
+from BESFleet import install_processor_shim
+install_processor_shim()
+
+from stub_bigfix import start_server
+
+FAKE_QNA = os.path.join(ROOT, 'Benchmarks', 'fake_qna.py')
+
+BES_TEMPLATE = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<BES xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    'xsi:noNamespaceSchemaLocation="BES.xsd"><Task>'
+    '<Title>%s</Title><Description>Test</Description>'
+    '<Relevance>true</Relevance></Task></BES>')
+
+
+def quiet(processor):
+    """Keep a processor's output out of the test report."""
+    processor.output = lambda *args, **kwargs: None
+    return processor
+
+
+class StubTestCase(unittest.TestCase):
+    """Runs each test against a fresh stub_bigfix server and work directory."""
+
+    def setUp(self):
+        self.server, self.base = start_server()
+        self.state = self.server.state
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.work_dir)
+
+    def credentials(self, **env):
+        env.update(BES_USERNAME='test', BES_PASSWORD='test',
+                   BES_ROOT_SERVER=self.base, BES_ROOTSERVER=self.base)
+        return env
+
+    def write_bes(self, title, name=None):
+        """Write a one-task .bes file and return its path."""
+        path = os.path.join(self.work_dir, name or '%s.bes' % title)
+        with open(path, 'w') as file_handle:
+            file_handle.write(BES_TEMPLATE % title)
+        return path
+
+    def write_file(self, name, content):
+        path = os.path.join(self.work_dir, name)
+        with open(path, 'wb') as file_handle:
+            file_handle.write(content)
+        return path
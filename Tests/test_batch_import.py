@@ -0,0 +1,167 @@
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+test_batch_import.py
+
+BESBatchImport and BESImporter's batch mode against stub_bigfix.py: IDs
+mapped back to the file each item came from, the one-at-a-time fallback
+after the console rejects a merged payload, and no second POST after it
+accepts one with a reply that cannot be mapped.
+"""
+from __future__ import absolute_import
+
+import os
+import unittest
+
+from support import StubTestCase, quiet
+
+from autopkglib import ProcessorError
+from BESBatchImport import import_files, read_bes_file
+from BESConnections import get_connection
+from BESImporter import BESImporter
+
+SITE = 'Test'
+
+TWO_TASKS = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<BES xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    'xsi:noNamespaceSchemaLocation="BES.xsd">'
+    '<Task><Title>%s</Title></Task><Task><Title>%s</Title></Task></BES>')
+
+
+class BatchImportTest(StubTestCase):
+
+    def setUp(self):
+        super(BatchImportTest, self).setUp()
+        self.state.sites[SITE] = []
+        self.connection = get_connection(self.base, 'test', 'test')
+
+    def write_two_tasks(self, name, first, second):
+        path = os.path.join(self.work_dir, name)
+        with open(path, 'w') as file_handle:
+            file_handle.write(TWO_TASKS % (first, second))
+        return path
+
+    def site_titles(self):
+        return dict((str(task['id']), task['name'])
+                    for task in self.state.sites[SITE])
+
+    def assertMapped(self, result, titles):
+        site_titles = self.site_titles()
+        self.assertEqual(result['result'], 'Created')
+        self.assertEqual([site_titles[task_id] for task_id in result['ids']],
+                         titles)
+        self.assertEqual(result['names'], titles)
+
+    def import_files_with_importer(self, paths):
+        importer = quiet(BESImporter(self.credentials(
+            bes_files=paths, bes_customsite=SITE,
+            bes_site_index_dir=os.path.join(self.work_dir, 'index'))))
+        importer.main()
+        return importer
+
+    def test_ids_map_to_their_files(self):
+        files = [(self.write_bes('App %d' % number), ['App %d' % number])
+                 for number in range(5)]
+        files.insert(2, (self.write_two_tasks('Two.bes', 'Two 1', 'Two 2'),
+                         ['Two 1', 'Two 2']))
+
+        results = import_files(self.connection, SITE,
+                               [path for path, _ in files])
+
+        self.assertEqual(self.state.import_posts, 1)
+        self.assertEqual(len(results), len(files))
+        for result, (path, titles) in zip(results, files):
+            self.assertEqual(result['file'], path)
+            self.assertMapped(result, titles)
+
+    def test_batches_stay_under_max_bytes(self):
+        paths = [self.write_bes('App %d' % number, 'a%d.bes' % number)
+                 for number in range(6)]
+        # Room for the items of two files per POST
+        size = read_bes_file(paths[0]).size
+
+        results = import_files(self.connection, SITE, paths,
+                               max_bytes=2 * size)
+
+        self.assertEqual(self.state.import_posts, 3)
+        for number, result in enumerate(results):
+            self.assertMapped(result, ['App %d' % number])
+
+    def test_rejected_batch_falls_back_to_single_files(self):
+        paths = [self.write_bes('App %d' % number, 'a%d.bes' % number)
+                 for number in range(4)]
+        paths[2] = self.write_bes('App 2 INVALID', 'a2.bes')
+
+        results = import_files(self.connection, SITE, paths)
+
+        # The merged POST, then one per file
+        self.assertEqual(self.state.import_posts, 5)
+        self.assertEqual([result['result'] for result in results],
+                         ['Created', 'Created', 'Failed', 'Created'])
+        self.assertIn('HTTP 400', results[2]['error'])
+        for number in (0, 1, 3):
+            self.assertMapped(results[number], ['App %d' % number])
+        self.assertEqual(len(self.state.sites[SITE]), 3)
+
+    def test_unmapped_response_is_not_posted_again(self):
+        paths = [self.write_bes('App %d' % number, 'a%d.bes' % number)
+                 for number in range(3)]
+        self.state.drop_import_ids = 1
+
+        results = import_files(self.connection, SITE, paths)
+
+        self.assertEqual(self.state.import_posts, 1)
+        self.assertEqual(len(self.state.sites[SITE]), 3)
+        for result in results:
+            self.assertEqual(result['result'], 'Failed')
+            self.assertIn('IDs unknown', result['error'])
+
+    def test_existing_titles_are_skipped(self):
+        paths = [self.write_bes('App %d' % number, 'a%d.bes' % number)
+                 for number in range(3)]
+
+        results = import_files(self.connection, SITE, paths,
+                               existing_titles={'App 1': ['99', None]})
+
+        self.assertEqual([result['result'] for result in results],
+                         ['Created', 'Duplicate', 'Created'])
+        self.assertEqual(results[1]['ids'], ['99'])
+
+    def test_importer_batch_summary(self):
+        self.import_files_with_importer([self.write_bes('App 1')])
+        paths = [self.write_bes('App 1'), self.write_bes('App 2')]
+
+        importer = self.import_files_with_importer(paths)
+
+        summary = importer.env['bes_importer_summary_result']
+        self.assertEqual(summary['report_fields'],
+                         ['Task ID', 'Task Name', 'Site', 'Result'])
+        site_titles = self.site_titles()
+        self.assertEqual(summary['data']['Task Name'], 'App 1, App 2')
+        self.assertEqual(
+            [site_titles[task_id]
+             for task_id in summary['data']['Task ID'].split(', ')],
+            ['App 1', 'App 2'])
+        self.assertEqual(summary['data']['Site'], SITE)
+        self.assertEqual(summary['data']['Result'], 'Duplicate, Created')
+
+    def test_importer_batch_mode(self):
+        good = self.write_bes('App 1')
+        bad = self.write_bes('App 2 INVALID')
+        importer = quiet(BESImporter(self.credentials(
+            bes_files=[good, bad], bes_customsite=SITE,
+            bes_site_index_dir=os.path.join(self.work_dir, 'index'))))
+
+        with self.assertRaises(ProcessorError):
+            importer.main()
+
+        results = importer.env['bes_batch_results']
+        self.assertMapped(results[0], ['App 1'])
+        self.assertEqual(results[1]['result'], 'Failed')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+test_bes_writer.py
+
+AutoPkgBESEngine's two .bes writers: the streaming writer must produce the
+same bytes, and the same fingerprint, as the tree writer, and what they
+write validates against the schema shipped in BESHelpers.
+"""
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from lxml import etree
+
+import support  # noqa: F401 (sets up the import paths)
+
+from AutoPkgBESEngine import AutoPkgBESEngine
+from BESFingerprint import content_fingerprint, read_fingerprint
+from bench_bes_writer import make_task
+
+
+class WriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def assertSameOutput(self, task, env=None):
+        engine = AutoPkgBESEngine(env or {})
+        tree_path = os.path.join(self.work_dir, 'tree.bes')
+        stream_path = os.path.join(self.work_dir, 'stream.bes')
+
+        tree_fingerprint = engine.write_tree(tree_path, task)
+        stream_fingerprint = engine.write_stream(stream_path, task)
+
+        with open(tree_path, 'rb') as tree, open(stream_path, 'rb') as stream:
+            self.assertEqual(tree.read(), stream.read())
+        self.assertEqual(tree_fingerprint, stream_fingerprint)
+
+        # What BESImporter recomputes from the written file
+        document = etree.parse(tree_path)
+        self.assertEqual(content_fingerprint(document), tree_fingerprint)
+        self.assertEqual(read_fingerprint(document), tree_fingerprint)
+
+    def test_large_task(self):
+        self.assertSameOutput(make_task(1, 3))
+
+    def test_default_schema_is_installed_with_the_helpers(self):
+        engine = AutoPkgBESEngine({})
+        path = os.path.join(self.work_dir, 'task.bes')
+        engine.write_stream(path, make_task(1, 2))
+        engine.output = lambda *args, **kwargs: None
+
+        # Raises ProcessorError if the schema is missing or the task invalid
+        engine.validate_xsd(path)
+
+    def test_escaping_and_self_service(self):
+        task = make_task(1, 2)
+        task['title'] = u'Deploy Café & "Friends" <1.0>'
+        task['description'] = u'<b>Café</b> — tab\there & there'
+        task['relevance'] = ['version of it >= "1.0" & it < "2.0"']
+        task['ui_metadata'] = None
+        task['mime_fields'] = []
+        for action_dict, _ in task['actions']:
+            action_dict['ActionScript'] = u'echo "ü <&> \'"\nexit 0'
+        task['actions'] = [(action_dict, True)
+                           for action_dict, _ in task['actions']]
+
+        self.assertSameOutput(task, {'NAME': u'Café',
+                                     'OfferCategory': 'Apps & Tools',
+                                     'OfferDescriptionHTML': '<p>Hi</p>'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+test_build_record.py
+
+AutoPkgBESEngine's build record: an unchanged recipe reuses the .bes from
+its last run, and anything the task is built from forces a rebuild.
+"""
+from __future__ import absolute_import
+
+import os
+import plistlib
+import unittest
+
+from support import StubTestCase, quiet
+
+import BESHTTP
+from AutoPkgBESEngine import AutoPkgBESEngine
+
+
+class BuildRecordTest(StubTestCase):
+
+    def setUp(self):
+        super(BuildRecordTest, self).setUp()
+        self.state.files['App-1.0.pkg'] = b'installer'
+        self.installer = self.write_file('App-1.0.pkg', b'installer 1.0')
+
+        # Safari's User-Agent list is not there off a Mac
+        BESHTTP.user_agent(self.write_file('UserAgents.plist', plistlib.dumps(
+            [{'user-agent': 'test_build_record'}])))
+
+    def build(self, **env):
+        """Run the engine on a fresh env, as each autopkg run does."""
+        defaults = {
+            'NAME': 'App',
+            'bes_version': '1.0',
+            'url': self.base + '/download/App-1.0.pkg',
+            'pathname': self.installer,
+            'RECIPE_CACHE_DIR': self.work_dir,
+            'bes_relevance': ['mac of operating system'],
+            'bes_actions': {1: {'ActionName': 'DefaultAction',
+                                'ActionNumber': 'Action1',
+                                'ActionScript': 'echo "1.0"'}},
+        }
+        defaults.update(env)
+        engine = quiet(AutoPkgBESEngine(defaults))
+        engine.main()
+        return engine.env
+
+    def assertRebuilt(self, env, rebuilt=True):
+        self.assertEqual(env['bes_rebuilt'], rebuilt)
+        self.assertTrue(os.path.isfile(env['bes_file']))
+
+    def test_unchanged_inputs_reuse_the_file(self):
+        first = self.build()
+        self.assertRebuilt(first)
+
+        second = self.build()
+        self.assertRebuilt(second, False)
+        self.assertEqual(second['bes_file'], first['bes_file'])
+        self.assertEqual(second['bes_fingerprint'], first['bes_fingerprint'])
+
+    def test_changed_installer_rebuilds(self):
+        first = self.build()
+        self.write_file('App-1.0.pkg', b'installer 1.1')
+
+        second = self.build()
+        self.assertRebuilt(second)
+        self.assertNotEqual(second['bes_fingerprint'],
+                            first['bes_fingerprint'])
+
+    def test_changed_actions_rebuild(self):
+        self.build()
+        env = self.build(bes_actions={1: {'ActionName': 'DefaultAction',
+                                          'ActionNumber': 'Action1',
+                                          'ActionScript': 'echo "1.1"'}})
+        self.assertRebuilt(env)
+
+    def test_edited_file_rebuilds(self):
+        bes_file = self.build()['bes_file']
+        with open(bes_file, 'r') as file_handle:
+            content = file_handle.read()
+        # The fingerprint field still matches after this edit
+        with open(bes_file, 'w') as file_handle:
+            file_handle.write(content.replace('Deploy App 1.0',
+                                              'Deploy App 1.0 (edited)'))
+
+        env = self.build()
+        self.assertRebuilt(env)
+        with open(bes_file, 'r') as file_handle:
+            self.assertEqual(file_handle.read().count('(edited)'), 0)
+
+    def test_deleted_file_rebuilds(self):
+        os.remove(self.build()['bes_file'])
+        self.assertRebuilt(self.build())
+
+    def test_force_rebuild(self):
+        self.build()
+        self.assertRebuilt(self.build(bes_force_rebuild='True'))
+
+
+if __name__ == '__main__':
+    unittest.main()
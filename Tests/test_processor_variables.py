@@ -0,0 +1,46 @@
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+test_processor_variables.py
+
+The inputs and outputs every BES processor shares come from the helper
+that implements them, so the five processors describe them the same way.
+"""
+from __future__ import absolute_import
+
+import unittest
+
+import support  # noqa: F401 (sets up the import paths)
+
+from AutoPkgBESEngine import AutoPkgBESEngine
+from BESImporter import BESImporter
+from BESProfile import PROFILE_INPUTS, PROFILE_OUTPUTS
+from BESRelevanceProvider import BESRelevanceProvider
+from BESTemplater import BESTemplater
+from BESTimings import TIMING_INPUTS, TIMING_OUTPUTS
+from BESUploader import BESUploader
+
+PROCESSORS = (AutoPkgBESEngine, BESImporter, BESRelevanceProvider,
+              BESTemplater, BESUploader)
+
+
+class ProcessorVariablesTest(unittest.TestCase):
+
+    def assertShared(self, inputs, outputs):
+        for processor in PROCESSORS:
+            for name, variable in inputs.items():
+                self.assertIs(processor.input_variables[name], variable)
+            for name, variable in outputs.items():
+                self.assertIs(processor.output_variables[name], variable)
+
+    def test_timing_variables(self):
+        self.assertShared(TIMING_INPUTS, TIMING_OUTPUTS)
+
+    def test_profile_variables(self):
+        self.assertShared(PROFILE_INPUTS, PROFILE_OUTPUTS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+# encoding: utf-8
+#
+# Copyright 2014 The Pennsylvania State University.
+#
+"""
+test_qna.py
+
+BESQnA's persistent sessions against fake_qna.py: answers in order,
+restarting after a crash or timeout, and how errors reach the processors.
+"""
+from __future__ import absolute_import
+
+import unittest
+
+from support import FAKE_QNA
+
+from BESQnA import QnAWorker, get_pool
+from BESRelevanceProvider import BESRelevanceProvider
+
+
+class QnAWorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.worker = QnAWorker(FAKE_QNA, timeout=5)
+
+    def tearDown(self):
+        self.worker.stop()
+
+    def test_batch_answers_in_order(self):
+        results = self.worker.evaluate(['"a"', 'true', '42'])
+        self.assertEqual([result.answers for result in results],
+                         [['a'], ['True'], ['42']])
+        self.assertFalse(any(result.error for result in results))
+
+    def test_session_is_reused(self):
+        self.worker.evaluate(['"a"'])
+        pid = self.worker.proc.pid
+        self.worker.evaluate(['"b"'])
+        self.assertEqual(self.worker.proc.pid, pid)
+
+    def test_relevance_error_is_per_expression(self):
+        results = self.worker.evaluate(['"a"', 'nonexistent thing', '"b"'])
+        self.assertEqual(results[1].answers, [])
+        self.assertIn('nonexistent object', results[1].error)
+        self.assertFalse(results[1].failed)
+        self.assertEqual(results[2].answers, ['b'])
+
+    def test_restart_after_crash(self):
+        self.worker.evaluate(['"a"'])
+        pid = self.worker.proc.pid
+        results = self.worker.evaluate(['"before"', 'fake crash', '"after"'])
+
+        self.assertEqual(results[0].answers, ['before'])
+        self.assertTrue(results[1].failed)
+        self.assertIn('status 3', results[1].error)
+        self.assertEqual(results[2].answers, ['after'])
+        self.assertNotEqual(self.worker.proc.pid, pid)
+
+    def test_restart_after_timeout(self):
+        self.worker.timeout = 0.5
+        results = self.worker.evaluate(['fake sleep 10', '"after"'])
+
+        self.assertTrue(results[0].failed)
+        self.assertIn('timed out', results[0].error)
+        self.assertEqual(results[1].answers, ['after'])
+
+
+class RelevanceProviderTest(unittest.TestCase):
+
+    def evaluate(self, relevance):
+        messages = []
+        provider = BESRelevanceProvider({'bes_qna_path': FAKE_QNA,
+                                         'bes_qna_timeout': 5,
+                                         'bes_relevance': relevance})
+        provider.output = lambda msg, verbose_level=1: messages.append(msg)
+        provider.main()
+        return provider.env['bes_relevance_result'], messages
+
+    def tearDown(self):
+        get_pool(FAKE_QNA).close()
+
+    def test_answer(self):
+        self.assertEqual(self.evaluate('"1.2.3"')[0], '1.2.3')
+
+    def test_relevance_error_is_reported(self):
+        result, messages = self.evaluate('nonexistent thing')
+        self.assertIsNone(result)
+        self.assertTrue(any(message.startswith('Relevance Error')
+                            for message in messages))
+
+    def test_crash_is_reported_and_session_recovers(self):
+        result, messages = self.evaluate('fake crash')
+        self.assertIsNone(result)
+        self.assertTrue(any('status 3' in message for message in messages))
+        self.assertEqual(self.evaluate('"next"')[0], 'next')
+
+
+if __name__ == '__main__':
+    unittest.main()
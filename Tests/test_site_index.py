@@ -0,0 +1,80 @@
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+test_site_index.py
+
+BESSiteIndex's incremental sync and BESImporter's indexed duplicate check
+against stub_bigfix.py.
+"""
+from __future__ import absolute_import
+
+import os
+import unittest
+
+from support import StubTestCase, quiet
+
+from BESConnections import get_connection
+from BESImporter import BESImporter
+from BESSiteIndex import SiteIndex
+
+SITE = 'Test'
+
+
+class SiteIndexTest(StubTestCase):
+
+    def setUp(self):
+        super(SiteIndexTest, self).setUp()
+        self.index_dir = os.path.join(self.work_dir, 'index')
+        self.state.sites[SITE] = []
+
+    def import_task(self, title):
+        """Run BESImporter for a new task titled title and return its env."""
+        importer = quiet(BESImporter(self.credentials(
+            bes_file=self.write_bes(title), bes_title=title,
+            bes_customsite=SITE, bes_site_index_dir=self.index_dir)))
+        importer.main()
+        return importer.env
+
+    def test_refresh_syncs_only_changes(self):
+        first_id = self.import_task('App 1.0')['bes_id']
+        connection = get_connection(self.base, 'test', 'test')
+        index = SiteIndex(self.index_dir)
+
+        self.state.rename_task(SITE, first_id, 'App 1.0 (old)')
+        titles = index.refresh(connection, SITE)
+
+        self.assertEqual(titles.get('App 1.0 (old)', [None])[0], first_id)
+        self.assertNotIn('App 1.0', titles)
+        self.assertEqual(self.state.requests.get('GET api/tasks'), 1)
+        self.assertTrue(self.state.requests.get('GET api/query'))
+
+    def test_renamed_task_is_not_a_duplicate(self):
+        first_id = self.import_task('App 1.0')['bes_id']
+        self.assertEqual(self.import_task('App 1.0')['bes_id'], None)
+
+        self.state.rename_task(SITE, first_id, 'App 1.0 (old)')
+        second_id = self.import_task('App 1.0')['bes_id']
+
+        self.assertIsNotNone(second_id)
+        self.assertNotEqual(second_id, first_id)
+        self.assertEqual(self.state.requests.get('GET api/tasks'), 1)
+
+    def test_stale_index_entry_is_dropped(self):
+        # Renamed in a way the incremental sync cannot see, e.g. with the
+        # server clock behind
+        first_id = self.import_task('App 1.0')['bes_id']
+        connection = get_connection(self.base, 'test', 'test')
+        index = SiteIndex(self.index_dir)
+        self.state.rename_task(SITE, first_id, 'App 1.0 (old)')
+        self.state.sites[SITE][0]['modified'] = 0
+
+        importer = quiet(BESImporter(self.credentials(
+            bes_site_index_dir=self.index_dir)))
+        self.assertIsNone(importer.find_duplicate(connection, SITE, 'App 1.0'))
+        self.assertNotIn('App 1.0', index.get(SiteIndex.key(connection, SITE)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+# encoding: utf-8
+#
+# Copyright 2013 The Pennsylvania State University.
+#
+"""
+test_uploader.py
+
+BESUploader against stub_bigfix.py: skipping files the console already
+holds, multi-part uploads with injected failures, and the fallback for
+servers without multi-part support.
+"""
+from __future__ import absolute_import
+
+import os
+import hashlib
+import unittest
+
+from support import StubTestCase, quiet
+
+from autopkglib import ProcessorError
+from BESUploader import BESUploader
+
+PART_SIZE = 64 * 1024
+
+
+class UploaderTest(StubTestCase):
+
+    def setUp(self):
+        super(UploaderTest, self).setUp()
+        self.content = os.urandom(10 * PART_SIZE + 123)
+        self.path = self.write_file('App 1.0.pkg', self.content)
+        self.recipe_cache_dir = os.path.join(self.work_dir, 'cache')
+
+    def upload(self, **env):
+        env.setdefault('bes_uploadpath', self.path)
+        env.setdefault('RECIPE_CACHE_DIR', self.recipe_cache_dir)
+        env.setdefault('bes_digest_cache_dir', '')
+        uploader = quiet(BESUploader(self.credentials(**env)))
+        uploader.main()
+        return uploader.env
+
+    def assertUploaded(self, env):
+        sha1 = hashlib.sha1(self.content).hexdigest()
+        self.assertEqual(env['bes_uploadsha1'], sha1)
+        self.assertEqual(env['bes_uploadsize'], str(len(self.content)))
+        self.assertIn((sha1, 'App 1.0.pkg'), self.state.uploads)
+
+
+class ExistingUploadTest(UploaderTest):
+
+    def test_skips_existing_upload(self):
+        self.assertUploaded(self.upload())
+        env = self.upload(bes_upload_check_existing='True')
+
+        self.assertUploaded(env)
+        self.assertTrue(env['bes_upload_stats']['skipped'])
+        self.assertEqual(self.state.requests['POST api/upload'], 1)
+        self.assertIn(hashlib.sha1(self.content).hexdigest(),
+                      env['bes_prefetch'])
+
+    def test_uploads_changed_content(self):
+        self.upload()
+        self.content = self.content[::-1]
+        self.write_file('App 1.0.pkg', self.content)
+        env = self.upload(bes_upload_check_existing='True')
+
+        self.assertUploaded(env)
+        self.assertFalse(env['bes_upload_stats']['skipped'])
+        self.assertEqual(self.state.requests['POST api/upload'], 2)
+
+    def test_check_is_off_by_default(self):
+        self.upload()
+        self.assertFalse(self.upload()['bes_upload_stats']['skipped'])
+        self.assertNotIn('GET api/upload', self.state.requests)
+
+
+class MultiPartTest(UploaderTest):
+
+    def test_parts(self):
+        env = self.upload(bes_upload_part_size=PART_SIZE)
+        self.assertUploaded(env)
+        self.assertEqual(self.state.part_requests, 11)
+        self.assertEqual(env['bes_upload_stats']['bytes'], len(self.content))
+
+    def test_resume_after_failures(self):
+        self.state.fail_parts_after = 4
+        with self.assertRaises(ProcessorError) as raised:
+            self.upload(bes_upload_part_size=PART_SIZE,
+                        bes_upload_retries=2, bes_upload_workers=1)
+        self.assertIn('run again to resume', str(raised.exception))
+        self.assertFalse(self.state.uploads)
+
+        # The four parts that arrived are not sent again
+        self.state.fail_parts_after = None
+        self.state.part_requests = 0
+        env = self.upload(bes_upload_part_size=PART_SIZE)
+        self.assertUploaded(env)
+        self.assertEqual(self.state.part_requests, 7)
+        self.assertEqual(env['bes_upload_stats']['bytes'],
+                         len(self.content) - 4 * PART_SIZE)
+
+    def test_failed_first_part_is_an_error(self):
+        self.state.fail_parts_after = 0
+        with self.assertRaises(ProcessorError):
+            self.upload(bes_upload_part_size=PART_SIZE, bes_upload_retries=2)
+        self.assertFalse(self.state.uploads)
+
+    def test_fallback_without_part_support(self):
+        self.state.accept_parts = False
+        env = self.upload(bes_upload_part_size=PART_SIZE)
+        self.assertUploaded(env)
+        # Only the first part was sent before falling back
+        self.assertEqual(self.state.requests['POST api/upload'], 2)
+        self.assertEqual(env['bes_upload_stats']['bytes'], len(self.content))
+
+
+if __name__ == '__main__':
+    unittest.main()